@@ -1,3 +1,6 @@
+import time
+BOOT_STARTED = time.perf_counter()
+
 from flask import Flask
 from flask_cors import CORS
 
@@ -8,27 +11,36 @@ from routes.auth_routes import auth_bp, init_auth_routes
 from routes.admin_routes import admin_bp, init_admin_routes
 from routes.ai_routes import ai_bp, init_ai_routes
 from routes.user_routes import user_bp, init_user_routes
-from database.db import init_database
 from routes.bookmark_routes import bookmark_bp
 from routes.review_routes import review_bp
 from database.db import init_database, init_active_ingredients
 from services.ai_engine_v2 import DataLoader
+from services.startup import Startup
 
-init_database()
-init_active_ingredients() 
+# schema / engine ไม่ทำตอน import แล้ว — create_app รันเป็น phase (ครั้งเดียวต่อ process) พร้อมจับเวลา
+startup = Startup(started=BOOT_STARTED)
+startup.mark("imports")
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
-
-        
+    app.config["STARTUP"] = startup
 
     CORS(app)
     # Register bookmark blueprint
     app.register_blueprint(bookmark_bp)
+
+    # DB ล่มตอน boot → ข้าม schema แล้วให้ engine ใช้ artifact ล่าสุด
+    if Config.INIT_DB == "true" and startup.run("schema", init_database):
+        startup.run("active_ingredients", init_active_ingredients)
+
     # Initialize services
     user_manager = UserManager()
-    ai = DataLoader()
+    ai = startup.run("engine", DataLoader)
+    if Config.CATALOG_FEED == "true":
+        startup.run("change_feed", ai.start_change_feed)
+    # sklearn / vectorizer / classifier โหลดบน background — boot จาก artifact ไม่ต้องรอ
+    startup.run("warmup", ai.warmup_async)
 
     # Initialize routes with dependencies
     init_auth_routes(user_manager)
@@ -42,7 +54,12 @@ def create_app():
     app.register_blueprint(ai_bp)
     app.register_blueprint(user_bp)
     app.register_blueprint(review_bp)
-    
+
+    @app.before_request
+    def _first_request():
+        startup.first_request()
+
+    startup.ready()
     return app
 
 
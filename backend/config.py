@@ -48,4 +48,6 @@ ROUTINE_MAP = {
 class Config:
     DEBUG = True
     PORT = 5000
-    AUTO_IMPORT = os.getenv("AUTO_IMPORT", "false")
\ No newline at end of file
+    AUTO_IMPORT = os.getenv("AUTO_IMPORT", "false")
+    CATALOG_FEED = os.getenv("CATALOG_FEED", "true")   # LISTEN การเปลี่ยนแปลงของ products
+    INIT_DB = os.getenv("INIT_DB", "true")             # รัน schema / import ข้อมูลเริ่มต้นตอน boot
\ No newline at end of file
@@ -1,7 +1,6 @@
 from flask import app
 import psycopg2
 import os
-import pandas as pd
 import math
 
 # ── อ่านจาก env ถ้ามี DATABASE_URL (Render/Supabase) ──
@@ -49,25 +48,32 @@ PRODUCT_COLUMNS = [
 
 
 def init_database():
-    conn = get_connection()
+    """คืน False ถ้าต่อ DB ไม่ได้ — boot ต่อได้ (engine ใช้ artifact ล่าสุด ดู DataLoader._rebuild_once)"""
+    from .migrate import migrate
+
     try:
-        cur = conn.cursor()
-        schema_path = os.path.join(os.path.dirname(__file__), "schema.sql")
-        with open(schema_path, "r", encoding="utf-8") as f:
-            cur.execute(f.read())
-        conn.commit()
-        print("✅ Database schema ready.")
+        conn = get_connection()
+    except psycopg2.OperationalError as e:
+        print(f"⚠️  ต่อ DB ไม่ได้ ({e}) — ข้าม schema / import")
+        return False
 
-        cur.execute("SELECT COUNT(*) FROM products")
-        count = cur.fetchone()[0]
+    try:
+        # schema อยู่ใน database/migrations — apply เฉพาะที่ยังไม่อยู่ใน schema_migrations
+        migrate(conn=conn)
 
-        if count > 0:
-            print(f"✅ Products พร้อมแล้ว ({count} รายการ) — ข้าม import")
+        cur = conn.cursor()
+        # EXISTS แทน COUNT(*) — ไม่ต้อง scan products ทั้ง table ทุก boot
+        cur.execute("SELECT EXISTS (SELECT 1 FROM products)")
+        has_products = cur.fetchone()[0]
+
+        if has_products:
+            print("✅ Products พร้อมแล้ว — ข้าม import")
         else:
             print("⚠️  ไม่พบ products — เริ่ม import CSV...")
             _import_products(cur, conn)
     finally:
         conn.close()
+    return True
 
 
 def _safe(val):
@@ -86,6 +92,8 @@ def _safe(val):
 
 
 def _import_products(cur, conn):
+    import pandas as pd   # ใช้แค่ตอน import CSV ครั้งแรก — ไม่ให้ทุก module ที่ใช้ get_connection ต้องรอ
+
     csv_path = os.path.normpath(CSV_PATH)
     if not os.path.exists(csv_path):
         print(f"❌ ไม่พบไฟล์ CSV: {csv_path}")
@@ -145,6 +153,7 @@ def init_active_ingredients():
         if not os.path.exists(csv_path):
             print(f"❌ ไม่พบ Active_group CSV: {csv_path}"); return
 
+        import pandas as pd
         df = pd.read_csv(csv_path)
         df['ingredient'] = df['ingredient'].str.strip()
         CATS = ['acne','whitening','wrinkle','exfoliation',
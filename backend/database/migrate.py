@@ -0,0 +1,156 @@
+"""
+migration runner — apply database/migrations/NNN_name.sql ตามลำดับ ครั้งเดียวต่อ DB
+
+ledger = table schema_migrations (version, name, checksum, applied_at, duration_ms)
+  - boot ที่ไม่มี migration ค้าง: อ่าน ledger อย่างเดียว ไม่แตะ table อื่น (ไม่มี lock บน products)
+  - migration ค้าง: แต่ละไฟล์รันใน transaction ของตัวเองพร้อม INSERT ledger
+    worker หลายตัว boot พร้อมกัน → pg_advisory_xact_lock ให้ apply ทีละตัว แล้วเช็ค ledger ซ้ำ
+  - ไฟล์ที่ apply แล้วถูกแก้ (checksum ไม่ตรง) → เตือนแต่ไม่รันซ้ำ ให้เขียน migration ใหม่แทน
+
+ใช้เอง:  python -m database.migrate            apply ที่ค้าง
+         python -m database.migrate --status   ดูสถานะ
+"""
+import hashlib
+import re
+import sys
+import time
+from pathlib import Path
+
+from .db import get_connection
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+
+# key ของ advisory lock — ค่าคงที่ใดๆ ที่ไม่ชนกับ lock อื่นใน app
+MIGRATION_LOCK_ID = 58201
+
+LEDGER_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version     INTEGER PRIMARY KEY,
+        name        TEXT NOT NULL,
+        checksum    TEXT NOT NULL,
+        applied_at  TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        duration_ms INTEGER
+    )
+"""
+
+_FILENAME = re.compile(r"^(\d+)_(.+)\.sql$")
+
+
+class Migration:
+    def __init__(self, version: int, name: str, path: Path):
+        self.version = version
+        self.name    = name
+        self.path    = path
+        self.sql     = path.read_text(encoding="utf-8")
+        # CRLF / LF ไม่นับเป็นการแก้ไฟล์ (checkout บน Windows)
+        self.checksum = hashlib.sha256(self.sql.replace("\r\n", "\n").encode("utf-8")).hexdigest()
+
+    def __repr__(self):
+        return f"{self.version:03d}_{self.name}"
+
+
+def load_migrations(directory: Path = MIGRATIONS_DIR) -> list:
+    migrations = []
+    for path in sorted(directory.glob("*.sql")):
+        m = _FILENAME.match(path.name)
+        if not m:
+            print(f"⚠️  ข้าม {path.name} — ชื่อไฟล์ต้องเป็น NNN_name.sql")
+            continue
+        migrations.append(Migration(int(m.group(1)), m.group(2), path))
+
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"migration version ซ้ำกัน: {migrations}")
+    return migrations
+
+
+def _applied(cur) -> dict:
+    cur.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(cur.fetchall())
+
+
+def _pending(migrations: list, applied: dict) -> list:
+    for m in migrations:
+        if m.version in applied and applied[m.version] != m.checksum:
+            print(f"⚠️  migration {m} ถูกแก้หลัง apply แล้ว — ไม่รันซ้ำ (เขียน migration ใหม่แทน)")
+    return [m for m in migrations if m.version not in applied]
+
+
+def migrate(directory: Path = MIGRATIONS_DIR, conn=None) -> list:
+    """
+    apply migration ที่ยังไม่อยู่ใน ledger — คืน list ของที่ apply ในครั้งนี้
+    ส่ง conn มา → ใช้ต่อ (ไม่ปิดให้) ทุก migration จบด้วย commit / rollback แล้ว
+    """
+    migrations = load_migrations(directory)
+    own  = conn is None
+    conn = conn or get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(LEDGER_SQL)
+        conn.commit()
+
+        if not _pending(migrations, _applied(cur)):
+            conn.rollback()
+            print(f"✅ Database schema up to date ({len(migrations)} migrations)")
+            return []
+
+        done = []
+        for m in migrations:
+            # lock ต่อ transaction — worker อื่นที่รออยู่จะเห็น ledger ใหม่หลังเรา commit
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (m.version,))
+            if cur.fetchone():
+                conn.rollback()
+                continue
+
+            started = time.perf_counter()
+            try:
+                cur.execute(m.sql)
+                duration_ms = int((time.perf_counter() - started) * 1000)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, name, checksum, duration_ms) "
+                    "VALUES (%s, %s, %s, %s)",
+                    (m.version, m.name, m.checksum, duration_ms),
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                print(f"❌ migration {m} ล้มเหลว")
+                raise
+            print(f"✅ migration {m} applied ({duration_ms} ms)")
+            done.append(m)
+        return done
+    finally:
+        if own:
+            conn.close()
+
+
+def status(directory: Path = MIGRATIONS_DIR) -> list:
+    """[(migration, state)] — state = applied / pending / modified"""
+    migrations = load_migrations(directory)
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+        applied = _applied(cur) if cur.fetchone()[0] else {}
+    finally:
+        conn.close()
+
+    result = []
+    for m in migrations:
+        if m.version not in applied:
+            state = "pending"
+        elif applied[m.version] != m.checksum:
+            state = "modified"
+        else:
+            state = "applied"
+        result.append((m, state))
+    return result
+
+
+if __name__ == "__main__":
+    if "--status" in sys.argv[1:]:
+        for m, state in status():
+            print(f"{state:9s} {m}")
+    else:
+        migrate()
@@ -1,5 +1,6 @@
 -- ================================================================
--- schema.sql
+-- 001_baseline.sql — schema.sql เดิมก่อนมี migration ledger
+-- DB เดิมที่เคยรัน schema.sql ทุก boot มีทุกอย่างแล้ว ทุก statement จึงต้อง idempotent
 -- ================================================================
 
 CREATE TABLE IF NOT EXISTS users (
@@ -34,14 +35,21 @@ CREATE TABLE IF NOT EXISTS products (
 );
 
 -- migrate: ถ้า products มี VARCHAR อยู่ให้แปลงเป็น TEXT อัตโนมัติ
-ALTER TABLE products ALTER COLUMN brand          TYPE TEXT;
-ALTER TABLE products ALTER COLUMN major_category TYPE TEXT;
-ALTER TABLE products ALTER COLUMN subtype        TYPE TEXT;
-ALTER TABLE products ALTER COLUMN image_url      TYPE TEXT;
-ALTER TABLE products ALTER COLUMN image_local    TYPE TEXT;
-ALTER TABLE products ALTER COLUMN skintype       TYPE TEXT;
-ALTER TABLE products ALTER COLUMN product_url    TYPE TEXT;
-ALTER TABLE products ALTER COLUMN name           TYPE TEXT;
+-- (เฉพาะ column ที่ยังไม่ใช่ TEXT — ALTER TYPE lock ทั้ง table แม้ type จะเหมือนเดิม)
+DO $$
+DECLARE
+    col TEXT;
+BEGIN
+    FOR col IN
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'products'
+          AND column_name IN ('brand', 'major_category', 'subtype', 'image_url',
+                              'image_local', 'skintype', 'product_url', 'name')
+          AND data_type <> 'text'
+    LOOP
+        EXECUTE format('ALTER TABLE products ALTER COLUMN %I TYPE TEXT', col);
+    END LOOP;
+END $$;
 ALTER TABLE products ADD COLUMN IF NOT EXISTS free_from        TEXT;
 ALTER TABLE products ADD COLUMN IF NOT EXISTS key_ingredients  TEXT;
 ALTER TABLE products ADD COLUMN IF NOT EXISTS key_functions    TEXT;
@@ -55,7 +63,18 @@ ALTER TABLE products ADD COLUMN IF NOT EXISTS active_soothing  TEXT;
 ALTER TABLE products ADD COLUMN IF NOT EXISTS active_oilct     TEXT;
 ALTER TABLE products ADD COLUMN IF NOT EXISTS active_antioxidant TEXT;
 -- ✅ แก้: migrate created_at เป็น TIMESTAMP WITH TIME ZONE (ถ้า DB เก่าใช้ TIMESTAMP ธรรมดา)
-ALTER TABLE products ALTER COLUMN created_at TYPE TIMESTAMP WITH TIME ZONE USING created_at AT TIME ZONE 'Asia/Bangkok';
+-- เช็ค type ก่อน — รันซ้ำบน column ที่เป็น timestamptz แล้วจะ rewrite ทั้ง table
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'products'
+          AND column_name = 'created_at' AND data_type = 'timestamp without time zone'
+    ) THEN
+        ALTER TABLE products ALTER COLUMN created_at TYPE TIMESTAMP WITH TIME ZONE
+            USING created_at AT TIME ZONE 'Asia/Bangkok';
+    END IF;
+END $$;
 ALTER TABLE products ALTER COLUMN created_at SET DEFAULT NOW();
 
 -- เพิ่ม table active_ingredients
@@ -0,0 +1,17 @@
+-- ✅ skin profile ล่าสุดของ user — ใช้ reverse match สินค้าใหม่ (find_matching_profiles)
+-- concern_bits : bit i = CONCERN_KEYS[i] ใน services/ai_engine_v2.py
+-- *_code       : 1 + ลำดับค่าใน CONTEXT_RULES[dimension], 0 = ไม่ได้ระบุ
+CREATE TABLE IF NOT EXISTS user_profiles (
+    user_id           INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    skin_type         VARCHAR(20) NOT NULL DEFAULT 'all',
+    concern_bits      SMALLINT NOT NULL DEFAULT 0,
+    gender_code       SMALLINT NOT NULL DEFAULT 0,
+    age_code          SMALLINT NOT NULL DEFAULT 0,
+    hydration_code    SMALLINT NOT NULL DEFAULT 0,
+    environment_code  SMALLINT NOT NULL DEFAULT 0,
+    experience_code   SMALLINT NOT NULL DEFAULT 0,
+    routine_time_code SMALLINT NOT NULL DEFAULT 0,
+    updated_at        TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_profiles_match ON user_profiles(skin_type, concern_bits);
@@ -0,0 +1,24 @@
+-- ✅ notification สินค้าใหม่ — notify_new_products.py เขียน, ตัวส่งอ่าน status = 'pending' ไปส่ง
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id          BIGSERIAL PRIMARY KEY,
+    product_id  INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    user_id     INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    score       REAL NOT NULL,
+    status      VARCHAR(20) NOT NULL DEFAULT 'pending',
+    created_at  TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    sent_at     TIMESTAMP WITH TIME ZONE,
+    UNIQUE (product_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_pending
+    ON notification_outbox(created_at) WHERE status = 'pending';
+
+-- checkpoint ของ fan-out ต่อ product — last_user_id commit พร้อม outbox ของ chunk เดียวกัน
+CREATE TABLE IF NOT EXISTS notification_jobs (
+    product_id   INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    last_user_id INTEGER NOT NULL DEFAULT 0,
+    matched      INTEGER NOT NULL DEFAULT 0,
+    done         BOOLEAN NOT NULL DEFAULT FALSE,
+    started_at   TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at   TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
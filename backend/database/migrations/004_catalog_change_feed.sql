@@ -0,0 +1,46 @@
+-- ✅ catalog change feed — เพิ่ม version ทุก statement ที่แก้ products แล้ว NOTIFY ให้ engine
+-- payload: {"version", "op", "ids"} — ids เป็น null ถ้าเกิน 500 แถวหรือ TRUNCATE (engine จะ rebuild)
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id         BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version    BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+INSERT INTO catalog_version (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION notify_catalog_change() RETURNS trigger AS $$
+DECLARE
+    v   BIGINT;
+    ids INTEGER[];
+    n   INTEGER := 0;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        SELECT array_agg(id), count(*) INTO ids, n FROM (SELECT id FROM old_rows LIMIT 501) t;
+    ELSIF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT array_agg(id), count(*) INTO ids, n FROM (SELECT id FROM new_rows LIMIT 501) t;
+    END IF;
+    IF TG_OP <> 'TRUNCATE' AND n = 0 THEN
+        RETURN NULL;
+    END IF;
+    IF n > 500 THEN
+        ids := NULL;
+    END IF;
+
+    UPDATE catalog_version SET version = version + 1, updated_at = NOW() RETURNING version INTO v;
+    PERFORM pg_notify('catalog_changes',
+                      json_build_object('version', v, 'op', TG_OP, 'ids', ids)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_catalog_insert   ON products;
+DROP TRIGGER IF EXISTS products_catalog_update   ON products;
+DROP TRIGGER IF EXISTS products_catalog_delete   ON products;
+DROP TRIGGER IF EXISTS products_catalog_truncate ON products;
+CREATE TRIGGER products_catalog_insert AFTER INSERT ON products
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_change();
+CREATE TRIGGER products_catalog_update AFTER UPDATE ON products
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_change();
+CREATE TRIGGER products_catalog_delete AFTER DELETE ON products
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_change();
+CREATE TRIGGER products_catalog_truncate AFTER TRUNCATE ON products
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_change();
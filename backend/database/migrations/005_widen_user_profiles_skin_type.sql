@@ -0,0 +1,4 @@
+-- ✅ skin_type ของ user_profiles เท่ากับ history.skin_type (VARCHAR(50)) — 002 เป็น VARCHAR(20)
+-- encode_profile เก็บ skin_type ที่ user ส่งมาตามนั้น ค่าที่ยาวเกิน 20 ทำให้ upsert profile
+-- (ใน transaction เดียวกับ history) fail ทั้งก้อน — 002 apply ไปแล้ว จึงแก้ที่นี่แทน
+ALTER TABLE user_profiles ALTER COLUMN skin_type TYPE VARCHAR(50);
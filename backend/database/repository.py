@@ -6,16 +6,86 @@ def get_all_products():
     conn = get_connection()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT * FROM products")
+        cur.execute("SELECT * FROM products ORDER BY id")
         return cur.fetchall()
     finally:
         conn.close()
 
 
-def insert_product(product_data):
+def get_products_by_ids(ids):
+    if not ids:
+        return []
+    conn = get_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("SELECT * FROM products WHERE id = ANY(%s) ORDER BY id", (list(ids),))
+        return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def get_catalog_version():
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT version, updated_at FROM catalog_version")
+        return cur.fetchone()
+    finally:
+        conn.close()
+
+
+def get_active_ingredient_names():
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT ingredient FROM active_ingredients ORDER BY ingredient")
+        return [r[0] for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def get_profile_skin_types():
     conn = get_connection()
     try:
         cur = conn.cursor()
+        cur.execute("SELECT DISTINCT skin_type FROM user_profiles")
+        return [r[0] for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def stream_user_profiles(pairs, chunk_size=50000, after_user_id=0):
+    """
+    generator ของ user_profiles ทีละ chunk (list of dict) เฉพาะ (skin_type, concern_bits) ใน pairs
+    ใช้ named cursor (server-side) → DB ส่งมาทีละ chunk ไม่โหลด user ทั้งหมดเข้า memory
+    เรียงตาม user_id และเริ่มหลัง after_user_id (keyset) — job ที่ checkpoint user_id ต่อได้จากจุดเดิม
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor(name="stream_user_profiles", cursor_factory=RealDictCursor)
+        cur.itersize = chunk_size
+        cur.execute("""
+            SELECT p.*
+            FROM user_profiles p
+            JOIN unnest(%s::text[], %s::smallint[]) AS c(skin_type, concern_bits)
+              ON c.skin_type = p.skin_type AND c.concern_bits = p.concern_bits
+            WHERE p.user_id > %s
+            ORDER BY p.user_id
+        """, ([st for st, _ in pairs], [bits for _, bits in pairs], after_user_id))
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def insert_product(product_data):
+    """คืนแถวที่ insert แล้ว (dict รวม id / created_at) หรือ None ถ้าไม่สำเร็จ"""
+    conn = get_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute("""
             INSERT INTO products (
                 product_url, name, brand, major_category, subtype,
@@ -30,6 +100,7 @@ def insert_product(product_data):
                 %s, %s,
                 %s, %s, %s
             )
+            RETURNING *
         """, (
             product_data.get('product_url'),
             product_data.get('name'),
@@ -47,10 +118,11 @@ def insert_product(product_data):
             product_data.get('image_local'),
             product_data.get('skintype'),
         ))
+        row = cur.fetchone()
         conn.commit()
-        return True
+        return row
     except Exception as e:
         print("Insert Product Error:", e)
-        return False
+        return None
     finally:
         conn.close()
\ No newline at end of file
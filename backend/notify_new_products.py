@@ -0,0 +1,105 @@
+"""
+notify_new_products.py
+วางไฟล์นี้ใน backend/ แล้วรัน (ตั้ง cron ได้ — รันซ้ำไม่สร้าง notification ซ้ำ):
+  python notify_new_products.py [--days 7] [--chunk 5000] [--threshold 0.4]
+
+1. หา product ที่ created_at ภายใน --days วัน และยัง fan-out ไม่เสร็จ
+2. reverse match กับ user_profiles ทีละ chunk เรียงตาม user_id
+   (ดึงเฉพาะ (skin_type, concern_bits) ที่ score ถึง threshold ได้ — DataLoader.profile_candidates)
+3. bulk insert ผลลง notification_outbox
+4. last_user_id ใน notification_jobs commit พร้อม outbox ของ chunk เดียวกัน
+   → crash แล้วรันใหม่ จะต่อจาก chunk ล่าสุดที่ commit แล้ว
+memory ใช้แค่ chunk เดียว ไม่ขึ้นกับจำนวน user
+"""
+import sys, os
+import argparse
+sys.path.insert(0, os.path.dirname(__file__))
+
+from psycopg2.extras import RealDictCursor, execute_values
+from database.db import get_connection
+from database.repository import get_profile_skin_types, stream_user_profiles
+from services.ai_engine_v2 import DataLoader, decode_profile
+
+PENDING_SQL = """
+    SELECT p.*, COALESCE(j.last_user_id, 0) AS last_user_id
+    FROM products p
+    LEFT JOIN notification_jobs j ON j.product_id = p.id
+    WHERE p.created_at >= NOW() - make_interval(days => %s)
+      AND NOT COALESCE(j.done, FALSE)
+    ORDER BY p.id
+"""
+
+
+def fan_out(engine, conn, product, threshold, chunk_size):
+    cur   = conn.cursor(cursor_factory=RealDictCursor)
+    pid   = product["id"]
+    last  = product["last_user_id"]
+    total = 0
+
+    cur.execute(
+        "INSERT INTO notification_jobs (product_id) VALUES (%s) ON CONFLICT (product_id) DO NOTHING",
+        (pid,)
+    )
+    conn.commit()
+
+    pairs = engine.profile_candidates(product, get_profile_skin_types(), threshold)
+    # stream เรียงตาม user_id ต่อจาก last_user_id — resume ได้โดยไม่ต้อง OFFSET
+    chunks = stream_user_profiles(pairs, chunk_size, last) if pairs else []
+    for rows in chunks:
+        matched = engine.find_matching_users(
+            product, [decode_profile(r) for r in rows], threshold
+        )
+        if matched:
+            execute_values(cur, """
+                INSERT INTO notification_outbox (product_id, user_id, score) VALUES %s
+                ON CONFLICT (product_id, user_id) DO NOTHING
+            """, [(pid, m["user_id"], m["score"]) for m in matched])
+
+        last = rows[-1]["user_id"]
+        cur.execute("""
+            UPDATE notification_jobs
+            SET last_user_id = %s, matched = matched + %s, updated_at = NOW()
+            WHERE product_id = %s
+        """, (last, len(matched), pid))
+        conn.commit()
+
+        total += len(matched)
+        print(f"   user_id ≤ {last}: +{len(matched)} ({total} รวม)")
+
+    cur.execute(
+        "UPDATE notification_jobs SET done = TRUE, updated_at = NOW() WHERE product_id = %s",
+        (pid,)
+    )
+    conn.commit()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days",      type=int,   default=7)
+    parser.add_argument("--chunk",     type=int,   default=5000)
+    parser.add_argument("--threshold", type=float, default=0.4)
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(PENDING_SQL, (args.days,))
+        products = cur.fetchall()
+        conn.commit()
+        if not products:
+            print("✅ ไม่มีสินค้าใหม่ที่ต้องแจ้ง")
+            return
+
+        print(f"📦 สินค้าใหม่ที่ต้อง fan-out: {len(products)}")
+        engine = DataLoader()
+        for product in products:
+            print(f"🔔 [{product['id']}] {product['name']} (ต่อจาก user_id > {product['last_user_id']})")
+            total = fan_out(engine, conn, product, args.threshold, args.chunk)
+            print(f"✅ [{product['id']}] notification {total} รายการ")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
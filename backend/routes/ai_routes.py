@@ -1,7 +1,16 @@
-from flask import Blueprint, request, jsonify
+import os
+import hmac
+
+from flask import Blueprint, request, jsonify, current_app
+from services.ai_engine_v2 import encode_profile
+from database.repository import insert_product
 
 ai_bp = Blueprint("ai", __name__)
 
+# token ของ route ที่แก้ engine (/api/engine/products, /api/engine/rebuild) ส่งมาใน header X-Admin-Token
+# ไม่ตั้ง = ปิด route เหล่านี้ (404)
+ENGINE_ADMIN_TOKEN = os.environ.get("ENGINE_ADMIN_TOKEN", "")
+
 PRICE_RANGES = {
     "low":    (0,     500),
     "medium": (500,   1500),
@@ -9,6 +18,33 @@ PRICE_RANGES = {
     "any":    (0,     100000),
 }
 
+
+def _price_bounds(data):
+    """
+    min_price / max_price ที่ส่งมาตรงๆ มีผลก่อน price_range
+    คืน None ถ้าค่าไม่ใช่ตัวเลข
+    """
+    min_p, max_p = PRICE_RANGES.get(data.get('price_range', 'any'), (0, 100000))
+    try:
+        if data.get('min_price') is not None:
+            min_p = float(data['min_price'])
+        if data.get('max_price') is not None:
+            max_p = float(data['max_price'])
+    except (TypeError, ValueError):
+        return None
+    return min_p, max_p
+
+
+def _engine_admin_denied():
+    """response 404 / 403 ถ้า request ไม่มีสิทธิ์แก้ engine — มีสิทธิ์คืน None"""
+    if not ENGINE_ADMIN_TOKEN:
+        return jsonify({"error": "not found"}), 404
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), ENGINE_ADMIN_TOKEN.encode("utf-8")):
+        return jsonify({"error": "forbidden"}), 403
+    return None
+
+
 def init_ai_routes(ai_engine, user_manager):
 
     @ai_bp.route('/api/recommend', methods=['POST'])
@@ -16,10 +52,28 @@ def init_ai_routes(ai_engine, user_manager):
         data      = request.json
         skin_type = data.get('skin_type', 'all')
         concerns  = data.get('concerns', [])
-        price_key = data.get('price_range', 'any')
         email     = data.get('email')
         context   = data.get('context', {})
-        min_p, max_p = PRICE_RANGES.get(price_key, (0, 100000))
+        bounds    = _price_bounds(data)
+        if bounds is None:
+            return jsonify({"error": "min_price/max_price must be numbers"}), 400
+        min_p, max_p = bounds
+
+        # ส่ง cursor / page_size มา → ตอบทีละหน้า {"items", "next_cursor", "total"}
+        if 'cursor' in data or 'page_size' in data:
+            try:
+                page_size = min(max(int(data.get('page_size') or 20), 1), 100)
+                page = ai_engine.recommend_page(
+                    skin_type=skin_type, concerns=concerns,
+                    min_price=min_p, max_price=max_p, context=context,
+                    cursor=data.get('cursor'), page_size=page_size, top_n=100,
+                )
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            if email and not data.get('cursor'):
+                user_manager.add_history(email, skin_type, concerns, page["items"][:5],
+                                         profile=encode_profile(skin_type, concerns, context))
+            return jsonify(page)
 
         result = ai_engine.recommend_products(
             skin_type=skin_type, concerns=concerns,
@@ -27,7 +81,36 @@ def init_ai_routes(ai_engine, user_manager):
             top_n=100,  # ← ส่งทั้งหมดไม่จำกัด
         )
         if email:
-            user_manager.add_history(email, skin_type, concerns, result[:5])
+            user_manager.add_history(email, skin_type, concerns, result[:5],
+                                     profile=encode_profile(skin_type, concerns, context))
+        return jsonify(result)
+
+
+    @ai_bp.route('/api/recommend-text', methods=['POST'])
+    def recommend_text():
+        data    = request.json
+        text    = (data.get('text') or '').strip()
+        email   = data.get('email')
+        context = data.get('context', {})
+        bounds  = _price_bounds(data)
+        if not text:
+            return jsonify({"error": "text is required"}), 400
+        if bounds is None:
+            return jsonify({"error": "min_price/max_price must be numbers"}), 400
+        min_p, max_p = bounds
+        try:
+            top_n = min(max(int(data.get('top_n') or 20), 1), 100)
+        except (TypeError, ValueError):
+            return jsonify({"error": "top_n must be an integer"}), 400
+
+        result = ai_engine.recommend_text(
+            text, min_price=min_p, max_price=max_p, top_n=top_n, context=context,
+        )
+        if email:
+            parsed = result["parsed"]
+            user_manager.add_history(email, parsed["skin_type"], parsed["concerns"],
+                                     result["products"][:5],
+                                     profile=encode_profile(parsed["skin_type"], parsed["concerns"], context))
         return jsonify(result)
 
 
@@ -36,9 +119,11 @@ def init_ai_routes(ai_engine, user_manager):
         data      = request.json
         skin_type = data.get('skin_type', 'all')
         concerns  = data.get('concerns', [])
-        price_key = data.get('price_range', 'any')
         context   = data.get('context', {})
-        min_p, max_p = PRICE_RANGES.get(price_key, (0, 100000))
+        bounds    = _price_bounds(data)
+        if bounds is None:
+            return jsonify({"error": "min_price/max_price must be numbers"}), 400
+        min_p, max_p = bounds
 
         result = ai_engine.recommend_routine(
             skin_type=skin_type, concerns=concerns,
@@ -52,24 +137,24 @@ def init_ai_routes(ai_engine, user_manager):
         data      = request.json
         skin_type = data.get('skin_type', 'all')
         concerns  = data.get('concerns', [])
-        price_key = data.get('price_range', 'any')
         email     = data.get('email')
         context   = data.get('context', {})
-        min_p, max_p = PRICE_RANGES.get(price_key, (0, 100000))
+        bounds    = _price_bounds(data)
+        if bounds is None:
+            return jsonify({"error": "min_price/max_price must be numbers"}), 400
+        min_p, max_p = bounds
 
-        rec = ai_engine.recommend_products(
+        result = ai_engine.recommend_all(
             skin_type=skin_type, concerns=concerns,
             min_price=min_p, max_price=max_p, context=context,
             top_n=100,  # ← ส่งทั้งหมด frontend จัด pagination เอง
         )
-        routine = ai_engine.recommend_routine(
-            skin_type=skin_type, concerns=concerns,
-            min_price=min_p, max_price=max_p, context=context,
-        )
         # บันทึก history แค่ top 5
         if email:
-            user_manager.add_history(email, skin_type, concerns, rec[:5], routine)
-        return jsonify({"recommend": rec, "routine": routine})
+            user_manager.add_history(email, skin_type, concerns,
+                                     result["recommend"][:5], result["routine"],
+                                     profile=encode_profile(skin_type, concerns, context))
+        return jsonify(result)
 
 
     @ai_bp.route('/api/search', methods=['GET'])
@@ -77,4 +162,49 @@ def init_ai_routes(ai_engine, user_manager):
         q = request.args.get('q', '').strip().lower()
         if not q:
             return jsonify([])
-        return jsonify(ai_engine.search_products(q))
\ No newline at end of file
+        limit  = min(max(request.args.get('limit', 100, type=int), 1), 500)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        return jsonify(ai_engine.search_products(q, limit=limit, offset=offset))
+
+
+    @ai_bp.route('/api/autocomplete', methods=['GET'])
+    def autocomplete():
+        q = request.args.get('q', '')
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 20)
+        return jsonify(ai_engine.autocomplete(q, limit=limit))
+
+
+    @ai_bp.route('/api/engine/products', methods=['POST'])
+    def add_products():
+        """insert product ลง DB แล้วต่อท้าย engine ทันทีโดยไม่ต้อง restart"""
+        denied = _engine_admin_denied()
+        if denied:
+            return denied
+        data  = request.json
+        items = data if isinstance(data, list) else [data]
+        if not items or not all(isinstance(p, dict) and p.get('name') for p in items):
+            return jsonify({"error": "each product needs a name"}), 400
+
+        rows = [row for row in (insert_product(p) for p in items) if row]
+        if not rows:
+            return jsonify({"error": "insert failed"}), 500
+        return jsonify(ai_engine.add_products(rows)), 201
+
+
+    @ai_bp.route('/api/engine/rebuild', methods=['POST'])
+    def rebuild_engine():
+        """build catalog ใหม่บน background แล้วสลับ snapshot — ไม่ต้อง restart"""
+        denied = _engine_admin_denied()
+        if denied:
+            return denied
+        started = ai_engine.rebuild_async()
+        return jsonify({"started": started, "rebuilding": ai_engine.rebuilding}), 202
+
+
+    @ai_bp.route('/api/engine/stats', methods=['GET'])
+    def engine_stats():
+        stats   = ai_engine.stats()
+        startup = current_app.config.get("STARTUP")
+        if startup is not None:
+            stats["startup"] = startup.report()
+        return jsonify(stats)
@@ -193,6 +193,66 @@ CATEGORY_MAP = {
     "อายครีม":           "eye_care",
 }
 
+# ================================================================
+# PHRASE TRIE
+# รวมทั้ง 3 map เป็น trie เดียว แล้ว longest-match ไล่จากซ้ายไปขวารอบเดียว
+# ภาษาไทยไม่เว้นวรรค → ไม่ต้องพึ่ง split / bigram
+# ================================================================
+
+_END = None   # key ของ node ที่จบ phrase → {kind: value}
+
+_KIND_MAPS = (
+    ("skin_type", SKINTYPE_MAP),
+    ("concern",   CONCERN_MAP),
+    ("category",  CATEGORY_MAP),
+)
+
+
+def _compile_trie() -> dict:
+    root = {}
+    for kind, mapping in _KIND_MAPS:
+        for phrase, value in mapping.items():
+            node = root
+            for ch in phrase.lower():
+                node = node.setdefault(ch, {})
+            node.setdefault(_END, {})[kind] = value
+    return root
+
+
+_TRIE = _compile_trie()
+
+
+def match_phrases(text: str) -> list:
+    """
+    หา phrase ที่ยาวที่สุดที่ตรงกับแต่ละตำแหน่งใน text
+    คืน list ของ (phrase, {kind: value}) ตามลำดับที่เจอ — ช่องว่างกลาง phrase ข้ามได้ ("ผิว แห้ง")
+    """
+    text    = text.lower()
+    n       = len(text)
+    matches = []
+    i = 0
+    while i < n:
+        node, j, last = _TRIE, i, None
+        while j < n:
+            ch = text[j]
+            if ch.isspace() and j > i:
+                j += 1
+                continue
+            node = node.get(ch)
+            if node is None:
+                break
+            j += 1
+            if _END in node:
+                last = j
+                hit  = node[_END]
+        if last is None:
+            i += 1
+            continue
+        matches.append((text[i:last], hit))
+        i = last
+    return matches
+
+
 # ================================================================
 # PARSE FUNCTION
 # ================================================================
@@ -205,28 +265,21 @@ def parse_thai_input(text: str):
     skin_type : str  เช่น "oily"  (ถ้าไม่พบ → "")
     concerns  : list เช่น ["acne_control", "brightening"]
     category  : str  เช่น "serum" (ถ้าไม่พบ → "")
-    """
-    words = text.strip().split()
-    # ลองทั้งคำเดี่ยวและ bigram
-    tokens = set(words)
-    for i in range(len(words) - 1):
-        tokens.add(words[i] + words[i+1])
-        tokens.add(words[i] + " " + words[i+1])
 
+    เจอหลายค่า → skin_type / category เอาตัวแรกในข้อความ, concerns เรียงตามลำดับที่เจอ
+    """
     skin_type = ""
     concerns  = []
     category  = ""
 
-    for token in tokens:
-        t = token.strip()
-        if not skin_type and t in SKINTYPE_MAP:
-            skin_type = SKINTYPE_MAP[t]
-        if t in CONCERN_MAP:
-            tag = CONCERN_MAP[t]
-            if tag not in concerns:
-                concerns.append(tag)
-        if not category and t in CATEGORY_MAP:
-            category = CATEGORY_MAP[t]
+    for _, hit in match_phrases(text):
+        if not skin_type and "skin_type" in hit:
+            skin_type = hit["skin_type"]
+        tag = hit.get("concern")
+        if tag and tag not in concerns:
+            concerns.append(tag)
+        if not category and "category" in hit:
+            category = hit["category"]
 
     return skin_type, concerns, category
 
@@ -243,6 +296,7 @@ if __name__ == "__main__":
         "ฝ้า กระ ริ้วรอย กันแดด",
         "ผิวผสม จุดด่างดำ โทนเนอร์",
         "สิวอุดตัน รูขุมขนกว้าง ล้างหน้า",
+        "หน้ามันเป็นสิวอยากได้เซรั่ม",
     ]
 
     print("=" * 55)
@@ -19,18 +19,82 @@ NEW PRODUCT FEATURE
 
 อ้างอิง: Alvarez GV et al. JAAD 2025;93(6):1509-1525.
 """
+from __future__ import annotations
 
+import os
 import json
+import pickle
+import bisect
+import hashlib
+import select
+import shutil
+import base64
+import time
+import itertools
+import threading
 import numpy as np
-import pandas as pd
-import joblib
 from pathlib import Path
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from database.repository import get_all_products
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+from typing import TYPE_CHECKING
+from scipy import sparse
+# pandas / sklearn import ตอนใช้จริง (~0.3s / ~1s) — boot จาก artifact ไม่ต้องใช้ทั้งคู่
+if TYPE_CHECKING:
+    import pandas as pd
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+from database.db import get_connection
+from database.repository import (
+    get_all_products, get_active_ingredient_names,
+    get_catalog_version, get_products_by_ids,
+)
+from services.thai_mapping import parse_thai_input
 
 MODEL_DIR = Path(__file__).parent.parent / "training" / "model"
 
+DESC_PATH = MODEL_DIR / "ingredient_descriptions.json"
+
+# memory budget + dtype ของ SimilarityBank (float16/float32 ประหยัด memory แต่ score อาจคลาดที่ทศนิยมท้ายๆ)
+SIM_BANK_MAX_BYTES = int(os.environ.get("SIM_BANK_MAX_MB", "64")) * 1024 * 1024
+SIM_BANK_DTYPE     = os.environ.get("SIM_BANK_DTYPE", "float64")
+
+# search — จำนวน query ที่ cache, ผลสูงสุดต่อ query, top-k ของ cosine fallback
+SEARCH_CACHE_SIZE  = int(os.environ.get("SEARCH_CACHE_SIZE", "512"))
+SEARCH_MAX_RESULTS = int(os.environ.get("SEARCH_MAX_RESULTS", "1000"))
+SEARCH_FALLBACK_K  = int(os.environ.get("SEARCH_FALLBACK_K", "50"))
+
+# autocomplete — prefix ที่สั้นกว่าหรือเท่านี้คำนวณ top suggestions ไว้ตอน build
+AUTOCOMPLETE_PRECOMPUTE_LEN = int(os.environ.get("AUTOCOMPLETE_PRECOMPUTE_LEN", "2"))
+AUTOCOMPLETE_MAX_LIMIT      = 20
+
+# add_products — สัดส่วน n-gram ที่ vectorizer ไม่รู้จัก (สะสมตั้งแต่ fit ล่าสุด) ที่จะ refit ทั้ง catalog
+TFIDF_REFIT_DRIFT = float(os.environ.get("TFIDF_REFIT_DRIFT", "0.05"))
+
+# UPDATE / DELETE mask ตำแหน่งเดิมไว้ — สัดส่วนตำแหน่งที่ mask ที่จะ rebuild เพื่อบีบออก
+SNAPSHOT_COMPACT_RATIO = float(os.environ.get("SNAPSHOT_COMPACT_RATIO", "0.1"))
+
+# change feed — channel ของ NOTIFY จาก trigger บน products + เวลารอรวม notification ที่มาติดกัน
+CATALOG_CHANNEL       = "catalog_changes"
+CATALOG_FEED_DEBOUNCE = float(os.environ.get("CATALOG_FEED_DEBOUNCE", "0.5"))
+
+# artifact cache — snapshot ที่ build แล้วเก็บลง disk, key = hash ของ catalog + model version
+# ENGINE_ARTIFACT_DIR="" ปิด cache, ARTIFACT_FORMAT เพิ่มทุกครั้งที่ _featurize / CatalogSnapshot เปลี่ยน
+ARTIFACT_DIR    = os.environ.get("ENGINE_ARTIFACT_DIR", str(Path(__file__).parent.parent / "data" / "engine_cache"))
+ARTIFACT_KEEP   = int(os.environ.get("ENGINE_ARTIFACT_KEEP", "3"))
+ARTIFACT_FORMAT = 6
+# snapshot ที่ add_products ต่อท้ายแล้วอยู่ใน memory ก่อน — เขียนลง artifact รวมครั้งเดียวหลัง add แรกไปกี่วินาที
+# ค่าติดลบ = ไม่ตั้งเวลา (เขียนเมื่อเรียก persist() เอง หรือ rebuild ครั้งถัดไป build artifact ใหม่ทั้งชุด)
+ARTIFACT_PERSIST_DELAY = float(os.environ.get("ENGINE_ARTIFACT_PERSIST_DELAY", "30"))
+
+TZ_BANGKOK = timezone(timedelta(hours=7))
+
+# result cache ของ recommend — จำนวน entry สูงสุด + อายุ (วินาที)
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL  = float(os.environ.get("RESULT_CACHE_TTL", "300"))
+
 # ================================================================
 # ROUTINE STEPS
 # ================================================================
@@ -47,6 +111,11 @@ RETURN_COLS = [
     "skintype", "function_tags", "image_url", "price", "final_score",
 ]
 
+SEARCH_COLS = [
+    "name", "brand", "major_category", "subtype",
+    "skintype", "function_tags", "image_url", "price",
+]
+
 CONCERN_LABEL = {
     "acne_control":   "สิว",
     "brightening":    "หมองคล้ำ/ฝ้า",
@@ -119,6 +188,10 @@ CONCERN_TO_MODEL = {
     "antioxidant":    ["antioxidant", "whitening", "wrinkle", "exfoliation"],
 }
 
+# ลำดับ column ของ concern score matrix (n_products × 8)
+CONCERN_KEYS  = list(CONCERN_ACTIVE_WEIGHTS)
+CONCERN_INDEX = {c: i for i, c in enumerate(CONCERN_KEYS)}
+
 MODEL_TO_COL = {
     "acne":          "active_acne",
     "whitening":     "active_whitening",
@@ -131,6 +204,22 @@ MODEL_TO_COL = {
     "antioxidant":   "active_antioxidant",
 }
 
+# ================================================================
+# SKIN TYPE BITMASK
+# ================================================================
+# bit ของ skintype ที่รู้จัก — product ได้ bit นั้นถ้า skintype (lower) มีคำนั้นอยู่
+# (substring semantics เดียวกับ str.contains เดิม)
+SKIN_BITS = {
+    "oily":        1 << 0,
+    "dry":         1 << 1,
+    "sensitive":   1 << 2,
+    "combination": 1 << 3,
+    "normal":      1 << 4,
+    "all":         1 << 5,
+    "ทุกสภาพผิว":  1 << 6,
+}
+SKIN_ANY = SKIN_BITS["all"] | SKIN_BITS["ทุกสภาพผิว"]
+
 # ================================================================
 # CONTEXT RULES
 # ================================================================
@@ -172,26 +261,85 @@ CONTEXT_RULES = {
     },
 }
 
-# ================================================================
-# HELPERS
-# ================================================================
-def _merge_boosts(context: dict) -> dict:
-    merged = {}
+# tag ทั้งหมดที่ CONTEXT_RULES อ้างถึง — column ของ context tag matrix
+CONTEXT_TAGS      = sorted({
+    tag.lower()
+    for rules in CONTEXT_RULES.values()
+    for boosts in rules.values()
+    for tag in boosts
+})
+CONTEXT_TAG_INDEX = {tag: i for i, tag in enumerate(CONTEXT_TAGS)}
+
+
+def _compile_context_rules() -> dict:
+    """(dimension, value) → boost vector ยาว len(CONTEXT_TAGS)"""
+    vectors = {}
     for key, rule_map in CONTEXT_RULES.items():
-        for tag, w in rule_map.get(context.get(key, ""), {}).items():
-            merged[tag] = merged.get(tag, 0) + w
-    return merged
+        for value, boosts in rule_map.items():
+            vec = np.zeros(len(CONTEXT_TAGS), dtype=np.float64)
+            for tag, w in boosts.items():
+                vec[CONTEXT_TAG_INDEX[tag.lower()]] += w
+            vectors[(key, value)] = vec
+    return vectors
+
 
+CONTEXT_VECTORS = _compile_context_rules()
 
-def _context_score_normalized(function_tags: str, boost_map: dict) -> float:
-    if not boost_map:
-        return 0.0
-    tags = function_tags.lower()
-    raw = sum(w for tag, w in boost_map.items() if tag.lower() in tags)
-    max_possible = sum(boost_map.values())
-    if max_possible == 0:
-        return 0.0
-    return min(raw / max_possible, 1.0)
+# ================================================================
+# HELPERS
+# ================================================================
+def _skin_mask(skintype: str) -> int:
+    st = str(skintype or "").lower()
+    return sum(bit for key, bit in SKIN_BITS.items() if key in st)
+
+
+def _skin_masks(skintypes: pd.Series) -> np.ndarray:
+    lowered = skintypes.fillna("").astype(str).str.lower()
+    masks = np.zeros(len(lowered), dtype=np.uint8)
+    for key, bit in SKIN_BITS.items():
+        masks[lowered.str.contains(key, regex=False).to_numpy()] |= bit
+    return masks
+
+
+def _skin_ok(product_mask: int, product_skin: str, skin_type: str) -> bool:
+    """hard filter ของ product เดียว — skin type ของ user หรือ all/ทุกสภาพผิว"""
+    if product_mask & SKIN_ANY:
+        return True
+    bit = SKIN_BITS.get(skin_type.lower())
+    if bit is not None:
+        return bool(product_mask & bit)
+    return skin_type.lower() in str(product_skin or "").lower()
+
+
+def _context_vector(context: dict) -> np.ndarray:
+    """boost vector ของ context ทั้งชุด — ผลรวม boost ของทุก dimension ที่ user เลือก"""
+    vec = np.zeros(len(CONTEXT_TAGS), dtype=np.float64)
+    for key in CONTEXT_RULES:
+        boost = CONTEXT_VECTORS.get((key, context.get(key, "")))
+        if boost is not None:
+            vec += boost
+    return vec
+
+
+def _context_tag_matrix(function_tags: pd.Series) -> sparse.csr_matrix:
+    """
+    multi-hot (n_products × len(CONTEXT_TAGS)) — column = tag เป็น substring ของ function_tags
+    เช็คทีละ tag แยกกัน ดังนั้น tag ที่เป็น substring ของ tag อื่นก็ได้ผลเหมือน `tag in tags` เดิม
+    """
+    lowered = function_tags.fillna("").astype(str).str.lower()
+    hits = np.column_stack([
+        lowered.str.contains(tag, regex=False).to_numpy(dtype=bool) for tag in CONTEXT_TAGS
+    ])
+    return sparse.csr_matrix(hits, dtype=np.float64)
+
+
+def _context_layer(context_matrix: sparse.csr_matrix, boost_vec: np.ndarray) -> np.ndarray:
+    n = context_matrix.shape[0]
+    max_possible = boost_vec.sum()
+    if max_possible <= 0:
+        return np.zeros(n, dtype=np.float64)
+    raw = context_matrix @ boost_vec
+    return np.minimum(raw / max_possible, 1.0)
 
 
 def _concern_score_normalized(pred: dict, concerns: list) -> tuple:
@@ -226,13 +374,60 @@ def _concern_score_normalized(pred: dict, concerns: list) -> tuple:
     return min(final, 1.0), matched
 
 
-def _top_ingredients(row: pd.Series, model_cats: list, n: int = 3) -> list:
+def _concern_weight_matrix(categories: list) -> np.ndarray:
+    """
+    (n_categories × 8) — คูณกับ probability matrix แล้วได้ concern score
+    ของทุก concern ในครั้งเดียว ให้ผลเท่ากับ _concern_score_normalized ทีละ concern
+    """
+    cat_index = {c: i for i, c in enumerate(categories)}
+    W = np.zeros((len(categories), len(CONCERN_KEYS)), dtype=np.float64)
+    for j, concern in enumerate(CONCERN_KEYS):
+        weights     = CONCERN_ACTIVE_WEIGHTS.get(concern, {})
+        mcats       = CONCERN_TO_MODEL.get(concern, [])
+        denominator = sum(weights.get(mcat, 0.3) for mcat in mcats)
+        if denominator <= 0:
+            continue
+        for mcat in mcats:
+            if mcat in cat_index:
+                W[cat_index[mcat], j] += weights.get(mcat, 0.3) / denominator
+    return W
+
+
+def _concern_layer(concern_matrix: np.ndarray, concerns: list) -> np.ndarray:
+    """column gather + mean — concern ที่ไม่รู้จักนับเป็น 0 เหมือนเดิม"""
+    n = concern_matrix.shape[0]
+    if not concerns:
+        return np.zeros(n, dtype=np.float64)
+    cols = [CONCERN_INDEX[c] for c in concerns if c in CONCERN_INDEX]
+    if not cols:
+        return np.zeros(n, dtype=np.float64)
+    total = concern_matrix[:, cols].sum(axis=1)
+    return np.minimum(total / len(concerns), 1.0)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    index ของ k ค่าสูงสุด เรียงมาก → น้อย โดยไม่ sort ทั้ง array
+    ค่าเท่ากันเรียงตามลำดับเดิมใน array (stable)
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        kth  = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        # เก็บทุกตัวที่เสมอกับตัวที่ k ไว้ด้วย เพื่อให้ tie-break ตามลำดับเดิม
+        cand = np.flatnonzero(scores >= kth)
+    else:
+        cand = np.arange(n)
+    order = np.lexsort((cand, -scores[cand]))
+    return cand[order][:k]
+
+
+def _top_ingredients(frag: dict, model_cats: list, n: int = 3) -> list:
     seen, result = set(), []
     for mcat in model_cats:
-        col = MODEL_TO_COL.get(mcat, "")
-        for ing in str(row.get(col, "") or "").split(","):
-            ing = ing.strip()
-            if ing and ing not in seen:
+        for ing in frag["ingredients"].get(mcat, ()):
+            if ing not in seen:
                 seen.add(ing)
                 result.append(ing)
                 if len(result) >= n:
@@ -240,13 +435,79 @@ def _top_ingredients(row: pd.Series, model_cats: list, n: int = 3) -> list:
     return result
 
 
+def _load_ingredient_descriptions() -> dict:
+    """ingredient (lower) → description_th แบบสั้น (ไม่เกิน 60 ตัวอักษร) โหลดครั้งเดียวตอน import"""
+    if not DESC_PATH.exists():
+        print("⚠️  ingredient_descriptions.json ไม่พบ — explanation จะไม่มี description")
+        return {}
+    raw = json.loads(DESC_PATH.read_text(encoding="utf-8"))
+    short = {}
+    for key, val in raw.items():
+        desc = (val or {}).get("description_th", "")
+        if desc:
+            short[key.lower()] = desc[:60] + "..." if len(desc) > 60 else desc
+    print(f"✅ Ingredient descriptions loaded: {len(short)}")
+    return short
+
+
+INGR_DESC = _load_ingredient_descriptions()
+
+
+def _explanation_fragments(df: pd.DataFrame) -> np.ndarray:
+    """
+    ส่วนของ explanation ที่ไม่ขึ้นกับ user — คำนวณครั้งเดียวต่อ product
+    ingredients : mcat → ingredient ตามลำดับใน active_* column
+    labels      : ingredient → "ingredient (description)" เฉพาะตัวที่มีใน INGR_DESC
+    key_text / free_text : ข้อความ "Key ingredients" / "ปลอดภัย" (None ถ้าไม่มี)
+    """
+    cols = ["skintype", "key_ingredients", "free_from"] + list(MODEL_TO_COL.values())
+    frags = np.empty(len(df), dtype=object)
+    for i, values in enumerate(df[cols].itertuples(index=False, name=None)):
+        row = dict(zip(cols, values))
+
+        ingredients, labels = {}, {}
+        for mcat, col in MODEL_TO_COL.items():
+            ingrs = tuple(
+                ing for ing in (v.strip() for v in str(row[col] or "").split(",")) if ing
+            )
+            ingredients[mcat] = ingrs
+            for ing in ingrs:
+                desc = INGR_DESC.get(ing.lower())
+                if desc:
+                    labels[ing] = f"{ing} ({desc})"
+
+        key = str(row["key_ingredients"] or "").strip()
+        top = [v.strip() for v in key.split(",") if v.strip()][:3]
+        free = str(row["free_from"] or "").strip()
+
+        frags[i] = {
+            "skintype":    str(row["skintype"]).lower(),
+            "ingredients": ingredients,
+            "labels":      labels,
+            "key_text":    f"Key ingredients: {', '.join(top)}" if top else None,
+            "free_text":   f"ปลอดภัย: {free}" if free and free.upper() != "NA" else None,
+        }
+    return frags
+
+
+def _concern_reason_text(frag: dict, label: str, ingrs: list) -> str:
+    if not ingrs:
+        return f"ช่วย{label}"
+    if INGR_DESC:
+        return f"ช่วย{label}: " + " | ".join(frag["labels"].get(ing, ing) for ing in ingrs[:2])
+    return f"ช่วย{label}: {', '.join(ingrs)}"
+
+
 # ================================================================
 # CONCERN MODEL (ML)
 # ================================================================
 class ConcernModel:
     def __init__(self):
-        self.model       = None
+        self._model      = None
+        self._model_path = None
+        self._model_lock = threading.Lock()
         self.categories  = []
+        self.ingredients = []
         self._ingr_index = {}
         self._n_features = 0
         self._load()
@@ -257,33 +518,74 @@ class ConcernModel:
         if not model_path.exists():
             print("⚠️  concern_classifier.pkl ไม่พบ — concern_score = 0")
             return
-        self.model = joblib.load(model_path)
+        self._model_path = model_path
         meta = json.loads(meta_path.read_text(encoding="utf-8"))
         self.categories  = meta["categories"]
+        self.ingredients = meta["ingredients"]
         self._ingr_index = {ing: i for i, ing in enumerate(meta["ingredients"])}
         self._n_features = len(meta["ingredients"])
         print(f"✅ Concern model loaded — {self._n_features} ingredients, {len(self.categories)} categories")
 
-    def _vectorize(self, ingredients_list_str: str) -> np.ndarray:
-        x = np.zeros(self._n_features, dtype=np.float32)
-        for ing in str(ingredients_list_str).split(","):
-            idx = self._ingr_index.get(ing.strip().lower())
-            if idx is not None:
-                x[idx] = 1.0
-        return x
+    @property
+    def model(self):
+        """
+        classifier โหลดตอนใช้ครั้งแรก — unpickle ต้อง import sklearn (~1s)
+        boot จาก artifact ใช้แค่ categories / ingredients จาก meta
+        """
+        if self._model is None and self._model_path is not None:
+            with self._model_lock:
+                if self._model is None:
+                    import joblib
+                    self._model = joblib.load(self._model_path)
+        return self._model
+
+    def vectorize(self, ingredients_lists) -> sparse.csr_matrix:
+        """
+        multi-hot ingredient matrix (n_products × n_features) แบบ sparse CSR
+        tokenize ทั้ง catalog ด้วย pandas string ops — normalize strip().lower() เหมือนตอน train
+        """
+        import pandas as pd
+
+        n = len(ingredients_lists)
+        if n == 0 or self._n_features == 0:
+            return sparse.csr_matrix((n, self._n_features), dtype=np.float32)
+
+        tokens = (
+            pd.Series(ingredients_lists, dtype=object).astype(str)
+            .str.split(",").explode()
+            .str.strip().str.lower()
+            .map(self._ingr_index)
+            .dropna()
+        )
+        rows = tokens.index.to_numpy(dtype=np.int64)
+        cols = tokens.to_numpy(dtype=np.int64)
+        # ingredient ซ้ำใน product เดียวกันนับเป็น 1
+        keys = np.unique(rows * self._n_features + cols)
+        rows, cols = np.divmod(keys, self._n_features)
+        data = np.ones(len(keys), dtype=np.float32)
+        return sparse.csr_matrix((data, (rows, cols)), shape=(n, self._n_features))
 
     def predict_proba(self, ingredients_list_str: str, threshold: float = 0.25) -> dict:
         if self.model is None:
             return {}
-        x = self._vectorize(ingredients_list_str)
-        if x.sum() == 0:
-            return {}
-        proba = self.model.predict_proba(x.reshape(1, -1))[0]
-        return {
-            cat: round(float(p), 3)
-            for cat, p in zip(self.categories, proba)
-            if p >= threshold
-        }
+        proba = self.predict_matrix(self.vectorize([ingredients_list_str]), threshold)[0]
+        return {cat: float(p) for cat, p in zip(self.categories, proba) if p > 0}
+
+    def predict_matrix(self, X: sparse.csr_matrix, threshold: float = 0.25) -> np.ndarray:
+        """
+        predict ทั้ง catalog ในครั้งเดียว → (n_products × n_categories)
+        ค่าที่ต่ำกว่า threshold เป็น 0 และปัด 3 ตำแหน่ง — product ที่ไม่มี ingredient ที่รู้จักได้ 0 ทั้งแถว
+        """
+        n = X.shape[0]
+        if self.model is None or n == 0:
+            return np.zeros((n, len(self.categories)), dtype=np.float64)
+        proba = self.model.predict_proba(X).astype(np.float64)
+        proba[X.getnnz(axis=1) == 0] = 0.0
+        proba[proba < threshold] = 0.0
+        return np.round(proba, 3)
+
+    def pred_from_row(self, proba_row: np.ndarray) -> dict:
+        return {cat: float(p) for cat, p in zip(self.categories, proba_row) if p > 0}
 
     def score_and_match(self, row: pd.Series, concerns: list) -> tuple:
         pred = self.predict_proba(row.get("ingredients_list", ""))
@@ -295,8 +597,9 @@ class ConcernModel:
 # ================================================================
 # EXPLANATION BUILDER
 # ================================================================
-def build_explanation(row: pd.Series, skin_type: str, concerns: list,
+def build_explanation(frag: dict, skin_type: str, concerns: list,
                         matched: dict, scores: dict) -> dict:
+    """frag มาจาก _explanation_fragments — ตอน request เหลือแค่ dict lookup"""
     breakdown = {
         "final":   round(scores.get("final", 0), 4),
         "concern": {"score": round(scores.get("concern", 0), 4), "weight": "55%"},
@@ -309,26 +612,22 @@ def build_explanation(row: pd.Series, skin_type: str, concerns: list,
         label       = CONCERN_LABEL.get(concern, concern)
         sorted_cats = sorted(cat_confs, key=lambda x: -(x[1] * x[2]))
         top_cats    = [mc for mc, _, _ in sorted_cats]
-        ingrs       = _top_ingredients(row, top_cats, n=3)
+        ingrs       = _top_ingredients(frag, top_cats, n=3)
         concern_reasons.append({
             "concern":     concern,
             "label":       label,
             "ingredients": ingrs,
             "top_conf":    round(sorted_cats[0][1], 2) if sorted_cats else 0,
-            "text":        f"ช่วย{label}: {', '.join(ingrs)}" if ingrs else f"ช่วย{label}",
+            "text":        _concern_reason_text(frag, label, ingrs),
         })
 
     other = []
-    if skin_type and skin_type.lower() in str(row.get("skintype", "")).lower():
+    if skin_type and skin_type.lower() in frag["skintype"]:
         other.append(f"เหมาะกับผิว {skin_type}")
-    key = str(row.get("key_ingredients", "") or "").strip()
-    if key:
-        top = [v.strip() for v in key.split(",") if v.strip()][:3]
-        if top:
-            other.append(f"Key ingredients: {', '.join(top)}")
-    free = str(row.get("free_from", "") or "").strip()
-    if free and free.upper() != "NA":
-        other.append(f"ปลอดภัย: {free}")
+    if frag["key_text"]:
+        other.append(frag["key_text"])
+    if frag["free_text"]:
+        other.append(frag["free_text"])
 
     return {
         "score_breakdown":  breakdown,
@@ -338,6 +637,923 @@ def build_explanation(row: pd.Series, skin_type: str, concerns: list,
     }
 
 
+# ================================================================
+# TF-IDF SIMILARITY BANK
+# ================================================================
+def _cosine_similarity(X, Y) -> np.ndarray:
+    # import sklearn ตอนใช้ครั้งแรก (~1s) — ไม่ให้ boot จาก artifact ต้องรอ
+    from sklearn.metrics.pairwise import cosine_similarity
+    return cosine_similarity(X, Y)
+
+
+class SimilarityBank:
+    """
+    memo cosine(query text, ทุก product) ต่อ (skin_type, concerns) — LRU ภายใต้ max_bytes
+    char_wb n-gram นับแยกทีละคำ ลำดับคำไม่มีผล จึงเรียง concerns เป็น key ได้โดย score เท่าเดิม
+    """
+
+    def __init__(self, vectorizer, tfidf_matrix,
+                 max_bytes: int = SIM_BANK_MAX_BYTES, dtype: str = SIM_BANK_DTYPE):
+        self.vectorizer   = vectorizer
+        self.tfidf_matrix = tfidf_matrix
+        self.max_bytes    = max_bytes
+        self.dtype        = np.dtype(dtype)
+        self._vectors     = OrderedDict()
+        self._bytes       = 0
+        self._lock        = threading.Lock()
+
+    @staticmethod
+    def key(skin_type: str, concerns: list) -> tuple:
+        return skin_type, tuple(sorted(concerns))
+
+    def get(self, skin_type: str, concerns: list) -> np.ndarray:
+        """(n_products,) cosine similarity — read-only"""
+        key = self.key(skin_type, concerns)
+        with self._lock:
+            vec = self._vectors.get(key)
+            if vec is not None:
+                self._vectors.move_to_end(key)
+                return vec
+
+        user_vec = self.vectorizer.transform([key[0] + " " + " ".join(key[1])])
+        vec = _cosine_similarity(user_vec, self.tfidf_matrix).ravel().astype(self.dtype)
+        vec.flags.writeable = False
+
+        with self._lock:
+            if key not in self._vectors:
+                self._vectors[key] = vec
+                self._bytes += vec.nbytes
+                while self._bytes > self.max_bytes and len(self._vectors) > 1:
+                    _, old = self._vectors.popitem(last=False)
+                    self._bytes -= old.nbytes
+        return vec
+
+
+# ================================================================
+# SEARCH INDEX
+# ================================================================
+class SearchIndex:
+    """
+    inverted index ของ n-gram 1–3 ตัวอักษรบน name / brand (lower)
+    grams    : (n_grams,) unicode เรียงแล้ว — หา gram ด้วย binary search
+    postings : (n_grams × n_products) CSR bool — แถว i = positions ที่มี grams[i] เรียงตามลำดับ catalog
+    ทั้งสองเป็น .npy ใน artifact (search_grams / search_postings) → worker ทุกตัวแชร์ page cache ชุดเดียว
+    query ยาวไม่เกิน 3 → posting list ตรงๆ, ยาวกว่านั้น → intersect trigram แล้วเช็ค substring ซ้ำ
+    ผลเรียงตาม rank (ชื่อตรง > ขึ้นต้นชื่อ > brand ตรง > ขึ้นต้น brand > ขึ้นต้นคำในชื่อ > อื่นๆ)
+    แล้วตามลำดับ catalog, cache ต่อ query แบบ LRU
+    """
+    N = 3
+
+    def __init__(self, names: np.ndarray, brands: np.ndarray,
+                 cache_size: int = SEARCH_CACHE_SIZE, max_results: int = SEARCH_MAX_RESULTS,
+                 grams: np.ndarray = None, postings: sparse.csr_matrix = None):
+        self.names       = [x.lower() if isinstance(x, str) else "" for x in names]
+        self.brands      = [x.lower() if isinstance(x, str) else "" for x in brands]
+        self.cache_size  = cache_size
+        self.max_results = max_results
+        self._cache      = OrderedDict()
+        self._lock       = threading.Lock()
+        if grams is None:
+            grams, positions = self._pairs(self.names, self.brands, 0)
+            grams, rows      = np.unique(grams, return_inverse=True)
+            postings         = self._postings(rows, positions, len(grams), len(self.names))
+        self.grams    = grams
+        self.postings = postings
+
+    @classmethod
+    def _pairs(cls, names: list, brands: list, start: int) -> tuple:
+        """(grams, positions) ทุกคู่ n-gram / product — gram ซ้ำใน product เดียวกันนับครั้งเดียว"""
+        grams, positions = [], []
+        for pos, (name, brand) in enumerate(zip(names, brands), start):
+            found = set()
+            for text in (name, brand):
+                for n in range(1, cls.N + 1):
+                    found.update(text[i:i + n] for i in range(len(text) - n + 1))
+            grams.extend(found)
+            positions.extend([pos] * len(found))
+        return np.array(grams, dtype=f"U{cls.N}"), np.array(positions, dtype=np.int64)
+
+    @staticmethod
+    def _postings(rows: np.ndarray, positions: np.ndarray, n_grams: int, n_products: int):
+        """
+        CSR (n_grams × n_products) จากคู่ (แถวของ gram, position)
+        argsort แบบ stable — position ในแถวเดียวกันคงลำดับที่ส่งมา (เรียงตาม catalog อยู่แล้ว)
+        """
+        order  = np.argsort(rows, kind="stable")
+        indptr = np.zeros(n_grams + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_grams), out=indptr[1:])
+        return sparse.csr_matrix(
+            (np.ones(len(order), dtype=bool), positions[order], indptr), shape=(n_grams, n_products)
+        )
+
+    def extended(self, names: np.ndarray, brands: np.ndarray) -> "SearchIndex":
+        """index ใหม่ที่มี product ต่อท้าย — posting เดิมอยู่หน้า position ใหม่ในแต่ละแถวเสมอ"""
+        index = SearchIndex([], [], self.cache_size, self.max_results)
+        new_names   = [x.lower() if isinstance(x, str) else "" for x in names]
+        new_brands  = [x.lower() if isinstance(x, str) else "" for x in brands]
+        index.names  = self.names + new_names
+        index.brands = self.brands + new_brands
+
+        grams, positions = self._pairs(new_names, new_brands, len(self.names))
+        index.grams = np.union1d(self.grams, grams).astype(self.grams.dtype)
+        old_rows    = np.repeat(np.arange(len(self.grams)), np.diff(self.postings.indptr))
+        rows = np.concatenate([
+            np.searchsorted(index.grams, self.grams)[old_rows],
+            np.searchsorted(index.grams, grams),
+        ])
+        positions = np.concatenate([self.postings.indices, positions])
+        index.postings = self._postings(rows, positions, len(index.grams), len(index.names))
+        return index
+
+    def posting(self, gram: str) -> np.ndarray:
+        """positions ที่ name / brand มี gram (เรียงตามลำดับ catalog) — slice ของ postings ไม่ copy"""
+        i = int(np.searchsorted(self.grams, gram))
+        if i < len(self.grams) and self.grams[i] == gram:
+            return self.postings.indices[self.postings.indptr[i]:self.postings.indptr[i + 1]]
+        return np.empty(0, dtype=np.int64)
+
+    def _matches(self, q: str) -> np.ndarray:
+        """positions ที่ name หรือ brand มี q เป็น substring (เรียงตามลำดับ catalog)"""
+        if len(q) <= self.N:
+            return self.posting(q)
+        postings = [self.posting(g) for g in {q[i:i + self.N] for i in range(len(q) - self.N + 1)}]
+        postings.sort(key=len)
+        cand = postings[0]
+        for posting in postings[1:]:
+            if not len(cand):
+                break
+            cand = np.intersect1d(cand, posting, assume_unique=True)
+        return np.array(
+            [p for p in cand if q in self.names[p] or q in self.brands[p]], dtype=np.int64
+        )
+
+    def _rank(self, q: str, pos: np.ndarray) -> np.ndarray:
+        ranks = np.empty(len(pos), dtype=np.int8)
+        for i, p in enumerate(pos):
+            name, brand = self.names[p], self.brands[p]
+            if name == q:
+                ranks[i] = 0
+            elif name.startswith(q):
+                ranks[i] = 1
+            elif brand == q:
+                ranks[i] = 2
+            elif brand.startswith(q):
+                ranks[i] = 3
+            elif any(w.startswith(q) for w in name.split()):
+                ranks[i] = 4
+            else:
+                ranks[i] = 5
+        return pos[np.lexsort((pos, ranks))]
+
+    def search(self, q: str, fallback=None) -> np.ndarray:
+        """
+        ranked positions ของ query ที่ normalize แล้ว (ไม่เกิน max_results)
+        ถ้าไม่มี name/brand ไหนตรง และมี fallback → ใช้ fallback(q) แทน
+        """
+        with self._lock:
+            hit = self._cache.get(q)
+            if hit is not None:
+                self._cache.move_to_end(q)
+                return hit
+
+        ranked = self._rank(q, self._matches(q))[:self.max_results]
+        if not len(ranked) and fallback is not None:
+            ranked = fallback(q)
+        ranked.flags.writeable = False
+
+        with self._lock:
+            self._cache[q] = ranked
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return ranked
+
+
+# ================================================================
+# AUTOCOMPLETE
+# ================================================================
+class Autocomplete:
+    """
+    prefix lookup ด้วย sorted array + bisect
+    entries = (text, type, popularity) — text ซ้ำ (ไม่สนตัวพิมพ์) ใน type เดียวกันรวม popularity
+    product / brand ที่ popularity รวมเหลือ ≤ 0 (สินค้าถูก mask ออกหมด ดู CatalogSnapshot.without) ถูกตัดทิ้ง
+    prefix สั้น (≤ AUTOCOMPLETE_PRECOMPUTE_LEN) ช่วงกว้างมาก → คำนวณ top ไว้ก่อนตอน build
+    """
+
+    def __init__(self, entries, max_limit: int = AUTOCOMPLETE_MAX_LIMIT,
+                 precompute_len: int = AUTOCOMPLETE_PRECOMPUTE_LEN):
+        merged = {}
+        for text, kind, popularity in entries:
+            if not isinstance(text, str) or not text.strip():
+                continue
+            key = (text.strip().lower(), kind)
+            if key in merged:
+                merged[key][1] += popularity
+            else:
+                merged[key] = [text.strip(), popularity]
+
+        items = sorted(((key, value) for key, value in merged.items()
+                        if value[1] > 0 or key[1] == "ingredient"), key=lambda kv: kv[0])
+        self.keys       = [k for (k, _), _ in items]
+        self.kinds      = [kind for (_, kind), _ in items]
+        self.texts      = [text for _, (text, _) in items]
+        self.popularity = np.array([pop for _, (_, pop) in items], dtype=np.float64)
+        self.max_limit      = max_limit
+        self.precompute_len = precompute_len
+
+        self._top = {}
+        for n in range(1, precompute_len + 1):
+            for prefix in {k[:n] for k in self.keys if len(k) >= n}:
+                self._top[prefix] = self._rank(*self._range(prefix))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def extended(self, entries) -> "Autocomplete":
+        """Autocomplete ใหม่ที่รวม entries เพิ่ม (popularity ของ text เดิมบวกเพิ่ม)"""
+        current = list(zip(self.texts, self.kinds, self.popularity.tolist()))
+        return Autocomplete(current + list(entries), self.max_limit, self.precompute_len)
+
+    def ingredients(self) -> list:
+        return [t for t, k in zip(self.texts, self.kinds) if k == "ingredient"]
+
+    def _range(self, prefix: str):
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + "\uffff", lo)
+        return lo, hi
+
+    def _rank(self, lo: int, hi: int) -> np.ndarray:
+        """index ของ entries ใน [lo, hi) เรียง popularity มาก → น้อย แล้วตามตัวอักษร"""
+        pop = self.popularity[lo:hi]
+        if hi - lo > self.max_limit:
+            cut = np.partition(pop, hi - lo - self.max_limit)[hi - lo - self.max_limit]
+            idx = np.flatnonzero(pop >= cut)
+        else:
+            idx = np.arange(hi - lo)
+        idx = idx[np.lexsort((idx, -pop[idx]))][:self.max_limit]
+        return idx + lo
+
+    def suggest(self, prefix: str, limit: int = 10) -> list:
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        top = self._top.get(prefix)
+        if top is None:
+            top = self._rank(*self._range(prefix))
+        return [
+            {"text": self.texts[i], "type": self.kinds[i]}
+            for i in top[:min(limit, self.max_limit)]
+        ]
+
+
+def _autocomplete_counts(df: pd.DataFrame, ingredient_names: list) -> dict:
+    """
+    ส่วนของ popularity ใน autocomplete ที่มาจากแต่ละสินค้า — snapshot เก็บไว้ให้ without() หักออกได้
+    autocomplete_weight : (n_products,) 1 + rating_count — popularity ที่ให้ชื่อสินค้า / brand
+    autocomplete_hits   : (n_products × len(ingredient_names)) CSR จำนวนครั้งที่ ingredient อยู่ใน ingredients_list
+    """
+    import pandas as pd
+
+    rating_count = (
+        pd.to_numeric(df["rating_count"], errors="coerce").fillna(0)
+        if "rating_count" in df.columns else pd.Series(0, index=df.index)
+    )
+    index  = {ing.strip().lower(): j for j, ing in enumerate(ingredient_names)}
+    tokens = (df["ingredients_list"].reset_index(drop=True)
+              .str.split(",").explode().str.strip().str.lower())
+    cols   = tokens.map(index).dropna()
+    hits   = sparse.csr_matrix(
+        (np.ones(len(cols)), (cols.index.to_numpy(), cols.to_numpy(dtype=np.int64))),
+        shape=(len(df), len(ingredient_names)),
+    )
+    return {
+        "autocomplete_weight": (rating_count + 1).to_numpy(dtype=np.float64),
+        "autocomplete_hits":   hits,
+    }
+
+
+def _autocomplete_entries(names, brands, ingredient_names: list, weight, hits) -> list:
+    """
+    (text, type, popularity) ของสินค้าชุดหนึ่ง — weight / hits จาก _autocomplete_counts
+    popularity: product name / brand = ผลรวม (1 + rating_count) ของสินค้า
+    ingredient = จำนวนสินค้าที่มี ingredient นั้นใน ingredients_list
+    weight / hits ติดลบ = หักสินค้าชุดนั้นออก
+    """
+    weight   = np.asarray(weight, dtype=np.float64).tolist()
+    counts   = np.asarray(hits.sum(axis=0)).ravel()
+    entries  = list(zip(list(names), ["product"] * len(weight), weight))
+    entries += list(zip(list(brands), ["brand"] * len(weight), weight))
+    entries += [(ing, "ingredient", float(n)) for ing, n in zip(ingredient_names, counts)]
+    return entries
+
+
+# ================================================================
+# RESULT CACHE
+# ================================================================
+class ResultCache:
+    """
+    LRU + TTL ของผล recommend — key ต้องมี catalog version อยู่ด้วย
+    เจอ version ใหม่เมื่อไหร่ ล้าง entry ของ version เก่าทิ้งทั้งหมด
+    ค่าที่ได้จาก get() ใช้ร่วมกันหลาย request ห้ามแก้ไข
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl         = ttl
+        self._entries    = OrderedDict()   # key → (expires_at, value)
+        self._version    = None
+        self._lock       = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, version, key):
+        with self._lock:
+            entry = self._entries.get(key) if version == self._version else None
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, version, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "version":   self._version,
+                "size":      len(self._entries),
+                "hits":      self.hits,
+                "misses":    self.misses,
+                "evictions": self.evictions,
+                "hit_rate":  round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def _profile_key(skin_type: str, concerns: list, min_price: float,
+                 max_price: float, context: dict) -> tuple:
+    """
+    key ของ profile สำหรับ ResultCache — เก็บเฉพาะสิ่งที่มีผลต่อผลลัพธ์
+    concerns คงลำดับไว้ เพราะลำดับ concern_reasons ใน explanation ตามลำดับนี้
+    context ที่ไม่มีใน CONTEXT_RULES ไม่มีผล จึง normalize เป็น ""
+    """
+    return (skin_type, tuple(concerns), float(min_price), float(max_price), _context_key(context))
+
+
+def _context_key(context: dict) -> tuple:
+    ctx = []
+    for key in CONTEXT_RULES:
+        value = context.get(key, "")
+        ctx.append((key, value if (key, value) in CONTEXT_VECTORS else ""))
+    return tuple(ctx)
+
+
+def _user_signature(skin_type: str, concerns: list, context: dict) -> tuple:
+    """
+    กลุ่ม user ที่ได้ score เท่ากันทุก product — concern เรียงใหม่ได้
+    (concern score เป็นค่าเฉลี่ย, char n-gram ของ TF-IDF ไม่สนลำดับคำ)
+    """
+    return (skin_type or "", tuple(sorted(concerns or [])),
+            _context_key(context or {}))
+
+
+# ================================================================
+# USER PROFILE CODEC  (แถวใน user_profiles)
+# concern_bits : bit i = CONCERN_KEYS[i]
+# <dim>_code   : 1 + ลำดับค่าใน CONTEXT_RULES[dim], 0 = ไม่ได้ระบุ
+# ================================================================
+CONTEXT_VALUES = {dim: list(rules) for dim, rules in CONTEXT_RULES.items()}
+
+
+def encode_concern_bits(concerns: list) -> int:
+    """concern ที่ไม่รู้จักไม่มี bit จึงถูกตัดทิ้ง"""
+    return sum(1 << CONCERN_INDEX[c] for c in set(concerns or []) if c in CONCERN_INDEX)
+
+
+def decode_concern_bits(bits: int) -> list:
+    return [c for i, c in enumerate(CONCERN_KEYS) if bits >> i & 1]
+
+
+def encode_profile(skin_type: str, concerns: list, context: dict) -> dict:
+    context = context or {}
+    profile = {
+        "skin_type":    (skin_type or "all").lower(),
+        "concern_bits": encode_concern_bits(concerns),
+    }
+    for dim, values in CONTEXT_VALUES.items():
+        value = context.get(dim, "")
+        profile[f"{dim}_code"] = values.index(value) + 1 if value in values else 0
+    return profile
+
+
+def decode_profile(row: dict) -> dict:
+    """แถว user_profiles → user dict แบบที่ find_matching_users รับ"""
+    context = {}
+    for dim, values in CONTEXT_VALUES.items():
+        code = row.get(f"{dim}_code") or 0
+        if 0 < code <= len(values):
+            context[dim] = values[code - 1]
+    return {
+        "user_id":   row.get("user_id"),
+        "email":     row.get("email"),
+        "skin_type": row.get("skin_type", ""),
+        "concerns":  decode_concern_bits(row.get("concern_bits") or 0),
+        "context":   context,
+    }
+
+
+def _encode_cursor(version: int, offset: int) -> str:
+    return base64.urlsafe_b64encode(f"{version}:{offset}".encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    """(snapshot version ตอนออก cursor, offset) — raise ValueError ถ้า cursor ผิดรูปแบบ"""
+    try:
+        version, offset = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        version, offset = int(version), int(offset)
+    except (ValueError, UnicodeDecodeError, AttributeError):
+        raise ValueError("invalid cursor")
+    if offset < 0:
+        raise ValueError("invalid cursor")
+    return version, offset
+
+
+# ================================================================
+# CATALOG SNAPSHOT
+# ================================================================
+_SNAPSHOT_VERSIONS = itertools.count(1)
+
+
+class CatalogSnapshot:
+    """
+    state ของ catalog ที่ใช้ตอน score — column arrays + matrices + indexes
+    สร้างครั้งเดียวแล้วไม่แก้ไขอีก ทุก request อ่านอย่างเดียวจาก position arrays
+    """
+
+    def __init__(self, columns: dict, price: np.ndarray, is_new: np.ndarray,
+                 fragments: PackedObjects, vectorizer, tfidf_matrix, ingredient_matrix,
+                 concern_proba: np.ndarray, concern_matrix: np.ndarray,
+                 context_matrix, skin_mask: np.ndarray, routine_masks: np.ndarray,
+                 autocomplete: Autocomplete, autocomplete_weight: np.ndarray, autocomplete_hits,
+                 search_index: SearchIndex = None,
+                 search_grams: np.ndarray = None, search_postings: sparse.csr_matrix = None,
+                 created_at: np.ndarray = None, alive: np.ndarray = None):
+        self.columns           = columns          # col → object array (เฉพาะที่ใช้ตอบ/อธิบาย)
+        self.price             = price            # (n_products,) float64, ไม่มีราคา = 0
+        self.is_new            = is_new           # (n_products,) bool
+        self.fragments         = fragments        # (n_products,) dict แบบ PackedObjects — ดู _explanation_fragments
+        self.vectorizer        = vectorizer
+        self.tfidf_matrix      = tfidf_matrix
+        self.ingredient_matrix = ingredient_matrix   # (n_products × n_ingredients) CSR multi-hot
+        self.concern_proba     = concern_proba       # (n_products × 9)  model probability
+        self.concern_matrix    = concern_matrix      # (n_products × 8)  score ต่อ concern
+        self.context_matrix    = context_matrix      # (n_products × len(CONTEXT_TAGS)) CSR multi-hot
+        self.skin_mask         = skin_mask           # (n_products,)  uint8 — ดู SKIN_BITS
+        self.routine_masks     = routine_masks       # (len(ROUTINE_STEPS) × n_products) bool
+        self.created_at        = created_at          # (n_products,) datetime64 UTC หรือ None — ที่มาของ is_new
+        # (n_products,) bool — False = ถูก UPDATE / DELETE ไปแล้ว (ดู without) ไม่อยู่ใน price index
+        self.alive             = np.ones(len(price), dtype=bool) if alive is None else alive
+        self.n_alive           = int(self.alive.sum())
+        self.similarity        = SimilarityBank(vectorizer, tfidf_matrix)
+        # artifact เก็บแค่ grams / postings — names / brands (lower) คำนวณจาก columns ตอนโหลด
+        self.search_index      = search_index or SearchIndex(
+            columns["name"], columns["brand"], grams=search_grams, postings=search_postings
+        )
+        self.autocomplete      = autocomplete
+        # ส่วนของ popularity ใน autocomplete ต่อสินค้า — ดู _autocomplete_counts
+        self.autocomplete_weight = autocomplete_weight   # (n_products,) float64
+        self.autocomplete_hits   = autocomplete_hits     # (n_products × len(autocomplete.ingredients())) CSR
+        self.version           = next(_SNAPSHOT_VERSIONS)   # เปลี่ยนทุกครั้งที่ build ใหม่
+
+        # ── Price index (เฉพาะ alive — ทุก recommend เริ่มจาก price_candidates) ──
+        has_price         = price > 0
+        priced            = np.flatnonzero(has_price & self.alive)
+        self.price_order  = priced[np.argsort(price[priced], kind="stable")]
+        self.price_sorted = price[self.price_order]
+        self.no_price_pos = np.flatnonzero(~has_price & self.alive)
+
+        for arr in (*columns.values(), price, is_new, fragments.data, fragments.offsets,
+                    concern_proba, concern_matrix,
+                    skin_mask, routine_masks, autocomplete_weight, self.alive,
+                    self.price_order, self.price_sorted, self.no_price_pos):
+            arr.flags.writeable = False
+        if created_at is not None:
+            created_at.flags.writeable = False
+
+    def __len__(self) -> int:
+        return len(self.price)
+
+    def extended(self, parts: dict) -> "CatalogSnapshot":
+        """
+        snapshot ใหม่ที่มี product ใน parts ต่อท้าย (parts มาจาก DataLoader._featurize
+        ด้วย vectorizer ตัวเดิม + _autocomplete_counts บน autocomplete.ingredients())
+        — snapshot นี้ไม่ถูกแก้ request ที่ถืออยู่ยังอ่านได้ตามเดิม
+        """
+        autocomplete_entries = _autocomplete_entries(
+            parts["columns"]["name"], parts["columns"]["brand"], self.autocomplete.ingredients(),
+            parts["autocomplete_weight"], parts["autocomplete_hits"],
+        )
+        return CatalogSnapshot(
+            columns           = {
+                col: np.concatenate([arr, parts["columns"][col]])
+                for col, arr in self.columns.items()
+            },
+            price             = np.concatenate([self.price, parts["price"]]),
+            is_new            = np.concatenate([self.is_new, parts["is_new"]]),
+            fragments         = self.fragments.extended(parts["fragments"]),
+            vectorizer        = self.vectorizer,
+            tfidf_matrix      = sparse.vstack([self.tfidf_matrix, parts["tfidf_matrix"]], format="csr"),
+            ingredient_matrix = sparse.vstack([self.ingredient_matrix, parts["ingredient_matrix"]], format="csr"),
+            concern_proba     = np.vstack([self.concern_proba, parts["concern_proba"]]),
+            concern_matrix    = np.vstack([self.concern_matrix, parts["concern_matrix"]]),
+            context_matrix    = sparse.vstack([self.context_matrix, parts["context_matrix"]], format="csr"),
+            skin_mask         = np.concatenate([self.skin_mask, parts["skin_mask"]]),
+            routine_masks     = np.hstack([self.routine_masks, parts["routine_masks"]]),
+            autocomplete      = self.autocomplete.extended(autocomplete_entries),
+            autocomplete_weight = np.concatenate([self.autocomplete_weight, parts["autocomplete_weight"]]),
+            autocomplete_hits   = sparse.vstack([self.autocomplete_hits, parts["autocomplete_hits"]], format="csr"),
+            search_index      = self.search_index.extended(
+                parts["columns"]["name"], parts["columns"]["brand"]
+            ),
+            created_at        = (np.concatenate([self.created_at, parts["created_at"]])
+                                 if self.created_at is not None and parts["created_at"] is not None
+                                 else None),
+            alive             = np.concatenate([self.alive, np.ones(len(parts["price"]), dtype=bool)]),
+        )
+
+    def without(self, ids) -> "CatalogSnapshot":
+        """
+        snapshot ใหม่ที่ mask product ตาม id ออก (UPDATE / DELETE) — array / matrix ใช้ร่วมกับ
+        ตัวเดิมทั้งหมด ไม่มีการ copy ไม่มี id ไหนตรง → คืนตัวเดิม
+        autocomplete หัก popularity ของสินค้าที่ mask (ชื่อ / brand ที่ไม่เหลือสินค้าหายไป)
+        """
+        ids  = set(ids)
+        drop = np.fromiter((i in ids for i in self.columns["id"]), dtype=bool, count=len(self))
+        gone = np.flatnonzero(drop & self.alive)
+        if not len(gone):
+            return self
+        autocomplete = self.autocomplete.extended(_autocomplete_entries(
+            self.columns["name"][gone], self.columns["brand"][gone], self.autocomplete.ingredients(),
+            -self.autocomplete_weight[gone], -self.autocomplete_hits[gone],
+        ))
+        return CatalogSnapshot(**dict(self.artifact(), alive=self.alive & ~drop,
+                                      autocomplete=autocomplete, search_index=self.search_index))
+
+    def artifact(self) -> dict:
+        """ทุกอย่างที่ต้องใช้สร้าง snapshot นี้ใหม่ (ไม่รวม SimilarityBank / price index ที่คำนวณเร็ว)"""
+        return dict(
+            columns           = self.columns,
+            price             = self.price,
+            is_new            = self.is_new,
+            fragments         = self.fragments,
+            vectorizer        = self.vectorizer,
+            tfidf_matrix      = self.tfidf_matrix,
+            ingredient_matrix = self.ingredient_matrix,
+            concern_proba     = self.concern_proba,
+            concern_matrix    = self.concern_matrix,
+            context_matrix    = self.context_matrix,
+            skin_mask         = self.skin_mask,
+            routine_masks     = self.routine_masks,
+            autocomplete      = self.autocomplete,
+            autocomplete_weight = self.autocomplete_weight,
+            autocomplete_hits   = self.autocomplete_hits,
+            search_grams      = self.search_index.grams,
+            search_postings   = self.search_index.postings,
+            created_at        = self.created_at,
+            alive             = self.alive,
+        )
+
+    def price_candidates(self, min_price: float, max_price: float) -> np.ndarray:
+        """
+        positions ที่ราคาอยู่ในช่วง [min_price, max_price] + product ที่ไม่มีราคา
+        binary search บน price_sorted → slice ต่อเนื่อง, เรียงกลับเป็นลำดับ catalog
+        """
+        lo = np.searchsorted(self.price_sorted, min_price, side="left")
+        hi = np.searchsorted(self.price_sorted, max_price, side="right")
+        in_range = np.sort(self.price_order[lo:hi])
+        return np.concatenate([in_range, self.no_price_pos])
+
+    def skin_hits(self, pos: np.ndarray, skin_type: str) -> np.ndarray:
+        """skintype ของ product ที่ตำแหน่ง pos มี skin_type ของ user หรือไม่ (bool array)"""
+        st  = skin_type.lower()
+        bit = SKIN_BITS.get(st)
+        if bit is not None:
+            return (self.skin_mask[pos] & bit) != 0
+        # skin type ที่ไม่อยู่ใน SKIN_BITS — เทียบ string ตรงๆ
+        skintypes = self.columns["skintype"][pos]
+        return np.array([st in str(x).lower() for x in skintypes], dtype=bool)
+
+    def row(self, pos: int) -> dict:
+        """materialize product ที่ตำแหน่ง pos เป็น dict — ทำเฉพาะแถวที่จะตอบกลับ"""
+        row = {col: arr[pos] for col, arr in self.columns.items()}
+        row["price"]  = float(self.price[pos])
+        row["is_new"] = bool(self.is_new[pos])
+        return row
+
+
+# ================================================================
+# ARTIFACT CACHE
+# snapshot ที่ build แล้วเก็บลง disk ต่อ key — boot ครั้งถัดไปที่ catalog เหมือนเดิม
+# โหลดไฟล์แทนการ fit TF-IDF / รัน concern model ใหม่, ถ้าต่อ DB ไม่ได้ใช้ตัวล่าสุด (LATEST)
+# matrix / array เป็น .npy ที่ mmap แบบ read-only → ทุก worker process แชร์ memory ชุดเดียว
+# (object ที่เหลือใช้ pickle ตรงๆ — joblib.load ช้ากว่า ~5 เท่ากับ object array อย่าง columns)
+# เขียน directory ชั่วคราวแล้ว os.replace — worker หลายตัวเขียนพร้อมกันได้
+# ================================================================
+def _utc_datetimes(created_at) -> np.ndarray:
+    """
+    created_at (datetime / string / Series) → datetime64[ns] UTC แบบที่ artifact เก็บ
+    เป็น datetime64 อยู่แล้ว → คืนตามเดิม (numpy ล้วน, boot ไม่ต้อง import pandas)
+    """
+    if isinstance(created_at, np.ndarray) and created_at.dtype.kind == "M":
+        return created_at
+    import pandas as pd
+    return (pd.to_datetime(pd.Series(created_at), utc=True, errors="coerce")
+            .dt.tz_localize(None).to_numpy(dtype="datetime64[ns]"))
+
+
+def _new_flags(created_at) -> np.ndarray:
+    """created_at ภายใน 7 วันล่าสุด → True — คำนวณใหม่ตอนโหลด artifact ด้วย"""
+    created_at = _utc_datetimes(created_at)
+    now   = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), "ns")
+    valid = ~np.isnat(created_at)
+    flags = np.zeros(len(created_at), dtype=bool)
+    flags[valid] = (now - created_at[valid]) // np.timedelta64(1, "D") <= 7
+    return flags
+
+
+class PackedObjects:
+    """
+    object ต่อ product (fragments) pickle ทีละตัวต่อกันใน buffer เดียว
+      data    : (n_bytes,) uint8
+      offsets : (n + 1,) int64 — ตัวที่ i = data[offsets[i]:offsets[i + 1]]
+    artifact เก็บเป็น .npy (ArtifactStore.PACKED) เปิดแบบ mmap → ไม่มีสำเนาต่อ worker
+    unpickle เฉพาะตัวที่อ่าน (explanation ของ top-N) แทนทั้ง catalog ตอน boot
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data    = data
+        self.offsets = offsets
+
+    @classmethod
+    def pack(cls, objects) -> "PackedObjects":
+        blobs   = [pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL) for obj in objects]
+        offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in blobs], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(blobs), dtype=np.uint8), offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int):
+        return pickle.loads(self.data[self.offsets[i]:self.offsets[i + 1]])
+
+    def extended(self, other: "PackedObjects") -> "PackedObjects":
+        return PackedObjects(
+            np.concatenate([self.data, other.data]),
+            np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]]),
+        )
+
+
+class LazyPickle:
+    """
+    object ที่ unpickle ตอนใช้ครั้งแรก แล้วส่ง attribute ต่อให้ object จริง
+    ใช้กับ vectorizer ใน artifact — unpickle ต้อง import sklearn (~1s) ซึ่ง boot ไม่จำเป็นต้องรอ
+    """
+
+    def __init__(self, blob: bytes):
+        self._blob = blob
+        self._obj  = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._obj is None:
+            with self._lock:
+                if self._obj is None:
+                    self._obj  = pickle.loads(self._blob)
+                    self._blob = None
+        return self._obj
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __reduce__(self):
+        return pickle.loads, (pickle.dumps(self.get(), protocol=pickle.HIGHEST_PROTOCOL),)
+
+
+class ArtifactStore:
+    """
+    artifact หนึ่งตัว = directory catalog-<key>/
+      <name>.npy                          numeric arrays (ARRAYS)
+      <name>.data/.indices/.indptr.npy    CSR buffers (MATRICES)
+      <name>.data/.offsets.npy            PackedObjects (PACKED)
+      vectorizer.pkl                      unpickle ตอนใช้ครั้งแรก (LAZY)
+      objects.pkl                         ที่เหลือ — columns (object arrays) + Autocomplete
+      STAMP                               catalog_version stamp ตอน build (ดู DataLoader._read_catalog_version)
+    .npy เปิดด้วย mmap_mode="r" → worker ทุกตัวที่โหลด key เดียวกันใช้ page cache ชุดเดียว
+    ส่วนที่ยังเป็นสำเนาต่อ worker (catalog 5,320 product ≈ 3 MB heap หลังโหลด): columns + Autocomplete
+    จาก objects.pkl และ names / brands ของ SearchIndex ที่คำนวณจาก columns
+    (columns ถูก index แบบ numpy object array ทุก request, autocomplete bisect บน list ของ str)
+    """
+    LATEST   = "LATEST"
+    STAMP    = "STAMP"
+    OBJECTS  = "objects.pkl"
+    LAZY     = ("vectorizer",)   # pickle แยกไฟล์ unpickle ตอนใช้ครั้งแรก (import sklearn)
+    ARRAYS   = ("price", "is_new", "concern_proba", "concern_matrix", "skin_mask", "routine_masks",
+                "created_at", "alive", "autocomplete_weight", "search_grams")
+    MATRICES = ("tfidf_matrix", "ingredient_matrix", "context_matrix", "autocomplete_hits",
+                "search_postings")
+    CSR_BUFFERS = ("data", "indices", "indptr")
+    PACKED   = ("fragments",)
+    PACKED_BUFFERS = ("data", "offsets")
+
+    def __init__(self, directory: str = ARTIFACT_DIR, keep: int = ARTIFACT_KEEP):
+        self.directory = Path(directory) if directory else None
+        self.keep      = keep
+        self.model_version = self._model_version()
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    @staticmethod
+    def _model_version() -> str:
+        """ARTIFACT_FORMAT + ไฟล์ model / description ที่มีผลต่อ feature ของ product"""
+        h = hashlib.sha1(str(ARTIFACT_FORMAT).encode())
+        for path in (MODEL_DIR / "concern_classifier.pkl", MODEL_DIR / "concern_meta.json", DESC_PATH):
+            if path.exists():
+                stat = path.stat()
+                h.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return h.hexdigest()[:12]
+
+    def key(self, rows: list, ingredient_names: list) -> str:
+        """hash ของเนื้อหา catalog ตามลำดับแถว (ลำดับ = position ใน snapshot) + model version"""
+        h = hashlib.sha256()
+        for row in rows:
+            h.update(json.dumps(row, sort_keys=True, default=str).encode())
+            h.update(b"\n")
+        h.update(json.dumps(ingredient_names, default=str).encode())
+        return f"{h.hexdigest()[:16]}-{self.model_version}"
+
+    def derived_key(self, base: str, rows: list, remove_ids=()) -> str:
+        """
+        key ของ snapshot ที่ได้จาก artifact base + mask remove_ids + ต่อท้าย rows
+        ไม่ต้องอ่าน catalog ทั้งหมดมา hash — worker ที่ได้ change เดียวกันบน base เดียวกันจึงได้ key เดียวกัน
+        """
+        h = hashlib.sha256(base.encode())
+        h.update(json.dumps(sorted(remove_ids), default=str).encode())
+        for row in rows:
+            h.update(json.dumps(row, sort_keys=True, default=str).encode())
+            h.update(b"\n")
+        return f"{h.hexdigest()[:16]}-{self.model_version}"
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"catalog-{key}"
+
+    @contextmanager
+    def building(self):
+        """
+        lock ข้าม process ระหว่าง build — worker ที่ boot พร้อมกันรอตัวแรก build เสร็จ
+        แล้วโหลด artifact แทนที่จะ build ซ้ำ (ไม่มี fcntl เช่นบน Windows → ไม่ lock)
+        """
+        if not self.enabled or fcntl is None:
+            yield
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / ".build.lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load(self, key: str = None):
+        """(key, parts) ของ artifact ตาม key หรือตัวล่าสุดถ้าไม่ระบุ — ไม่มี / อ่านไม่ได้ → None"""
+        if not self.enabled:
+            return None
+        try:
+            if key is None:
+                key = (self.directory / self.LATEST).read_text(encoding="utf-8").strip()
+            path = self._path(key)
+            if not (path / self.OBJECTS).exists():
+                return None
+            with open(path / self.OBJECTS, "rb") as f:
+                parts = pickle.load(f)
+            if parts.pop("format", None) != ARTIFACT_FORMAT:
+                return None
+            shapes = parts.pop("shapes")
+
+            for name in self.LAZY:
+                parts[name] = LazyPickle((path / f"{name}.pkl").read_bytes())
+            for name in self.ARRAYS:
+                if (path / f"{name}.npy").exists():
+                    parts[name] = np.load(path / f"{name}.npy", mmap_mode="r")
+            for name in self.MATRICES:
+                data, indices, indptr = (
+                    np.load(path / f"{name}.{buf}.npy", mmap_mode="r") for buf in self.CSR_BUFFERS
+                )
+                parts[name] = sparse.csr_matrix((data, indices, indptr), shape=shapes[name], copy=False)
+            for name in self.PACKED:
+                parts[name] = PackedObjects(*(
+                    np.load(path / f"{name}.{buf}.npy", mmap_mode="r") for buf in self.PACKED_BUFFERS
+                ))
+        except Exception as e:
+            print(f"⚠️  โหลด artifact ไม่ได้ ({e})")
+            return None
+        return key, parts
+
+    def find(self, stamp: str):
+        """key ของ artifact ที่ build จาก catalog ตาม stamp นี้ (และ model version ปัจจุบัน)"""
+        if not self.enabled or not self.directory.exists():
+            return None
+        for path in self.directory.glob(f"catalog-*-{self.model_version}"):
+            try:
+                if (path / self.STAMP).read_text(encoding="utf-8") == stamp:
+                    return path.name[len("catalog-"):]
+            except OSError:
+                continue
+        return None
+
+    def mark(self, key: str, stamp: str):
+        if not self.enabled or not key or not stamp:
+            return
+        try:
+            tmp = self.directory / f".{self.STAMP}.{os.getpid()}.tmp"
+            tmp.write_text(stamp, encoding="utf-8")
+            os.replace(tmp, self._path(key) / self.STAMP)
+        except OSError as e:
+            print(f"⚠️  บันทึก stamp ไม่ได้ ({e})")
+
+    def save(self, key: str, parts: dict, stamp: str = None) -> bool:
+        if not self.enabled:
+            return False
+        path = self._path(key)
+        tmp  = self.directory / f".catalog-{key}.{os.getpid()}.tmp"
+        try:
+            tmp.mkdir(parents=True, exist_ok=True)
+            objects = {"format": ARTIFACT_FORMAT, "shapes": {}}
+            for name, value in parts.items():
+                if name in self.ARRAYS:
+                    if value is not None:
+                        np.save(tmp / f"{name}.npy", np.ascontiguousarray(value))
+                elif name in self.LAZY:
+                    with open(tmp / f"{name}.pkl", "wb") as f:
+                        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                elif name in self.MATRICES:
+                    matrix = sparse.csr_matrix(value)
+                    objects["shapes"][name] = matrix.shape
+                    for buf in self.CSR_BUFFERS:
+                        np.save(tmp / f"{name}.{buf}.npy", getattr(matrix, buf))
+                elif name in self.PACKED:
+                    for buf in self.PACKED_BUFFERS:
+                        np.save(tmp / f"{name}.{buf}.npy", getattr(value, buf))
+                else:
+                    objects[name] = value
+            with open(tmp / self.OBJECTS, "wb") as f:
+                pickle.dump(objects, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            if path.exists():
+                shutil.rmtree(tmp)   # worker อื่นเขียน key เดียวกันเสร็จก่อน
+            else:
+                os.replace(tmp, path)
+
+            self.mark(key, stamp)
+            latest = self.directory / f".{self.LATEST}.{os.getpid()}.tmp"
+            latest.write_text(key, encoding="utf-8")
+            os.replace(latest, self.directory / self.LATEST)
+            self._prune(key)
+            return True
+        except Exception as e:
+            print(f"⚠️  บันทึก artifact ไม่ได้ ({e})")
+            shutil.rmtree(tmp, ignore_errors=True)
+            return False
+
+    def _prune(self, current: str):
+        # worker ที่ยัง mmap ไฟล์ที่ลบอยู่อ่านต่อได้ (inode ยังอยู่จน unmap)
+        dirs = sorted(self.directory.glob("catalog-*"),
+                      key=lambda p: p.stat().st_mtime, reverse=True)
+        for path in dirs[self.keep:]:
+            if path != self._path(current):
+                shutil.rmtree(path, ignore_errors=True)
+
+
 # ================================================================
 # DATA LOADER
 # ================================================================
@@ -356,34 +1572,217 @@ class DataLoader:
         "active_acne", "active_whitening", "active_wrinkle",
         "active_hydration", "active_barrier", "active_soothing",
     ]
+    # column ที่ snapshot เก็บไว้ — ไม่รวม text หนักๆ อย่าง ingredients_raw
+    # (key_ingredients / free_from / active_* อยู่ใน fragments แล้ว)
+    SNAPSHOT_COLS = [
+        "id", "name", "brand", "major_category", "subtype",
+        "skintype", "function_tags", "image_url",
+    ]
 
     def __init__(self):
-        self.df            = None
-        self.vectorizer    = None
-        self.tfidf_matrix  = None
+        self.snapshot      = None
         self.concern_model = ConcernModel()
-        self._build()
+        self.result_cache  = ResultCache()
+        self.artifacts     = ArtifactStore()
+        self.artifact_key  = None                # artifact ที่ snapshot ปัจจุบันโหลดมา / บันทึกไว้
+        self._artifact_dirty = False            # snapshot มีแถวต่อท้ายที่ยังไม่ได้เขียนเป็น artifact_key (ดู persist)
+        self._persist_timer  = None
+        self._add_lock     = threading.Lock()   # serialize การเปลี่ยน self.snapshot
+        self._added_during_rebuild = None       # product ที่ add ระหว่าง rebuild (list) หรือ None
+        self._removed_during_rebuild = None     # id ที่ mask ระหว่าง rebuild (set) หรือ None
+        # rebuild ได้ทีละครั้ง — สอง flag นี้อ่าน/เขียนใต้ _add_lock เท่านั้น
+        self._rebuild_running = False
+        self._rebuild_pending = False           # มีคนขอ rebuild ระหว่างที่ rebuild ทำอยู่
+        self._feed_thread  = None
+        self.catalog_version = None             # catalog_version ใน DB ที่ snapshot ปัจจุบันสะท้อน
+        self._drift_grams  = 0   # n-gram ทั้งหมดของ product ที่ add หลัง fit ล่าสุด
+        self._drift_unseen = 0   # ในนั้นที่ไม่อยู่ใน vocabulary
+        self.rebuild()
+
+    # ================================================================
+    # REBUILD
+    # build snapshot ใหม่ทั้งชุดแล้วสลับด้วย assignment เดียว — request ที่ถือ snapshot เดิม
+    # อยู่ทำงานต่อบนของเดิมจนจบ, request ถัดไปเห็นของใหม่
+    # ================================================================
+    def rebuild(self) -> bool:
+        """
+        build ใหม่จาก DB แบบ synchronous — คืน False ถ้า DB ว่าง หรือมี rebuild อื่นทำอยู่
+        (กรณีหลังจะสั่งให้ rebuild ที่ทำอยู่วนอีกรอบ เพราะอาจอ่าน DB ไปก่อนการเปลี่ยนแปลงนี้)
+        """
+        with self._add_lock:
+            if self._rebuild_running:
+                self._rebuild_pending = True
+                return False
+            self._rebuild_running = True
+
+        built = False
+        try:
+            while True:
+                with self._add_lock:
+                    self._rebuild_pending = False
+                built = self._rebuild_once() or built
+                # ตัดสินใจจบ/วนอีกรอบใต้ lock เดียวกับที่ตั้ง pending — คำขอที่มาตอน
+                # rebuild กำลังจบจึงไม่หาย
+                with self._add_lock:
+                    if not self._rebuild_pending:
+                        self._added_during_rebuild = self._removed_during_rebuild = None
+                        self._rebuild_running = False
+                        return built
+        except BaseException:
+            with self._add_lock:
+                self._added_during_rebuild = self._removed_during_rebuild = None
+                self._rebuild_running = False
+            raise
+
+    def _rebuild_once(self) -> bool:
+        with self._add_lock:
+            self._added_during_rebuild   = []
+            self._removed_during_rebuild = set()
+
+        # อ่าน version ก่อน products — การเปลี่ยนแปลงหลังจากนี้จะมี version ใหม่กว่าเสมอ
+        version, stamp = self._read_catalog_version()
+        started = time.perf_counter()
+
+        # catalog ไม่เปลี่ยนตั้งแต่บันทึก artifact (stamp ตรง) → ไม่ต้องอ่าน products / hash
+        key    = self.artifacts.find(stamp) if stamp else None
+        cached = self.artifacts.load(key) if key else None
+        if cached is not None:
+            snap = self._snapshot_from_artifact(cached[1])
+            return self._swap(snap, version, key, f"from artifact {key}", started)
+
+        try:
+            rows = get_all_products()
+        except Exception as e:
+            if self.snapshot is not None:
+                print(f"⚠️  rebuild ไม่ได้ ({e}) — ใช้ snapshot เดิมต่อ")
+                return False
+            # boot ตอน DB ล่ม → ใช้ artifact ล่าสุด (catalog_version = None ให้ change feed
+            # rebuild ทันทีที่ต่อ DB ได้)
+            cached = self.artifacts.load()
+            if cached is None:
+                raise
+            print(f"⚠️  ต่อ DB ไม่ได้ ({e}) — ใช้ artifact ล่าสุด {cached[0]}")
+            return self._swap(self._snapshot_from_artifact(cached[1]), None, cached[0],
+                              f"from artifact {cached[0]}", started)
 
-    def _build(self):
-        rows = get_all_products()
         if not rows:
-            print("⚠️  No products in DB"); return
+            print("⚠️  No products in DB")
+            return False
+        # ลำดับแถว = position ใน snapshot และเป็นส่วนของ artifact key — เรียงตาม id ให้ key
+        # ไม่ขึ้นกับลำดับที่ DB คืนมา (get_all_products ORDER BY id อยู่แล้ว แถวเรียงแล้วจึงเร็ว)
+        rows = sorted(rows, key=lambda r: r["id"])
+        ingredient_names = self._autocomplete_ingredients()
+        key    = self.artifacts.key(rows, ingredient_names) if self.artifacts.enabled else None
+        cached = self.artifacts.load(key) if key else None
+        if cached is None:
+            # flock ครอบแค่ build / save ของ key นี้ — ปล่อยก่อน _swap (ที่ต้องเอา _add_lock)
+            with self.artifacts.building():
+                # worker อื่นอาจ build key เดียวกันเสร็จระหว่างรอ lock
+                cached = self.artifacts.load(key) if key else None
+                if cached is None:
+                    snap = self._build_snapshot(rows, ingredient_names, key, stamp)
+            if cached is None:
+                return self._swap(snap, version, key, "loaded", started)
+
+        # เนื้อหาเหมือน artifact เดิม (เช่น UPDATE ที่ไม่เปลี่ยนค่า) → จำ stamp ใหม่ไว้ให้ boot ถัดไป
+        self.artifacts.mark(key, stamp)
+        snap = self._snapshot_from_artifact(cached[1], rows)
+        return self._swap(snap, version, key, f"from artifact {key}", started)
+
+    def _swap(self, snap: CatalogSnapshot, version, key: str, source: str, started: float) -> bool:
+        with self._add_lock:
+            # product ที่ add / แก้ / ลบหลังอ่าน DB ไปแล้ว → apply ซ้ำบน snapshot ใหม่
+            # (mask ก่อน แล้วต่อท้ายเฉพาะตัวที่ยังไม่มี)
+            removed = self._removed_during_rebuild or set()
+            masked  = snap.without(removed) if removed else snap
+            late    = self._unseen_rows(masked, self._added_during_rebuild)
+            if late or masked is not snap:
+                snap, key = self._patch(masked, key, late, remove_ids=removed)
+            self.snapshot        = snap
+            self.catalog_version = version
+            self.artifact_key    = key
+            self._artifact_dirty = bool(late)
+            self._drift_grams = self._drift_unseen = 0
+        print(f"✅ AI Engine v2 ready — {snap.n_alive:,} products {source} "
+              f"({time.perf_counter() - started:.2f}s)")
+        if late:
+            self._schedule_persist()
+        return True
+
+    def rebuild_async(self) -> bool:
+        """rebuild บน background thread — คืน False ถ้ามี rebuild ทำอยู่แล้ว (จะวนอีกรอบให้)"""
+        started = not self._rebuild_running
+        threading.Thread(target=self.rebuild, name="engine-rebuild", daemon=True).start()
+        return started
+
+    @property
+    def rebuilding(self) -> bool:
+        return self._rebuild_running
+
+    def warmup(self):
+        """
+        โหลดของที่ lazy ไว้ (sklearn, vectorizer, concern classifier) ก่อน request แรกต้องใช้
+        boot จาก artifact ไม่ต้องรอส่วนนี้ — เรียกผ่าน warmup_async หลัง app พร้อม
+        """
+        snap = self.snapshot
+        if snap is not None and len(snap):
+            user_vec = snap.vectorizer.transform(["warmup"])
+            _cosine_similarity(user_vec, snap.tfidf_matrix[:1])
+        self.concern_model.model
+
+    def warmup_async(self) -> threading.Thread:
+        thread = threading.Thread(target=self.warmup, name="engine-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def _build_snapshot(self, rows: list, ingredient_names: list,
+                        key: str = None, stamp: str = None) -> CatalogSnapshot:
+        df = self._prepare(rows)
+
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 5))
+        vectorizer.fit(self._tfidf_text(df))
+
+        counts = _autocomplete_counts(df, ingredient_names)
+        snap = CatalogSnapshot(
+            vectorizer   = vectorizer,
+            autocomplete = Autocomplete(_autocomplete_entries(
+                df["name"], df["brand"], ingredient_names,
+                counts["autocomplete_weight"], counts["autocomplete_hits"],
+            )),
+            **counts,
+            **self._featurize(df, vectorizer),
+        )
+        if key:
+            # เปิดกลับจาก disk แบบ mmap — process นี้ก็แชร์ page cache กับ worker อื่น
+            if self.artifacts.save(key, snap.artifact(), stamp):
+                cached = self.artifacts.load(key)
+                if cached is not None:
+                    return self._snapshot_from_artifact(cached[1], rows)
+        return snap
+
+    def _snapshot_from_artifact(self, parts: dict, rows: list = None) -> CatalogSnapshot:
+        """is_new ขึ้นกับวันปัจจุบัน จึงคำนวณใหม่จาก created_at แทนค่าที่เก็บไว้ตอน build"""
+        created_at = parts.get("created_at")
+        if rows is not None:
+            created_at = _utc_datetimes([r.get("created_at") for r in rows])
+        if created_at is not None:
+            parts = dict(parts, created_at=created_at, is_new=_new_flags(created_at))
+        return CatalogSnapshot(**parts)
+
+    def _prepare(self, rows: list) -> pd.DataFrame:
+        import pandas as pd
 
         df = pd.DataFrame(rows)
         df["price"]  = pd.to_numeric(df["price"], errors="coerce").fillna(0)
         
         # ✅ ใหม่ (timezone ไทย UTC+7
         # ที่เพิ่มแก้ไขเรื่อง ถ้า created_at อยู่ในช่วง 7 วันล่าสุด 
-        
-        from datetime import datetime, timezone , timedelta
-        
-        TZ_BANGKOK = timezone(timedelta(hours=7))
 
         if "created_at" in df.columns:
-            now = datetime.now(TZ_BANGKOK)
             df["created_at"] = pd.to_datetime(df["created_at"], utc=True, errors="coerce")
             df["created_at"] = df["created_at"].dt.tz_convert(TZ_BANGKOK)
-            df["is_new"] = (now - df["created_at"]).dt.days <= 7
+            df["is_new"] = _new_flags(df["created_at"])
             
         # สินค้าที่ created_at ภายใน 7 วัน → is_new = True อัตโนมัติ
         
@@ -392,194 +1791,565 @@ class DataLoader:
             
         for col in self.TEXT_COLS + self.ACTIVE_COLS:
             df[col] = df[col].fillna("") if col in df.columns else ""
+        return df
 
-        df["combined_features"] = df[self.TFIDF_COLS].apply(
+    def _tfidf_text(self, df: pd.DataFrame) -> pd.Series:
+        return df[self.TFIDF_COLS].apply(
             lambda r: " ".join(r.values.astype(str)), axis=1
         )
 
-        self.df           = df
-        self.vectorizer   = TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 5))
-        self.tfidf_matrix = self.vectorizer.fit_transform(df["combined_features"])
-        print(f"✅ AI Engine v2 ready — {len(df):,} products loaded")
-
-    def _score(self, df: pd.DataFrame, skin_type: str, concerns: list,
-                min_price: float, max_price: float, context: dict) -> pd.DataFrame:
+    def _featurize(self, df: pd.DataFrame, vectorizer) -> dict:
+        """
+        ทุกอย่างต่อ product ที่ CatalogSnapshot ต้องใช้ ยกเว้น vectorizer / autocomplete
+        vectorizer ต้อง fit แล้ว — ใช้ทั้งตอน build และตอน add_products
+        """
+        # ── Concern model ทั้ง catalog ครั้งเดียว ─────────────────────────────
+        ingredient_matrix = self.concern_model.vectorize(df["ingredients_list"].tolist())
+        concern_proba     = self.concern_model.predict_matrix(ingredient_matrix)
+        concern_matrix    = concern_proba @ _concern_weight_matrix(self.concern_model.categories)
+
+        columns = {
+            col: (df[col].to_numpy(dtype=object) if col in df.columns
+                  else np.full(len(df), None, dtype=object))
+            for col in self.SNAPSHOT_COLS
+        }
+        return dict(
+            columns           = columns,
+            price             = df["price"].to_numpy(dtype=np.float64),
+            is_new            = (df["is_new"] == True).to_numpy(dtype=bool),
+            fragments         = PackedObjects.pack(_explanation_fragments(df)),
+            tfidf_matrix      = vectorizer.transform(self._tfidf_text(df)),
+            ingredient_matrix = ingredient_matrix,
+            concern_proba     = concern_proba,
+            concern_matrix    = concern_matrix,
+            context_matrix    = _context_tag_matrix(df["function_tags"]),
+            skin_mask         = _skin_masks(df["skintype"]),
+            created_at        = (df["created_at"].to_numpy(dtype="datetime64[ns]")
+                                 if "created_at" in df.columns else None),
+            routine_masks     = np.vstack([
+                df["major_category"].isin(step["categories"]).to_numpy(dtype=bool)
+                for step in ROUTINE_STEPS
+            ]),
+        )
 
+    # ================================================================
+    # INCREMENTAL ADD
+    # product ใหม่ transform ด้วย vectorizer เดิม แล้วต่อท้าย snapshot (ไม่ refit)
+    # n-gram ที่ vectorizer ไม่รู้จักถูกทิ้ง → สะสมสัดส่วนไว้ ถ้าเกิน TFIDF_REFIT_DRIFT ค่อย build ใหม่ทั้งหมด
+    # ================================================================
+    def add_products(self, rows: list, remove_ids=()) -> dict:
+        """
+        rows = product dict แบบแถวใน products table (ควร insert ลง DB แล้ว —
+        ตอน refit จะอ่าน catalog ใหม่ทั้งหมดจาก DB)
+        remove_ids = id ที่ถูก UPDATE / DELETE — mask ตำแหน่งเดิมออกก่อน แล้วต่อท้าย rows
+        (ค่าใหม่ของตัวที่ UPDATE) ตัวที่ DELETE ไม่มีใน rows จึงหายไปเลย
+        คืน {"added", "removed", "products", "drift", "refit"} — refit = สั่ง rebuild background แล้ว
+        """
+        remove_ids = set(remove_ids)
+        with self._add_lock:
+            snap = self.snapshot
+            if snap is None:
+                return {"added": len(rows), "removed": 0, "products": 0, "drift": 0.0,
+                        "refit": self.rebuild_async()}
+            masked  = snap.without(remove_ids) if remove_ids else snap
+            removed = snap.n_alive - masked.n_alive
+            rows    = self._unseen_rows(masked, rows)
+            if not rows and not removed:
+                return {"added": 0, "removed": 0, "products": snap.n_alive,
+                        "drift": self._drift(), "refit": False}
+
+            df = self._prepare(rows) if rows else None
+            if rows:
+                analyzer   = snap.vectorizer.build_analyzer()
+                vocabulary = snap.vectorizer.vocabulary_
+                for text in self._tfidf_text(df):
+                    grams = analyzer(text)
+                    self._drift_grams  += len(grams)
+                    self._drift_unseen += sum(g not in vocabulary for g in grams)
+
+            self.snapshot, self.artifact_key = self._patch(
+                masked, self.artifact_key, rows, df, remove_ids
+            )
+            # mask อย่างเดียวใช้ array / matrix ของ artifact เดิมร่วมกัน (alive เป็น array เล็ก) → ไม่ต้องเขียน
+            self._artifact_dirty = self._artifact_dirty or bool(rows)
+            if self._added_during_rebuild is not None:
+                # ตัวที่ถูกแก้ / ลบทีหลังต้องไม่ถูกต่อกลับด้วยค่าเก่าตอน _swap
+                self._added_during_rebuild[:] = [
+                    r for r in self._added_during_rebuild if r.get("id") not in remove_ids
+                ]
+                self._added_during_rebuild.extend(rows)
+                self._removed_during_rebuild |= remove_ids
+
+            # ต่อท้าย / mask ไปก่อนเสมอ ถ้า drift หรือตำแหน่งที่ mask เกินค่อย rebuild ทั้ง catalog บน background
+            drift = self._drift()
+            dead  = 1 - self.snapshot.n_alive / max(len(self.snapshot), 1)
+            refit = drift > TFIDF_REFIT_DRIFT or dead > SNAPSHOT_COMPACT_RATIO
+            if refit:
+                print(f"🔄 vocabulary drift {drift:.1%} / masked {dead:.1%} — rebuild ทั้ง catalog")
+                self.rebuild_async()
+            result = {"added": len(rows), "removed": removed, "products": self.snapshot.n_alive,
+                      "drift": drift, "refit": refit}
+        if rows:
+            self._schedule_persist()
+        return result
+
+    def _patch(self, snap: CatalogSnapshot, key: str, rows: list,
+               df: pd.DataFrame = None, remove_ids=()) -> tuple:
+        """
+        (snapshot ที่ต่อท้าย rows แล้ว, artifact key ของมัน) — ทำใน memory อย่างเดียว
+        snap = snapshot ที่ mask remove_ids แล้ว (remove_ids ใช้ทำ key), key = artifact ที่ snap มาจาก
+        เรียกใต้ _add_lock จึงไม่แตะ disk / flock — การเขียนลง artifact อยู่ใน persist
+        """
+        patched = snap
+        if rows:
+            new = self._prepare(rows) if df is None else df
+            patched = snap.extended(dict(
+                self._featurize(new, snap.vectorizer),
+                **_autocomplete_counts(new, snap.autocomplete.ingredients()),
+            ))
+        if not (self.artifacts.enabled and key):
+            return patched, key
+        return patched, self.artifacts.derived_key(key, rows, remove_ids)
+
+    def _schedule_persist(self):
+        """persist บน timer — add ที่ตามมาภายใน ARTIFACT_PERSIST_DELAY รวมเป็นการเขียนครั้งเดียว"""
+        if ARTIFACT_PERSIST_DELAY < 0 or not self.artifacts.enabled:
+            return
+        with self._add_lock:
+            if self._persist_timer is not None and self._persist_timer.is_alive():
+                return
+            timer = threading.Timer(ARTIFACT_PERSIST_DELAY, self.persist)
+            timer.name   = "engine-persist"
+            timer.daemon = True
+            self._persist_timer = timer
+        timer.start()
+
+    def persist(self) -> bool:
+        """
+        เขียน snapshot ที่ต่อท้ายแล้วลง artifact แล้วเปิดกลับแบบ mmap — คืน False ถ้าไม่มีอะไรต้องเขียน
+        extended() ต่อ matrix เป็นสำเนาใน heap ของ process นี้ เปิดกลับแล้ว worker ทุกตัวแชร์
+        page cache ชุดเดียวกันอีกครั้ง worker อื่นที่ได้ change เดียวกันได้ derived_key เดียวกัน
+        → โหลดของที่เขียนไว้แทนเขียนซ้ำ
+        snapshot ครบถึง catalog_version ที่ DB รายงานอยู่ → stamp artifact ไว้ให้ boot ถัดไปหาเจอ
+        ด้วย find(stamp) โดยไม่ต้องอ่าน products ทั้งหมดมา hash
+        ไม่ถือ _add_lock ระหว่าง flock (ลำดับ lock ตรงข้ามกับ rebuild จะ deadlock)
+        """
+        with self._add_lock:
+            self._persist_timer = None            # add หลังจากนี้ตั้ง timer รอบใหม่ได้
+            snap, key, version = self.snapshot, self.artifact_key, self.catalog_version
+            if not (self._artifact_dirty and key):
+                return False
+
+        with self.artifacts.building():
+            cached = self.artifacts.load(key)
+            if cached is None and self.artifacts.save(key, snap.artifact()):
+                cached = self.artifacts.load(key)
+        if cached is None:
+            return False
+        # version ใน DB ใหม่กว่า (เช่น route add แล้ว notification ยังไม่มา) → ไม่ stamp
+        db_version, stamp = self._read_catalog_version()
+        if version is not None and db_version == version:
+            self.artifacts.mark(key, stamp)
+        reopened = self._snapshot_from_artifact(cached[1])
+
+        with self._add_lock:
+            current = self.snapshot is snap
+            if current:
+                self.snapshot        = reopened
+                self._artifact_dirty = False
+            retry = not current and self._artifact_dirty
+        if retry:
+            self._schedule_persist()   # snapshot เปลี่ยนระหว่างเขียน → เขียนตัวใหม่รอบหน้า
+        return current
+
+    @staticmethod
+    def _unseen_rows(snap: CatalogSnapshot, rows: list) -> list:
+        """ตัด product ที่ id มีใน snapshot แล้ว (เช่น route add แล้ว change feed ส่งซ้ำ)"""
+        known = set(snap.columns["id"][snap.alive].tolist())
+        return [r for r in rows if r.get("id") is None or r.get("id") not in known]
+
+    def _drift(self) -> float:
+        """สัดส่วน n-gram ของ product ที่เพิ่มหลัง fit ล่าสุดที่ไม่อยู่ใน vocabulary"""
+        return self._drift_unseen / self._drift_grams if self._drift_grams else 0.0
+
+    def _autocomplete_ingredients(self) -> list:
+        """
+        ชื่อ ingredient จาก table active_ingredients + vocabulary ของ concern model
+        ไม่ซ้ำแบบไม่สนตัวพิมพ์ (ตัวแรกชนะ) — Autocomplete รวม popularity ของ text ซ้ำ
+        ชื่อที่อยู่ทั้งสองแหล่งจึงจะถูกนับจำนวนสินค้าสองเท่า
+        เรียงตามตัวอักษร = ลำดับของ Autocomplete.ingredients() (column ของ autocomplete_hits)
+        """
+        try:
+            names = get_active_ingredient_names()
+        except Exception as e:
+            print(f"⚠️  โหลด active_ingredients ไม่ได้ ({e}) — autocomplete ใช้แค่ concern_meta")
+            names = []
+        unique = {}
+        for name in list(names) + list(self.concern_model.ingredients):
+            if isinstance(name, str) and name.strip():
+                unique.setdefault(name.strip().lower(), name.strip())
+        return [unique[k] for k in sorted(unique)]
+
+    def _score(self, snap: CatalogSnapshot, skin_type: str, concerns: list,
+                min_price: float, max_price: float, context: dict):
+        """
+        คืน dict ของ arrays ขนาดเท่าจำนวน candidate:
+        pos (position ใน snapshot), final, concern, cosine, context, skin
+        หรือ None ถ้าไม่มี product ผ่าน filter
+        """
         # ── กรองราคาก่อน ──────────────────────────────────────────────────────
-        has_price = df["price"] > 0
-        filtered = pd.concat([
-            df[has_price & (df["price"] >= min_price) & (df["price"] <= max_price)],
-            df[~has_price],
-        ]).drop_duplicates().copy()
+        pos = snap.price_candidates(min_price, max_price)
 
-        if filtered.empty:
-            return filtered
+        if not len(pos):
+            return None
 
         # ── Hard Filter Skin Type ──────────────────────────────────────────────
         if skin_type and skin_type.lower() != "all":
-            skin_match = filtered[
-                filtered["skintype"].str.lower().str.contains(skin_type.lower(), na=False) |
-                filtered["skintype"].str.lower().str.contains("all", na=False) |
-                filtered["skintype"].str.lower().str.contains("ทุกสภาพผิว", na=False)
-            ]
-            if not skin_match.empty:
-                filtered = skin_match
-
-        if filtered.empty:
-            return filtered
+            skin_match = snap.skin_hits(pos, skin_type) | ((snap.skin_mask[pos] & SKIN_ANY) != 0)
+            if skin_match.any():
+                pos = pos[skin_match]
 
         # ── Layer 1: Concern Score (55%) ───────────────────────────────────────
-        results = filtered.apply(
-            lambda row: self.concern_model.score_and_match(row, concerns), axis=1
-        )
-        filtered["concern_score"] = results.apply(lambda x: x[0])
-        filtered["_matched"]      = results.apply(lambda x: x[1])
+        concern_score = _concern_layer(snap.concern_matrix[pos], concerns)
 
         # ── Layer 2: TF-IDF Cosine (25%) ──────────────────────────────────────
-        user_vec = self.vectorizer.transform([skin_type + " " + " ".join(concerns)])
-        filtered["cosine_score"] = cosine_similarity(
-            user_vec, self.tfidf_matrix[filtered.index]
-        ).flatten()
+        cosine_score = snap.similarity.get(skin_type, concerns)[pos].astype(np.float64)
 
         # ── Layer 3: Context (20%) ─────────────────────────────────────────────
-        boost_map = _merge_boosts(context)
-        filtered["context_score"] = filtered["function_tags"].apply(
-            lambda tags: _context_score_normalized(tags, boost_map)
-        )
+        context_score = _context_layer(snap.context_matrix[pos], _context_vector(context))
 
         # ── Skin Bonus ─────────────────────────────────────────────────────────
-        filtered["skin_boost"] = filtered["skintype"].apply(
-            lambda x: 1.0 if skin_type and skin_type.lower() in str(x).lower() else 0.0
+        skin_boost = (
+            snap.skin_hits(pos, skin_type).astype(float)
+            if skin_type else np.zeros(len(pos))
         )
 
         # ── Final Score ────────────────────────────────────────────────────────
-        filtered["final_score"] = (
-            filtered["concern_score"] * 0.55 +
-            filtered["cosine_score"]  * 0.25 +
-            filtered["context_score"] * 0.20
-        ).round(4)
-
-        return filtered
-
-    # ================================================================
-    # NEW: score product ตัวเดียวโดยไม่ต้องผ่าน DataFrame ทั้งหมด
-    # ใช้ใน find_matching_users
-    # ================================================================
-    def _score_single_product(self, row: pd.Series, skin_type: str,
-                               concerns: list, context: dict) -> float:
-        concern_score, _ = self.concern_model.score_and_match(row, concerns)
-
-        combined = " ".join(str(row.get(col, "")) for col in self.TFIDF_COLS)
-        user_vec    = self.vectorizer.transform([skin_type + " " + " ".join(concerns)])
-        product_vec = self.vectorizer.transform([combined])
-        cosine_score = float(cosine_similarity(user_vec, product_vec).flatten()[0])
-
-        boost_map     = _merge_boosts(context)
-        context_score = _context_score_normalized(
-            str(row.get("function_tags", "")), boost_map
-        )
-
-        return round(
+        final_score = np.round(
             concern_score * 0.55 +
             cosine_score  * 0.25 +
             context_score * 0.20, 4
         )
 
+        return {
+            "pos":     pos,
+            "final":   final_score,
+            "concern": concern_score,
+            "cosine":  cosine_score,
+            "context": context_score,
+            "skin":    skin_boost,
+        }
+
+    def _matched(self, snap: CatalogSnapshot, pos: int, concerns: list) -> dict:
+        """matched concern → (mcat, conf, weight) ของ product ที่ตำแหน่ง pos ใช้ตอน build explanation"""
+        pred = self.concern_model.pred_from_row(snap.concern_proba[pos])
+        if not pred:
+            return {}
+        return _concern_score_normalized(pred, concerns)[1]
+
+    def _product(self, snap: CatalogSnapshot, scored: dict, i: int,
+                  skin_type: str, concerns: list) -> dict:
+        """product dict + explanation ของ candidate ลำดับที่ i ใน scored"""
+        pos = int(scored["pos"][i])
+        row = snap.row(pos)
+        row["final_score"] = float(scored["final"][i])
+        p = {col: row[col] for col in RETURN_COLS}
+        p["is_new"] = row["is_new"]
+        p["explanation"] = build_explanation(
+            snap.fragments[pos], skin_type, concerns, self._matched(snap, pos, concerns),
+            {
+                "final":   scored["final"][i],
+                "cosine":  scored["cosine"][i],
+                "concern": scored["concern"][i],
+                "skin":    scored["skin"][i],
+                "context": scored["context"][i],
+            }
+        )
+        return p
+
     # ================================================================
     # RECOMMEND PRODUCTS (แก้: guaranteed slot สำหรับ new product)
     # ================================================================
     def recommend_products(self, skin_type: str, concerns: list,
                             min_price: float = 0, max_price: float = 100000,
                             top_n: int = 5, context: dict = None) -> list:
-        if self.df is None:
+        snap = self.snapshot
+        if snap is None:
             return []
 
-        scored = self._score(self.df.copy(), skin_type, concerns,
-                              min_price, max_price, context or {})
-        if scored.empty:
+        context = context or {}
+        key = ("products", top_n) + _profile_key(skin_type, concerns, min_price, max_price, context)
+        return self._cached(snap, key, lambda: self._rank_products(
+            snap, self._score(snap, skin_type, concerns, min_price, max_price, context),
+            skin_type, concerns, top_n,
+        ))
+
+    def _rank_products(self, snap: CatalogSnapshot, scored: dict, skin_type: str,
+                        concerns: list, top_n: int) -> list:
+        if scored is None:
             return []
+        picks = self._rank_indices(snap, scored, skin_type, top_n)
+        return [self._product(snap, scored, i, skin_type, concerns) for i in picks]
 
-        sorted_all = scored.sort_values("final_score", ascending=False)
+    def _rank_indices(self, snap: CatalogSnapshot, scored: dict, skin_type: str,
+                       top_n: int) -> list:
+        """ลำดับ index ใน scored ที่จะตอบ — new product slot ก่อน ตามด้วย top_n regular"""
+        pos    = scored["pos"]
+        scores = scored["final"]
+        is_new = snap.is_new[pos]
 
-        # แยก new product ออกมา
-        new_df     = sorted_all[sorted_all["is_new"] == True]
-        regular_df = sorted_all[sorted_all["is_new"] != True]
+        picks = []
 
-        rows = []
-        
-        if not new_df.empty:
+        new_idx = np.flatnonzero(is_new)
+        if len(new_idx):
             # หา new product ที่ตรง skin_type ของ user ที่สุด
-            # ที่เพิ่มแก้ไข
-            
-            skin_match = new_df[
-                new_df["skintype"].str.lower().str.contains(skin_type.lower(), na=False)
-            ]
-            if not skin_match.empty:
-                rows.append(skin_match.iloc[0])
-            else:
+            pick = new_idx[snap.skin_hits(pos[new_idx], skin_type)]
+            if not len(pick):
             # ถ้าไม่มีตรงเลย เอา "all skin" แทน
-                all_skin = new_df[
-                    new_df["skintype"].str.lower().str.contains("all", na=False)
-                ]
-                if not all_skin.empty:
-                    rows.append(all_skin.iloc[0])
+                pick = new_idx[(snap.skin_mask[pos[new_idx]] & SKIN_BITS["all"]) != 0]
+            if len(pick):
+                picks.append(pick[_top_k(scores[pick], 1)[0]])
 
         # ตามด้วย regular products เต็ม top_n
-        for _, r in regular_df.head(top_n).iterrows():
-            rows.append(r)
+        regular_idx = np.flatnonzero(~is_new)
+        picks.extend(regular_idx[_top_k(scores[regular_idx], top_n)])
+        return picks
 
-        output = []
-        for row in rows:
-            p = row[RETURN_COLS].to_dict()
-            p["is_new"] = bool(row.get("is_new", False))
-            p["explanation"] = build_explanation(
-                row, skin_type, concerns, row["_matched"],
-                {
-                    "final":   row["final_score"],
-                    "cosine":  row["cosine_score"],
-                    "concern": row["concern_score"],
-                    "skin":    row["skin_boost"],
-                    "context": row["context_score"],
-                }
-            )
-            output.append(p)
-        return output
+    # ================================================================
+    # FREE-TEXT RECOMMEND
+    # ข้อความไทย/อังกฤษ → parse_thai_input → score เหมือน recommend_products
+    # เจอ category → จำกัดเฉพาะ major_category นั้น (ถ้ามีสินค้าเหลือ)
+    # ================================================================
+    def recommend_text(self, text: str, min_price: float = 0, max_price: float = 100000,
+                        top_n: int = 20, context: dict = None) -> dict:
+        skin_type, concerns, category = parse_thai_input(text)
+        skin_type = skin_type or "all"
+        parsed    = {"skin_type": skin_type, "concerns": concerns, "category": category}
+
+        snap = self.snapshot
+        if snap is None:
+            return {"parsed": parsed, "products": []}
+
+        context = context or {}
+        key = ("text", category, top_n) + _profile_key(skin_type, concerns, min_price, max_price, context)
+
+        def compute():
+            scored = self._score(snap, skin_type, concerns, min_price, max_price, context)
+            if scored is not None and category:
+                keep = snap.columns["major_category"][scored["pos"]] == category
+                if keep.any():
+                    scored = {k: v[keep] for k, v in scored.items()}
+            return self._rank_products(snap, scored, skin_type, concerns, top_n)
+
+        return {"parsed": parsed, "products": self._cached(snap, key, compute)}
+
+    # ================================================================
+    # PAGINATED RECOMMEND
+    # ranking (positions + scores) cache ไว้ต่อ profile, explanation สร้างเฉพาะหน้าที่ขอ
+    # ================================================================
+    def recommend_page(self, skin_type: str, concerns: list,
+                        min_price: float = 0, max_price: float = 100000,
+                        context: dict = None, cursor: str = None,
+                        page_size: int = 20, top_n: int = 100) -> dict:
+        """
+        คืน {"items", "next_cursor", "total"}
+        cursor มาจาก next_cursor ของหน้าก่อน — raise ValueError ถ้า cursor ผิดรูปแบบ
+        catalog เปลี่ยนระหว่างเลื่อนหน้า (change feed add / rebuild) → rank ใหม่บน snapshot
+        ปัจจุบันแล้วตอบต่อจาก offset เดิม (product ที่เพิ่งเข้ามาอาจทำให้ลำดับขยับ)
+        """
+        snap = self.snapshot
+        if snap is None:
+            return {"items": [], "next_cursor": None, "total": 0}
+
+        _, offset = _decode_cursor(cursor) if cursor else (snap.version, 0)
+        context = context or {}
+        key = ("ranking", top_n) + _profile_key(skin_type, concerns, min_price, max_price, context)
+        ranked = self._cached(snap, key, lambda: self._ranking(
+            snap, self._score(snap, skin_type, concerns, min_price, max_price, context),
+            skin_type, top_n,
+        ))
+
+        total = len(ranked["pos"])
+        end   = min(offset + page_size, total)
+        return {
+            "items":       [self._product(snap, ranked, i, skin_type, concerns)
+                            for i in range(offset, end)],
+            "next_cursor": _encode_cursor(snap.version, end) if end < total else None,
+            "total":       total,
+        }
+
+    def _ranking(self, snap: CatalogSnapshot, scored: dict, skin_type: str,
+                  top_n: int) -> dict:
+        """scored ที่ตัดเหลือเฉพาะแถวที่ติดอันดับ เรียงตามลำดับที่จะตอบ"""
+        if scored is None:
+            return {k: np.empty(0) for k in ("pos", "final", "concern", "cosine", "context", "skin")}
+        picks = np.asarray(self._rank_indices(snap, scored, skin_type, top_n), dtype=np.int64)
+        return {k: v[picks] for k, v in scored.items()}
 
     def recommend_routine(self, skin_type: str, concerns: list,
                             min_price: float = 0, max_price: float = 100000,
                             context: dict = None) -> list:
-        if self.df is None:
+        snap = self.snapshot
+        if snap is None:
             return []
-        scored = self._score(self.df.copy(), skin_type, concerns,
-                              min_price, max_price, context or {})
-        if scored.empty:
+
+        context = context or {}
+        key = ("routine",) + _profile_key(skin_type, concerns, min_price, max_price, context)
+        return self._cached(snap, key, lambda: self._build_routine(
+            snap, self._score(snap, skin_type, concerns, min_price, max_price, context),
+            skin_type, concerns,
+        ))
+
+    def _build_routine(self, snap: CatalogSnapshot, scored: dict, skin_type: str,
+                        concerns: list) -> list:
+        if scored is None:
             return []
 
+        scores = scored["final"]
+        steps  = snap.routine_masks[:, scored["pos"]]
+
         routine = []
-        for step in ROUTINE_STEPS:
-            step_df = scored[scored["major_category"].isin(step["categories"])]
-            if step_df.empty:
+        for step, in_step in zip(ROUTINE_STEPS, steps):
+            idx = np.flatnonzero(in_step)
+            if not len(idx):
                 continue
-            best = step_df.sort_values("final_score", ascending=False).iloc[0]
-            product = best[RETURN_COLS].to_dict()
+            # argmax คืนตัวแรกที่สูงสุด → tie-break ตามลำดับ catalog
+            best = idx[np.argmax(scores[idx])]
+            product = self._product(snap, scored, best, skin_type, concerns)
+            product.pop("is_new")
+            explanation = product.pop("explanation")
             product.update({
-                "step":       step["step"],
-                "step_label": step["label"],
-                "step_icon":  step["icon"],
-                "explanation": build_explanation(
-                    best, skin_type, concerns, best["_matched"],
-                    {
-                        "final":   best["final_score"],
-                        "cosine":  best["cosine_score"],
-                        "concern": best["concern_score"],
-                        "skin":    best["skin_boost"],
-                        "context": best["context_score"],
-                    }
-                ),
+                "step":        step["step"],
+                "step_label":  step["label"],
+                "step_icon":   step["icon"],
+                "explanation": explanation,
             })
             routine.append(product)
         return routine
 
+    def recommend_all(self, skin_type: str, concerns: list,
+                       min_price: float = 0, max_price: float = 100000,
+                       top_n: int = 5, context: dict = None) -> dict:
+        """recommend_products + recommend_routine จากการ score ครั้งเดียว"""
+        snap = self.snapshot
+        if snap is None:
+            return {"recommend": [], "routine": []}
+
+        context = context or {}
+        profile = _profile_key(skin_type, concerns, min_price, max_price, context)
+        rec_key     = ("products", top_n) + profile
+        routine_key = ("routine",) + profile
+
+        rec     = self.result_cache.get(snap.version, rec_key)
+        routine = self.result_cache.get(snap.version, routine_key)
+        if rec is None or routine is None:
+            scored = self._score(snap, skin_type, concerns, min_price, max_price, context)
+            if rec is None:
+                rec = self._rank_products(snap, scored, skin_type, concerns, top_n)
+                self.result_cache.put(snap.version, rec_key, rec)
+            if routine is None:
+                routine = self._build_routine(snap, scored, skin_type, concerns)
+                self.result_cache.put(snap.version, routine_key, routine)
+        return {"recommend": rec, "routine": routine}
+
+    def _cached(self, snap: CatalogSnapshot, key: tuple, compute):
+        value = self.result_cache.get(snap.version, key)
+        if value is None:
+            value = compute()
+            self.result_cache.put(snap.version, key, value)
+        return value
+
+    # ================================================================
+    # CATALOG CHANGE FEED
+    # trigger ใน migrations/004_catalog_change_feed.sql เพิ่ม catalog_version ทุกครั้งที่ products เปลี่ยน แล้ว NOTIFY
+    # {"version", "op", "ids"} ทาง channel catalog_changes — thread นี้ LISTEN แล้ว (add_products):
+    #   INSERT → ต่อท้าย, UPDATE → mask ตำแหน่งเดิมแล้วต่อท้ายค่าใหม่, DELETE → mask
+    #   TRUNCATE / ids ยาวเกิน → rebuild บน background
+    # ================================================================
+    def start_change_feed(self) -> bool:
+        if self._feed_thread is not None and self._feed_thread.is_alive():
+            return False
+        self._feed_thread = threading.Thread(target=self._listen, name="catalog-feed", daemon=True)
+        self._feed_thread.start()
+        return True
+
+    def _listen(self):
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                conn = get_connection()
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {CATALOG_CHANNEL}")
+                print(f"👂 listening {CATALOG_CHANNEL}")
+                backoff = 1
+
+                # ช่วงที่ไม่ได้ LISTEN อาจพลาด notification → version ต่าง = rebuild
+                version, _ = self._read_catalog_version()
+                if version is not None and version != self.catalog_version:
+                    self.rebuild_async()
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    # รวม notification ที่มาติดกัน (เช่น import ทีละแถว) แล้ว apply ครั้งเดียว
+                    time.sleep(CATALOG_FEED_DEBOUNCE)
+                    conn.poll()
+                    events = [json.loads(n.payload) for n in conn.notifies]
+                    conn.notifies.clear()
+                    self._apply_changes(events)
+            except Exception as e:
+                print(f"⚠️  catalog feed หลุด ({e}) — ต่อใหม่ใน {backoff}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _apply_changes(self, events: list):
+        current = self.catalog_version or 0
+        events  = [e for e in events if (e.get("version") or 0) > current]
+        if not events:
+            return
+        if any(e.get("ids") is None for e in events):
+            self.rebuild_async()   # rebuild ตั้ง catalog_version เอง
+            return
+
+        # อ่านค่าล่าสุดของทุก id จาก DB ครั้งเดียว — ไม่ขึ้นกับลำดับ event ใน batch
+        # (id ที่ DELETE ไม่มีแถวกลับมา จึงถูก mask อย่างเดียว)
+        ids   = {i for e in events for i in e["ids"]}
+        stale = {i for e in events if e.get("op") != "INSERT" for i in e["ids"]}
+        self.add_products(get_products_by_ids(sorted(ids)), remove_ids=stale)
+        with self._add_lock:
+            self.catalog_version = max(current, max(e["version"] for e in events))
+
+    def _read_catalog_version(self) -> tuple:
+        """
+        (version, stamp) — stamp = version + updated_at ใช้จับคู่กับ artifact
+        (version อย่างเดียวซ้ำได้ถ้าสร้าง DB ใหม่) อ่านไม่ได้ → (None, None)
+        """
+        try:
+            row = get_catalog_version()
+        except Exception as e:
+            print(f"⚠️  อ่าน catalog_version ไม่ได้ ({e})")
+            return None, None
+        if row is None:
+            return None, None
+        version, updated_at = row
+        return version, f"{version}@{updated_at.isoformat() if updated_at else ''}"
+
+    def stats(self) -> dict:
+        snap = self.snapshot
+        return {
+            "products":     snap.n_alive if snap is not None else 0,
+            "version":      snap.version if snap is not None else None,
+            "rebuilding":   self.rebuilding,
+            "catalog_version": self.catalog_version,
+            "artifact":     self.artifact_key,
+            "result_cache": self.result_cache.stats(),
+        }
+
     # ================================================================
     # NEW: find_matching_users
     # reverse match — รับ product ใหม่ แล้วหา users ที่ควรได้รับ notification
@@ -596,63 +2366,170 @@ class DataLoader:
     def find_matching_users(self, new_product: dict,
                              all_users: list,
                              score_threshold: float = 0.4) -> list:
-        if self.df is None:
+        snap = self.snapshot
+        if snap is None:
             return []
 
-        product_row  = pd.Series(new_product)
-        product_skin = str(new_product.get("skintype", "")).lower()
-        matched_users = []
-
-        for user in all_users:
-            skin_type = user.get("skin_type", "")
-            concerns  = user.get("concerns", [])
-            context   = user.get("context", {})
-
-            # Hard filter — skin type ต้องตรงก่อน เหมือนระบบหลัก
-            if skin_type and skin_type.lower() != "all":
-                skin_ok = (
-                    skin_type.lower() in product_skin or
-                    "all" in product_skin or
-                    "ทุกสภาพผิว" in product_skin
-                )
-                if not skin_ok:
-                    continue
+        feats = self._product_features(snap, new_product)
+
+        # ── รวม user ที่ signature เดียวกัน → score ครั้งเดียวต่อ signature ──────
+        sig_index  = {}
+        signatures = []
+        user_sig   = np.empty(len(all_users), dtype=np.int64)
+        for i, user in enumerate(all_users):
+            sig = _user_signature(user.get("skin_type"), user.get("concerns"), user.get("context"))
+            j = sig_index.get(sig)
+            if j is None:
+                j = sig_index[sig] = len(signatures)
+                signatures.append(sig)
+            user_sig[i] = j
+
+        if not signatures:
+            return []
 
-            score = self._score_single_product(
-                product_row, skin_type, concerns, context
-            )
+        skin_ok, concern_score, cosine_score = self._signature_layers(
+            snap, feats, [st for st, _, _ in signatures], [cs for _, cs, _ in signatures]
+        )
 
-            if score >= score_threshold:
-                matched_users.append({
-                    "user_id":   user.get("user_id"),
-                    "skin_type": skin_type,
-                    "concerns":  concerns,
-                    "score":     score,
-                })
+        # ── Layer 3: context — boost vector ต่อ signature (S × n_tags) ─────────
+        boosts       = np.vstack([_context_vector(dict(ctx)) for _, _, ctx in signatures])
+        max_possible = boosts.sum(axis=1)
+        context_score = np.where(
+            max_possible > 0,
+            np.minimum((boosts @ feats["tag_hits"]) / np.where(max_possible > 0, max_possible, 1), 1.0),
+            0.0,
+        )
 
+        final_score = np.round(
+            concern_score * 0.55 +
+            cosine_score  * 0.25 +
+            context_score * 0.20, 4
+        )
+
+        # ── กระจาย score กลับไปที่ user ────────────────────────────────────────
+        user_score = final_score[user_sig]
+        hits = np.flatnonzero(skin_ok[user_sig] & (user_score >= score_threshold))
         # เรียงจาก score สูงสุด → แจ้ง user ที่ "ตรงที่สุด" ก่อน
-        return sorted(matched_users, key=lambda x: -x["score"])
+        hits = hits[np.argsort(-user_score[hits], kind="stable")]
+
+        return [
+            {
+                "user_id":   all_users[i].get("user_id"),
+                "skin_type": all_users[i].get("skin_type", ""),
+                "concerns":  all_users[i].get("concerns", []),
+                "score":     float(user_score[i]),
+            }
+            for i in hits
+        ]
+
+    def _product_features(self, snap: CatalogSnapshot, new_product: dict) -> dict:
+        """featurize product ใหม่ครั้งเดียว — ใช้ร่วมกันทุก signature"""
+        product_skin = str(new_product.get("skintype", "")).lower()
+        proba = self.concern_model.predict_matrix(
+            self.concern_model.vectorize([new_product.get("ingredients_list", "")])
+        )
+        tags = str(new_product.get("function_tags", "")).lower()
+        return {
+            "skin":        product_skin,
+            "skin_mask":   _skin_mask(product_skin),
+            "concern_row": (proba @ _concern_weight_matrix(self.concern_model.categories))[0],
+            "vec":         snap.vectorizer.transform([
+                " ".join(str(new_product.get(col, "")) for col in self.TFIDF_COLS)
+            ]),
+            "tag_hits":    np.array([tag in tags for tag in CONTEXT_TAGS], dtype=np.float64),
+        }
+
+    def _signature_layers(self, snap: CatalogSnapshot, feats: dict,
+                           skin_types: list, concern_lists: list) -> tuple:
+        """
+        ต่อ signature: (skin_ok, concern score, cosine score)
+        skin_ok = ผ่าน hard filter ของ product ไหม
+        """
+        # Hard filter — skin type ต้องตรงก่อน เหมือนระบบหลัก
+        skin_ok = np.array([
+            not st or st.lower() == "all" or _skin_ok(feats["skin_mask"], feats["skin"], st)
+            for st in skin_types
+        ], dtype=bool)
+
+        # ── Layer 1: concern — นับ concern ต่อ signature (S × 8) @ concern score ของ product
+        counts     = np.zeros((len(concern_lists), len(CONCERN_KEYS)), dtype=np.float64)
+        n_concerns = np.zeros(len(concern_lists), dtype=np.float64)
+        for j, concerns in enumerate(concern_lists):
+            n_concerns[j] = len(concerns)
+            for c in concerns:
+                if c in CONCERN_INDEX:
+                    counts[j, CONCERN_INDEX[c]] += 1
+        concern_score = np.minimum((counts @ feats["concern_row"]) / np.maximum(n_concerns, 1), 1.0)
+
+        # ── Layer 2: cosine ระหว่าง query ของทุก signature กับ product ─────────
+        cosine_score = _cosine_similarity(
+            snap.vectorizer.transform([
+                st + " " + " ".join(cs) for st, cs in zip(skin_types, concern_lists)
+            ]),
+            feats["vec"],
+        ).ravel()
+        return skin_ok, concern_score, cosine_score
+
+    # ================================================================
+    # REVERSE MATCH จาก user_profiles
+    # หา (skin_type, concern_bits) ที่ score สูงสุดที่เป็นไปได้ยังถึง threshold
+    # แล้วให้ DB stream เฉพาะ user กลุ่มนั้นมาเป็น chunk (repository.stream_user_profiles)
+    # — ไม่โหลด user ทั้งหมด, ผู้ใช้หลักคือ notify_new_products.py
+    # ================================================================
+    def profile_candidates(self, new_product: dict, skin_types: list,
+                            score_threshold: float = 0.4) -> list:
+        """
+        (skin_type, concern_bits) ที่อาจผ่าน threshold
+        context ใช้ค่าสูงสุดที่ product นี้ทำได้ — ผลรวม boost หลาย dimension
+        เป็นค่าเฉลี่ยถ่วงน้ำหนัก จึงไม่เกิน ratio ของ (dimension, value) ที่ดีที่สุด
+        """
+        snap = self.snapshot
+        if snap is None or not skin_types:
+            return []
+
+        feats   = self._product_features(snap, new_product)
+        n_masks = 1 << len(CONCERN_KEYS)
+        pairs   = [(st, bits) for st in skin_types for bits in range(n_masks)]
+        skin_ok, concern_score, cosine_score = self._signature_layers(
+            snap, feats,
+            [st for st, _ in pairs],
+            [decode_concern_bits(bits) for _, bits in pairs],
+        )
+
+        context_max = max(
+            [float(vec @ feats["tag_hits"] / vec.sum()) for vec in CONTEXT_VECTORS.values() if vec.sum() > 0],
+            default=0.0,
+        )
+        bound = concern_score * 0.55 + cosine_score * 0.25 + min(context_max, 1.0) * 0.20
+        keep  = skin_ok & (bound >= score_threshold - 1e-4)   # final score ถูกปัด 4 ตำแหน่ง
+        return [pairs[i] for i in np.flatnonzero(keep)]
 
-    def search_products(self, query: str) -> list:
-        if self.df is None:
+    def autocomplete(self, prefix: str, limit: int = 10) -> list:
+        snap = self.snapshot
+        if snap is None:
             return []
-        q  = query.lower().strip()
-        df = self.df
+        return snap.autocomplete.suggest(prefix, limit)
 
-        name_match = df[
-            df["name"].str.lower().str.contains(q, na=False) |
-            df["brand"].str.lower().str.contains(q, na=False)
-        ]
-        if not name_match.empty:
-            return name_match[
-                ["name", "brand", "major_category", "subtype",
-                 "skintype", "function_tags", "image_url", "price"]
-            ].to_dict(orient="records")
-
-        scores = cosine_similarity(
-            self.vectorizer.transform([q]), self.tfidf_matrix
+    def search_products(self, query: str, limit: int = 100, offset: int = 0) -> list:
+        snap = self.snapshot
+        if snap is None:
+            return []
+        q = query.lower().strip()
+        if not q:
+            return []
+
+        ranked = snap.search_index.search(q, fallback=lambda q: self._search_fallback(snap, q))
+        ranked = ranked[snap.alive[ranked]]   # index ใช้ร่วมกันหลาย snapshot — ตัดตัวที่ mask ออกที่นี่
+        return [self._search_row(snap, pos) for pos in ranked[offset:offset + limit]]
+
+    def _search_fallback(self, snap: CatalogSnapshot, q: str) -> np.ndarray:
+        """ไม่มีชื่อ/brand ตรง → TF-IDF cosine กับทั้ง catalog เอาแค่ top-k"""
+        scores = _cosine_similarity(
+            snap.vectorizer.transform([q]), snap.tfidf_matrix
         ).flatten()
-        return df.assign(score=scores).sort_values("score", ascending=False)[
-            ["name", "brand", "major_category", "subtype",
-             "skintype", "function_tags", "image_url", "price"]
-        ].to_dict(orient="records")
\ No newline at end of file
+        scores[~snap.alive] = -1
+        return _top_k(scores, SEARCH_FALLBACK_K)
+
+    def _search_row(self, snap: CatalogSnapshot, pos: int) -> dict:
+        row = snap.row(pos)
+        return {col: row[col] for col in SEARCH_COLS}
@@ -0,0 +1,58 @@
+"""
+startup phases ของ backend — แทนการทำงานตอน import
+
+แต่ละ phase รันครั้งเดียวต่อ process (เรียกซ้ำคืนผลเดิม) และจับเวลาเป็น ms
+report() → /api/engine/stats: เวลาแต่ละ phase, ready (create_app เสร็จ), first_request
+ทุกค่านับจาก started (ต้นไฟล์ app.py ก่อน import อื่นๆ)
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class Startup:
+    def __init__(self, started: float = None):
+        self.started  = time.perf_counter() if started is None else started
+        self.phases   = OrderedDict()   # name → ms
+        self.ready_ms = None
+        self.first_request_ms = None
+        self._results = {}
+        self._lock    = threading.RLock()
+
+    def _since_start(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    def mark(self, name: str):
+        """phase ที่จบไปแล้ว (เช่น imports) — เวลาตั้งแต่ started ลบ phase ก่อนหน้า"""
+        with self._lock:
+            if name not in self.phases:
+                self.phases[name] = round(self._since_start() - sum(self.phases.values()), 1)
+
+    def run(self, name: str, fn, *args, **kwargs):
+        with self._lock:
+            if name in self._results:
+                return self._results[name]
+            t = time.perf_counter()
+            result = fn(*args, **kwargs)
+            self.phases[name]   = round((time.perf_counter() - t) * 1000, 1)
+            self._results[name] = result
+        print(f"⏱️  {name}: {self.phases[name]:.0f} ms")
+        return result
+
+    def ready(self):
+        if self.ready_ms is None:
+            self.ready_ms = self._since_start()
+            print(f"⏱️  ready: {self.ready_ms:.0f} ms "
+                  f"({', '.join(f'{k} {v:.0f}' for k, v in self.phases.items())})")
+
+    def first_request(self):
+        if self.first_request_ms is None:
+            self.first_request_ms = self._since_start()
+            print(f"⏱️  first request: {self.first_request_ms:.0f} ms")
+
+    def report(self) -> dict:
+        return {
+            "phases":           dict(self.phases),
+            "ready_ms":         self.ready_ms,
+            "first_request_ms": self.first_request_ms,
+        }
@@ -39,7 +39,12 @@ class UserManager:
         finally:
             conn.close()
 
-    def add_history(self, email, skin_type, concerns, recommend_results, routine_results=None):
+    def add_history(self, email, skin_type, concerns, recommend_results, routine_results=None,
+                    profile=None):
+        """
+        profile (จาก ai_engine_v2.encode_profile) → upsert user_profiles ใน transaction เดียวกัน
+        ทั้งสอง table จึงสำเร็จหรือไม่สำเร็จพร้อมกัน และใช้ connection เดียวต่อ request
+        """
         conn = get_connection()
         try:
             cur = conn.cursor()
@@ -55,12 +60,26 @@ class UserManager:
                 json.dumps(routine_results, ensure_ascii=False) if routine_results else None,
                 'both' if routine_results else 'recommend',
             ))
+            if profile:
+                self._upsert_profile(cur, email, profile)
             conn.commit()
         except Exception as e:
+            conn.rollback()
             print(f"❌ Failed to save history: {e}")
         finally:
             conn.close()
 
+    def _upsert_profile(self, cur, email, profile):
+        """skin profile ล่าสุดของ user — commit โดยผู้เรียก"""
+        cols = list(profile)
+        cur.execute(f"""
+            INSERT INTO user_profiles (user_id, {', '.join(cols)})
+            SELECT id, {', '.join(['%s'] * len(cols))} FROM users WHERE email = %s
+            ON CONFLICT (user_id) DO UPDATE SET
+                {', '.join(f'{c} = EXCLUDED.{c}' for c in cols)},
+                updated_at = NOW()
+        """, [profile[c] for c in cols] + [email])
+
     def get_user_with_history(self, email):
         conn = get_connection()
         try:
@@ -0,0 +1,81 @@
+"""
+fixture ร่วมของ tests — engine build จาก tests/fixtures/catalog.json แทน DB
+
+catalog.json : product 133 ตัว (สุ่มจาก catalog จริง) — days_ago แทน created_at
+               เพื่อให้ is_new ไม่ขึ้นกับวันที่รัน test
+expected.json: ผลของ ai_engine_v2 รุ่นก่อน refactor (DataFrame ทีละแถว) บน catalog เดียวกัน
+"""
+import os
+import sys
+import json
+import atexit
+import shutil
+import tempfile
+from pathlib import Path
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+import pytest
+
+BACKEND  = Path(__file__).resolve().parent.parent
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+sys.path.insert(0, str(BACKEND))
+
+# artifact cache ของ engine ลง temp dir — ไม่แตะ data/engine_cache ของเครื่องที่รัน test
+# (ArtifactStore อ่านค่านี้ตอน import จึงต้องตั้งก่อน)
+ARTIFACT_DIR = tempfile.mkdtemp(prefix="engine-cache-")
+os.environ["ENGINE_ARTIFACT_DIR"] = ARTIFACT_DIR
+# ไม่ตั้ง timer persist — timer ของ test หนึ่งจะไปเขียน / prune artifact ระหว่าง test อื่น
+# test ที่ต้องการเรียก persist() เอง หรือ monkeypatch ARTIFACT_PERSIST_DELAY
+os.environ["ENGINE_ARTIFACT_PERSIST_DELAY"] = "-1"
+atexit.register(shutil.rmtree, ARTIFACT_DIR, True)
+
+from services import ai_engine_v2 as E   # noqa: E402
+
+
+def load_json(name: str):
+    with open(FIXTURES / name, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def catalog_rows() -> list:
+    """แถวแบบที่ get_all_products คืน — created_at = ตอนนี้ - days_ago"""
+    now  = datetime.now(timezone.utc)
+    rows = []
+    for p in load_json("catalog.json"):
+        row = {k: v for k, v in p.items() if k != "days_ago"}
+        row["created_at"] = now - timedelta(days=p["days_ago"])
+        rows.append(row)
+    return rows
+
+
+def memmapped(arr) -> bool:
+    """arr (หรือ base ของมัน) เปิดจาก artifact แบบ np.memmap"""
+    while arr is not None:
+        if isinstance(arr, np.memmap):
+            return True
+        arr = getattr(arr, "base", None)
+    return False
+
+
+def make_engine(monkeypatch, rows: list) -> E.DataLoader:
+    """DataLoader ที่อ่าน products จาก rows (list ที่แก้ได้ — get_products_by_ids อ่านค่าล่าสุด)"""
+    monkeypatch.setattr(E, "get_all_products", lambda: [dict(r) for r in rows])
+    monkeypatch.setattr(E, "get_active_ingredient_names", lambda: ["Niacinamide", "Retinol"])
+    monkeypatch.setattr(E, "get_catalog_version", lambda: None)
+    monkeypatch.setattr(E, "get_products_by_ids",
+                        lambda ids: [dict(r) for r in rows if r["id"] in set(ids)])
+    return E.DataLoader()
+
+
+@pytest.fixture(scope="session")
+def engine():
+    """engine ร่วมของ test ที่อ่านอย่างเดียว — test ที่แก้ catalog ใช้ make_engine เอง"""
+    with pytest.MonkeyPatch.context() as mp:
+        yield make_engine(mp, catalog_rows())
+
+
+@pytest.fixture(scope="session")
+def expected():
+    return load_json("expected.json")
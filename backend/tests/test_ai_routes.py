@@ -0,0 +1,250 @@
+"""
+routes/ai_routes.py — engine / user_manager เป็น mock (ไม่ต้องต่อ DB)
+init_ai_routes ผูก route เข้า ai_bp ตัวเดียวของ module จึงเรียกได้ครั้งเดียวต่อ session
+"""
+from unittest.mock import MagicMock
+
+import pytest
+from flask import Flask
+
+from conftest import E   # import conftest ก่อน — เพิ่ม backend เข้า sys.path
+from routes.ai_routes import ai_bp, init_ai_routes, _price_bounds
+
+ENGINE       = MagicMock()
+USER_MANAGER = MagicMock()
+
+
+@pytest.fixture(scope="module")
+def app():
+    init_ai_routes(ENGINE, USER_MANAGER)
+    app = Flask(__name__)
+    app.register_blueprint(ai_bp)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    ENGINE.reset_mock(return_value=True, side_effect=True)
+    USER_MANAGER.reset_mock(return_value=True, side_effect=True)
+    ENGINE.recommend_products.return_value = []
+    ENGINE.recommend_routine.return_value  = []
+    ENGINE.recommend_all.return_value      = {"recommend": [], "routine": []}
+    return app.test_client()
+
+
+# ================================================================
+# PRICE BOUNDS
+# ================================================================
+def test_price_bounds():
+    assert _price_bounds({}) == (0, 100000)
+    assert _price_bounds({"price_range": "medium"}) == (500, 1500)
+    assert _price_bounds({"price_range": "medium", "max_price": "900"}) == (500, 900.0)
+    assert _price_bounds({"min_price": 100, "max_price": 250.5}) == (100.0, 250.5)
+    assert _price_bounds({"min_price": "cheap"}) is None
+    assert _price_bounds({"max_price": [1]}) is None
+
+
+@pytest.mark.parametrize("path", ["/api/recommend", "/api/routine", "/api/recommend-all"])
+def test_bad_price_is_400(client, path):
+    resp = client.post(path, json={"skin_type": "oily", "min_price": "abc"})
+    assert resp.status_code == 400
+    ENGINE.recommend_products.assert_not_called()
+    ENGINE.recommend_routine.assert_not_called()
+    ENGINE.recommend_all.assert_not_called()
+
+
+def test_recommend_passes_price_bounds(client):
+    resp = client.post("/api/recommend", json={"skin_type": "oily", "concerns": ["acne_control"],
+                                               "min_price": 100, "max_price": 300})
+    assert resp.status_code == 200
+    kwargs = ENGINE.recommend_products.call_args.kwargs
+    assert (kwargs["min_price"], kwargs["max_price"]) == (100.0, 300.0)
+
+
+def test_recommend_all_scores_once_and_saves_top5(client):
+    rec = [{"name": f"p{i}"} for i in range(8)]
+    ENGINE.recommend_all.return_value = {"recommend": rec, "routine": [{"name": "r"}]}
+    resp = client.post("/api/recommend-all", json={"skin_type": "dry", "email": "a@b.c"})
+    assert resp.get_json() == {"recommend": rec, "routine": [{"name": "r"}]}
+    ENGINE.recommend_all.assert_called_once()
+    ENGINE.recommend_products.assert_not_called()
+    args = USER_MANAGER.add_history.call_args.args
+    assert args[3] == rec[:5] and args[4] == [{"name": "r"}]
+
+
+# ================================================================
+# PAGINATION
+# ================================================================
+def test_recommend_page_saves_history_on_first_page_only(client):
+    page = {"items": [{"name": f"p{i}"} for i in range(8)], "next_cursor": "abc", "total": 30}
+    ENGINE.recommend_page.return_value = page
+    resp = client.post("/api/recommend", json={"skin_type": "oily", "email": "a@b.c", "page_size": 500})
+    assert resp.get_json() == page
+    assert ENGINE.recommend_page.call_args.kwargs["page_size"] == 100
+    assert USER_MANAGER.add_history.call_args.args[3] == page["items"][:5]
+
+    USER_MANAGER.add_history.reset_mock()
+    client.post("/api/recommend", json={"skin_type": "oily", "email": "a@b.c", "cursor": "abc"})
+    USER_MANAGER.add_history.assert_not_called()
+
+
+def test_recommend_page_bad_cursor_is_400(client):
+    ENGINE.recommend_page.side_effect = ValueError("invalid cursor")
+    resp = client.post("/api/recommend", json={"skin_type": "oily", "cursor": "garbage"})
+    assert resp.status_code == 400
+    assert resp.get_json() == {"error": "invalid cursor"}
+
+
+# ================================================================
+# SEARCH
+# ================================================================
+def test_search_clamps_limit_and_offset(client):
+    ENGINE.search_products.return_value = [{"name": "x"}]
+    resp = client.get("/api/search?q= Serum &limit=9999&offset=-3")
+    assert resp.get_json() == [{"name": "x"}]
+    ENGINE.search_products.assert_called_once_with("serum", limit=500, offset=0)
+    assert client.get("/api/search?q=").get_json() == []
+
+
+# ================================================================
+# AUTOCOMPLETE
+# ================================================================
+def test_autocomplete_clamps_limit(client):
+    ENGINE.autocomplete.return_value = [{"text": "Serum", "type": "product"}]
+    resp = client.get("/api/autocomplete?q=se&limit=99")
+    assert resp.get_json() == [{"text": "Serum", "type": "product"}]
+    ENGINE.autocomplete.assert_called_once_with("se", limit=20)
+
+
+# ================================================================
+# FREE-TEXT RECOMMEND
+# ================================================================
+def test_recommend_text_requires_text(client):
+    assert client.post("/api/recommend-text", json={"text": "  "}).status_code == 400
+    ENGINE.recommend_text.assert_not_called()
+
+
+def test_recommend_text_saves_parsed_profile(client):
+    products = [{"name": f"p{i}"} for i in range(7)]
+    ENGINE.recommend_text.return_value = {
+        "parsed": {"skin_type": "oily", "concerns": ["acne_control"], "category": ""},
+        "products": products,
+    }
+    resp = client.post("/api/recommend-text", json={"text": "หน้ามัน สิว", "email": "a@b.c", "top_n": 500})
+    assert resp.status_code == 200
+    assert ENGINE.recommend_text.call_args.kwargs["top_n"] == 100
+    call = USER_MANAGER.add_history.call_args
+    assert call.args == ("a@b.c", "oily", ["acne_control"], products[:5])
+    assert call.kwargs["profile"] == E.encode_profile("oily", ["acne_control"], {})
+
+
+@pytest.mark.parametrize("top_n", ["abc", [3]])
+def test_recommend_text_bad_top_n_is_400(client, top_n):
+    resp = client.post("/api/recommend-text", json={"text": "หน้ามัน", "top_n": top_n})
+    assert resp.status_code == 400
+    ENGINE.recommend_text.assert_not_called()
+
+
+# ================================================================
+# USER PROFILE
+# ================================================================
+def test_recommend_saves_encoded_profile_with_history(client):
+    context = {"age": "teen", "gender": "male"}
+    client.post("/api/recommend-all", json={"skin_type": "oily", "concerns": ["acne_control"],
+                                            "context": context, "email": "a@b.c"})
+    call = USER_MANAGER.add_history.call_args
+    assert call.args[0] == "a@b.c"
+    assert call.kwargs["profile"] == E.encode_profile("oily", ["acne_control"], context)
+
+
+def test_recommend_without_email_saves_nothing(client):
+    client.post("/api/recommend", json={"skin_type": "oily"})
+    USER_MANAGER.add_history.assert_not_called()
+
+
+# ================================================================
+# ENGINE — ADMIN GUARD
+# ================================================================
+ADMIN = {"X-Admin-Token": "s3cret"}
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr("routes.ai_routes.ENGINE_ADMIN_TOKEN", ADMIN["X-Admin-Token"])
+
+
+@pytest.mark.parametrize("path", ["/api/engine/products", "/api/engine/rebuild"])
+def test_engine_writes_hidden_without_admin_token(client, path):
+    assert client.post(path, json={"name": "a"}, headers=ADMIN).status_code == 404
+
+
+@pytest.mark.parametrize("path", ["/api/engine/products", "/api/engine/rebuild"])
+@pytest.mark.parametrize("headers", [{}, {"X-Admin-Token": "wrong"}, {"X-Admin-Token": "ß"}])
+def test_engine_writes_need_admin_token(client, admin, path, headers):
+    assert client.post(path, json={"name": "a"}, headers=headers).status_code == 403
+    ENGINE.add_products.assert_not_called()
+    ENGINE.rebuild_async.assert_not_called()
+
+
+# ================================================================
+# ENGINE — ADD PRODUCTS
+# ================================================================
+@pytest.fixture
+def inserted(monkeypatch, admin):
+    calls = []
+
+    def insert(product):
+        calls.append(product)
+        return None if product["name"] == "fail" else dict(product, id=len(calls))
+
+    monkeypatch.setattr("routes.ai_routes.insert_product", insert)
+    return calls
+
+
+@pytest.mark.parametrize("body", [[], [{"brand": "x"}], ["name"], {"name": ""}])
+def test_add_products_requires_names(client, inserted, body):
+    assert client.post("/api/engine/products", json=body, headers=ADMIN).status_code == 400
+    assert inserted == []
+
+
+def test_add_products_inserts_then_extends_engine(client, inserted):
+    ENGINE.add_products.return_value = {"added": 1, "products": 10, "drift": 0.0, "refit": False}
+    resp = client.post("/api/engine/products", json=[{"name": "a"}, {"name": "fail"}], headers=ADMIN)
+    assert resp.status_code == 201
+    assert [p["name"] for p in inserted] == ["a", "fail"]
+    ENGINE.add_products.assert_called_once_with([{"name": "a", "id": 1}])
+
+
+def test_add_products_all_inserts_failed(client, inserted):
+    assert client.post("/api/engine/products", json={"name": "fail"}, headers=ADMIN).status_code == 500
+    ENGINE.add_products.assert_not_called()
+
+
+# ================================================================
+# ENGINE — REBUILD
+# ================================================================
+def test_rebuild_starts_in_background(client, admin):
+    ENGINE.rebuild_async.return_value = True
+    ENGINE.rebuilding = True
+    resp = client.post("/api/engine/rebuild", headers=ADMIN)
+    assert resp.status_code == 202
+    assert resp.get_json() == {"started": True, "rebuilding": True}
+
+
+# ================================================================
+# ENGINE — STATS
+# ================================================================
+def test_stats_includes_startup_report(app, client):
+    from services.startup import Startup
+
+    ENGINE.stats.return_value = {"products": 3}
+    assert client.get("/api/engine/stats").get_json() == {"products": 3}
+
+    startup = Startup()
+    startup.run("engine", lambda: None)
+    app.config["STARTUP"] = startup
+    try:
+        got = client.get("/api/engine/stats").get_json()
+    finally:
+        app.config.pop("STARTUP")
+    assert got["products"] == 3 and list(got["startup"]["phases"]) == ["engine"]
@@ -0,0 +1,920 @@
+"""
+ผลของ engine ต้องเท่ากับ ai_engine_v2 รุ่นก่อน refactor (tests/fixtures/expected.json)
+final_score ปัดเหลือ 4 ตำแหน่ง — product ที่ score เท่ากันเรียงลำดับต่างกันได้ จึงเทียบเป็นกลุ่มตาม score
+และกลุ่มสุดท้ายที่โดน top_n ตัดกลางกลุ่ม เทียบแค่ score
+"""
+import json
+import time
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from conftest import E, catalog_rows, make_engine, memmapped
+
+
+def _canon(items: list) -> list:
+    """[(final_score, [product json ...])] — ลำดับภายในกลุ่ม score เดียวกันไม่มีผล"""
+    groups = []
+    for item in items:
+        score = item.get("final_score")
+        if not groups or groups[-1][0] != score:
+            groups.append((score, []))
+        groups[-1][1].append(json.dumps(item, sort_keys=True, ensure_ascii=False))
+    return [(score, sorted(group)) for score, group in groups]
+
+
+def _assert_same_ranking(got: list, want: list, label):
+    got, want = _canon(got), _canon(want)
+    assert [(score, len(g)) for score, g in got] == [(score, len(g)) for score, g in want], label
+    assert got[:-1] == want[:-1], label
+
+
+def _jsonable(value):
+    return json.loads(json.dumps(value, default=lambda o: o.item() if hasattr(o, "item") else str(o)))
+
+
+def _profile(case: dict) -> dict:
+    return {k: case[k] for k in ("skin_type", "concerns", "min_price", "max_price", "context")}
+
+
+# ================================================================
+# EQUIVALENCE กับรุ่นก่อน refactor
+# ================================================================
+def test_recommend_products_matches_baseline(engine, expected):
+    for case in expected["recommend"]:
+        got = _jsonable(engine.recommend_products(top_n=case["top_n"], **_profile(case)))
+        _assert_same_ranking(got, case["expected"], case["skin_type"])
+
+
+def test_recommend_routine_matches_baseline(engine, expected):
+    for case in expected["routine"]:
+        got = _jsonable(engine.recommend_routine(**_profile(case)))
+        assert [(p["step"], p["final_score"]) for p in got] == \
+               [(p["step"], p["final_score"]) for p in case["expected"]], case["skin_type"]
+        # step ที่มีหลายตัว score เท่ากัน เลือกตัวไหนก็ได้
+        for p, want in zip(got, case["expected"]):
+            if p["name"] == want["name"]:
+                assert p == want, (case["skin_type"], p["step"])
+
+
+# ================================================================
+# CONCERN SCORE MATRIX
+# ================================================================
+def test_concern_matrix_matches_per_product_score(engine):
+    model = engine.concern_model
+    for pos, row in enumerate(catalog_rows()):
+        pred = model.predict_proba(row["ingredients_list"] or "")
+        for concern in E.CONCERN_KEYS:
+            want = E._concern_score_normalized(pred, [concern])[0]
+            assert engine.snapshot.concern_matrix[pos, E.CONCERN_INDEX[concern]] == pytest.approx(want), (pos, concern)
+
+
+def test_concern_layer_is_mean_over_concerns():
+    matrix = np.array([[0.2, 0.4, 0.0, 0, 0, 0, 0, 0.9],
+                       [1.0, 1.0, 0.0, 0, 0, 0, 0, 0.0]])
+    got = E._concern_layer(matrix, ["acne_control", "brightening", "unknown"])
+    assert got == pytest.approx([0.2, 2 / 3])              # concern ที่ไม่รู้จักนับเป็น 0
+    assert E._concern_layer(matrix, []).tolist() == [0.0, 0.0]
+
+
+# ================================================================
+# INGREDIENT MATRIX
+# ================================================================
+def test_ingredient_matrix_is_multi_hot_of_known_ingredients(engine):
+    model = engine.concern_model
+    for pos, row in enumerate(catalog_rows()):
+        want = {model._ingr_index[i.strip().lower()]
+                for i in str(row["ingredients_list"] or "").split(",")
+                if i.strip().lower() in model._ingr_index}
+        got = engine.snapshot.ingredient_matrix[pos]
+        assert set(got.indices) == want, pos
+        assert (got.data == 1).all()
+
+
+def test_vectorize_normalizes_and_dedupes(engine):
+    model = engine.concern_model
+    name  = next(iter(model._ingr_index))
+    X = model.vectorize([f" {name.upper()} ,{name}, not-an-ingredient", "", None])
+    assert X.shape == (3, model._n_features)
+    assert X[0].nnz == 1 and X[0, model._ingr_index[name]] == 1
+    assert X[1].nnz == 0 and X[2].nnz == 0
+
+
+# ================================================================
+# SKIN TYPE BITMASK
+# ================================================================
+def test_skin_mask_substring_semantics():
+    assert E._skin_mask("Oily, Combination") == E.SKIN_BITS["oily"] | E.SKIN_BITS["combination"]
+    assert E._skin_mask("ทุกสภาพผิว") == E.SKIN_BITS["ทุกสภาพผิว"]
+    assert E._skin_mask(None) == 0
+    assert E._skin_ok(E._skin_mask("dry"), "dry", "oily") is False
+    assert E._skin_ok(E._skin_mask("all skin types"), "all skin types", "oily") is True
+    assert E._skin_ok(E._skin_mask("mature skin"), "mature skin", "Mature") is True   # ไม่อยู่ใน SKIN_BITS
+
+
+@pytest.mark.parametrize("skin_type", ["oily", "dry", "sensitive", "combination", "normal", "mature"])
+def test_skin_hits_match_string_contains(engine, skin_type):
+    skintypes = [str(r["skintype"] or "").lower() for r in catalog_rows()]
+    pos  = np.arange(len(skintypes))
+    want = [skin_type in s for s in skintypes]
+    assert engine.snapshot.skin_hits(pos, skin_type).tolist() == want
+
+
+# ================================================================
+# PRICE INDEX
+# ================================================================
+@pytest.mark.parametrize("lo, hi", [(0, 100000), (0, 500), (500, 1500), (1500, 100000),
+                                    (350, 350), (99999, 100000), (800, 200)])
+def test_price_candidates_match_brute_force(engine, lo, hi):
+    price = np.array([float(r["price"] or 0) for r in catalog_rows()])
+    want  = set(np.flatnonzero(((price >= lo) & (price <= hi) & (price > 0)) | (price <= 0)))
+    got   = engine.snapshot.price_candidates(lo, hi)
+    assert len(got) == len(set(got))
+    assert set(got) == want
+
+
+# ================================================================
+# CONTEXT LAYER
+# ================================================================
+def _context_score_per_product(function_tags: str, context: dict) -> float:
+    """สูตรเดิมก่อน vectorize — รวม boost ของทุก dimension แล้วเช็ค tag ทีละตัว"""
+    boosts = {}
+    for key, rule_map in E.CONTEXT_RULES.items():
+        for tag, w in rule_map.get(context.get(key, ""), {}).items():
+            boosts[tag] = boosts.get(tag, 0) + w
+    max_possible = sum(boosts.values())
+    if not max_possible:
+        return 0.0
+    raw = sum(w for tag, w in boosts.items() if tag.lower() in function_tags.lower())
+    return min(raw / max_possible, 1.0)
+
+
+@pytest.mark.parametrize("context", [
+    {},
+    {"gender": "male", "age": "teen"},
+    {"hydration": "very_dry", "environment": "ac_all_day", "routine_time": "evening"},
+    {"age": "mature", "experience": "advanced", "unknown": "x", "gender": "nope"},
+])
+def test_context_layer_matches_per_product_score(engine, context):
+    tags = [str(r["function_tags"] or "") for r in catalog_rows()]
+    got  = E._context_layer(engine.snapshot.context_matrix, E._context_vector(context))
+    assert got == pytest.approx([_context_score_per_product(t, context) for t in tags])
+
+
+# ================================================================
+# TOP-K
+# ================================================================
+def test_top_k_matches_stable_sort():
+    rng = np.random.default_rng(0)
+    for n, k in [(50, 5), (50, 50), (50, 80), (1, 1), (200, 17)]:
+        scores = np.round(rng.random(n), 1)        # ปัดให้มีค่าซ้ำเยอะ
+        want   = np.argsort(-scores, kind="stable")[:k]
+        assert E._top_k(scores, k).tolist() == want.tolist(), (n, k)
+    assert len(E._top_k(np.array([]), 3)) == 0
+    assert len(E._top_k(np.ones(4), 0)) == 0
+
+
+# ================================================================
+# RECOMMEND ALL
+# ================================================================
+def test_recommend_all_matches_separate_calls(engine, expected):
+    for case in expected["recommend"]:
+        profile = _profile(case)
+        got = engine.recommend_all(top_n=case["top_n"], **profile)
+        assert _jsonable(got["recommend"]) == _jsonable(engine.recommend_products(top_n=case["top_n"], **profile))
+        assert _jsonable(got["routine"]) == _jsonable(engine.recommend_routine(**profile))
+
+
+# ================================================================
+# CATALOG SNAPSHOT
+# ================================================================
+def test_snapshot_arrays_are_read_only(engine):
+    snap = engine.snapshot
+    for arr in (snap.price, snap.is_new, snap.concern_matrix, snap.skin_mask,
+                snap.routine_masks, snap.price_order, *snap.columns.values()):
+        with pytest.raises(ValueError):
+            arr[0] = arr[0]
+
+
+def test_snapshot_row(engine):
+    rows = catalog_rows()
+    for pos in (0, 5, len(rows) - 1):
+        row = engine.snapshot.row(pos)
+        assert (row["id"], row["name"], row["brand"]) == (rows[pos]["id"], rows[pos]["name"], rows[pos]["brand"])
+        assert row["price"] == float(rows[pos]["price"] or 0)
+        assert isinstance(row["is_new"], bool)
+
+
+# ================================================================
+# SIMILARITY BANK
+# ================================================================
+def test_similarity_bank_matches_direct_cosine(engine):
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    snap = engine.snapshot
+    bank = E.SimilarityBank(snap.vectorizer, snap.tfidf_matrix)
+    got  = bank.get("oily", ["brightening", "acne_control"])
+    want = cosine_similarity(snap.vectorizer.transform(["oily acne_control brightening"]),
+                             snap.tfidf_matrix).ravel()
+    assert got == pytest.approx(want)
+    assert bank.get("oily", ["acne_control", "brightening"]) is got   # ลำดับ concern ไม่มีผล
+
+
+def test_similarity_bank_evicts_lru_within_budget(engine):
+    snap = engine.snapshot
+    one  = len(snap) * 8
+    bank = E.SimilarityBank(snap.vectorizer, snap.tfidf_matrix, max_bytes=2 * one)
+    a = bank.get("oily", [])
+    bank.get("dry", [])
+    bank.get("oily", [])            # oily ใช้ล่าสุด → dry ถูกไล่ออก
+    bank.get("sensitive", [])
+    assert list(bank._vectors) == [("oily", ()), ("sensitive", ())]
+    assert bank._bytes <= bank.max_bytes
+    assert bank.get("oily", []) is a
+
+
+# ================================================================
+# RESULT CACHE
+# ================================================================
+def test_recommend_is_served_from_cache(engine):
+    profile = dict(skin_type="oily", concerns=["acne_control"], min_price=0, max_price=100000,
+                   context={"age": "teen", "unknown": "x"})
+    first = engine.recommend_products(top_n=5, **profile)
+    hits  = engine.result_cache.hits
+    # context ที่ไม่มีผลต่อ score ไม่ทำให้ cache miss
+    again = engine.recommend_products(top_n=5, **dict(profile, context={"age": "teen"}))
+    assert again is first
+    assert engine.result_cache.hits == hits + 1
+    assert engine.recommend_products(top_n=6, **profile) is not first
+
+
+# ================================================================
+# PAGINATION
+# ================================================================
+def test_recommend_page_walks_recommend_products(engine, expected):
+    for case in expected["recommend"]:
+        profile = _profile(case)
+        items, cursor = [], None
+        while True:
+            page = engine.recommend_page(cursor=cursor, page_size=3, top_n=case["top_n"], **profile)
+            items += page["items"]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert page["total"] == len(items)
+        assert _jsonable(items) == _jsonable(engine.recommend_products(top_n=case["top_n"], **profile))
+
+
+def test_recommend_page_rejects_bad_cursor(engine):
+    with pytest.raises(ValueError):
+        engine.recommend_page("oily", ["acne_control"], cursor="garbage")
+
+
+def test_cursor_stays_valid_after_catalog_change(monkeypatch):
+    rows = catalog_rows()
+    eng  = make_engine(monkeypatch, rows[:-1])
+    monkeypatch.setattr(E, "TFIDF_REFIT_DRIFT", 1.0)
+    first = eng.recommend_page("oily", ["acne_control"], page_size=20)
+    eng.add_products([rows[-1]])                 # version เปลี่ยน — cursor เดิมยังใช้ได้
+
+    page  = eng.recommend_page("oily", ["acne_control"], cursor=first["next_cursor"], page_size=20)
+    fresh = eng.recommend_products("oily", ["acne_control"], top_n=100)
+    assert _jsonable(page["items"]) == _jsonable(fresh[20:40])
+
+
+# ================================================================
+# EXPLANATION FRAGMENTS
+# ================================================================
+def test_explanation_fragments_match_row(engine):
+    rows = catalog_rows()
+    for pos in (0, 7, len(rows) - 1):
+        row, frag = rows[pos], engine.snapshot.fragments[pos]
+        assert frag["skintype"] == str(row["skintype"]).lower()
+        for mcat, col in E.MODEL_TO_COL.items():
+            assert list(frag["ingredients"][mcat]) == \
+                   [i.strip() for i in str(row[col] or "").split(",") if i.strip()], (pos, mcat)
+        key = [v.strip() for v in str(row["key_ingredients"] or "").split(",") if v.strip()][:3]
+        assert frag["key_text"] == (f"Key ingredients: {', '.join(key)}" if key else None)
+
+
+def test_concern_reason_text_uses_descriptions(monkeypatch):
+    frag = {"labels": {"Niacinamide": "Niacinamide (ลดรอยดำ)"}}
+    monkeypatch.setattr(E, "INGR_DESC", {"niacinamide": "ลดรอยดำ"})
+    assert E._concern_reason_text(frag, "ผิวกระจ่างใส", ["Niacinamide", "Vitamin C", "Arbutin"]) == \
+           "ช่วยผิวกระจ่างใส: Niacinamide (ลดรอยดำ) | Vitamin C"
+    assert E._concern_reason_text(frag, "ผิวกระจ่างใส", []) == "ช่วยผิวกระจ่างใส"
+    monkeypatch.setattr(E, "INGR_DESC", {})
+    assert E._concern_reason_text(frag, "ผิวกระจ่างใส", ["Niacinamide", "Vitamin C"]) == \
+           "ช่วยผิวกระจ่างใส: Niacinamide, Vitamin C"
+
+
+# ================================================================
+# SEARCH
+# ================================================================
+def test_search_matches_baseline(engine, expected):
+    for case in expected["search"]:
+        got = engine.search_products(case["query"], limit=1000)
+        assert sorted(f"{r['name']}|{r['brand']}" for r in got) == case["expected"], case["query"]
+
+
+def test_search_fallback_is_top_k(engine):
+    # ไม่มีชื่อ/brand ตรง → TF-IDF fallback ตัดเหลือ SEARCH_FALLBACK_K
+    got = engine.search_products("zzqxjv", limit=1000)
+    assert 0 < len(got) <= E.SEARCH_FALLBACK_K
+
+
+def test_search_pages(engine):
+    full = engine.search_products("serum", limit=1000)
+    assert engine.search_products("serum", limit=5, offset=3) == full[3:8]
+    assert engine.search_products("   ") == []
+
+
+@pytest.mark.parametrize("q", ["s", "se", "ser", "serum", "cream", "ahc", "the ", "zzqxjv"])
+def test_search_index_matches_substring_scan(engine, q):
+    index = E.SearchIndex(engine.snapshot.columns["name"], engine.snapshot.columns["brand"])
+    want  = {pos for pos, (n, b) in enumerate(zip(index.names, index.brands)) if q in n or q in b}
+    got   = index.search(q)
+    assert len(got) == len(set(got)) and set(got) == want
+    assert index.search(q) is got                     # cache ต่อ query
+
+
+def test_search_index_rank_order():
+    names  = np.array(["acne gel", "serum", "my serum", "serum x", None], dtype=object)
+    brands = np.array(["serum co", "a", "b", "c", "serum"], dtype=object)
+    index  = E.SearchIndex(names, brands)
+    # ชื่อตรง > ขึ้นต้นชื่อ > brand ตรง > ขึ้นต้น brand > ขึ้นต้นคำในชื่อ
+    assert index.search("serum").tolist() == [1, 3, 4, 0, 2]
+
+
+# ================================================================
+# AUTOCOMPLETE
+# ================================================================
+def test_autocomplete_suggests_catalog_entries(engine):
+    got = engine.autocomplete("ni", limit=20)
+    assert 0 < len(got) <= 20
+    assert all(s["text"].lower().startswith("ni") for s in got)
+    assert {"text": "Niacinamide", "type": "ingredient"} in got
+    names = {r["name"] for r in catalog_rows()}
+    assert all(s["text"] in names for s in engine.autocomplete(catalog_rows()[0]["name"][:4], 20)
+               if s["type"] == "product")
+
+
+def _ingredient_popularity(ac, name: str) -> tuple:
+    i = next(i for i, (k, kind) in enumerate(zip(ac.keys, ac.kinds)) if k == name and kind == "ingredient")
+    return ac.texts[i], float(ac.popularity[i])
+
+
+def test_autocomplete_counts_shared_ingredient_once(engine):
+    # "Niacinamide" มีทั้งใน active_ingredients และ vocabulary ของ concern model ("niacinamide")
+    assert "niacinamide" in engine.concern_model.ingredients
+    want = sum(
+        [t.strip().lower() for t in str(r["ingredients_list"]).split(",")].count("niacinamide")
+        for r in catalog_rows()
+    )
+    assert want > 0
+    assert _ingredient_popularity(engine.snapshot.autocomplete, "niacinamide") == ("Niacinamide", want)
+
+
+# ================================================================
+# FREE-TEXT RECOMMEND
+# ================================================================
+def test_recommend_text_uses_parsed_profile(engine):
+    got = engine.recommend_text("หน้ามัน สิว", top_n=5)
+    assert got["parsed"] == {"skin_type": "oily", "concerns": ["acne_control"], "category": ""}
+    assert _jsonable(got["products"]) == _jsonable(engine.recommend_products("oily", ["acne_control"], top_n=5))
+
+
+def test_recommend_text_limits_category(engine):
+    got = engine.recommend_text("ผิวแห้ง เซรั่ม", top_n=5)
+    assert got["parsed"]["category"] == "serum"
+    assert got["products"] and all(p["major_category"] == "serum" for p in got["products"])
+    assert engine.recommend_text("อยากได้ของดีๆ")["parsed"]["skin_type"] == "all"
+
+
+# ================================================================
+# FIND MATCHING USERS
+# ================================================================
+def test_find_matching_users_matches_baseline(engine, expected):
+    case    = expected["match"]
+    product = next(r for r in catalog_rows() if r["id"] == case["product_id"])
+    got = engine.find_matching_users(product, case["users"], case["score_threshold"])
+    assert _jsonable(got) == case["expected"]
+
+
+def test_user_signature_ignores_concern_order_and_unknown_context():
+    a = E._user_signature("oily", ["brightening", "acne_control"], {"age": "teen", "x": "y"})
+    b = E._user_signature("oily", ["acne_control", "brightening"], {"age": "teen"})
+    assert a == b
+    assert E._user_signature(None, None, None) == E._user_signature("", [], {})
+
+
+def test_find_matching_users_without_users(engine):
+    assert engine.find_matching_users(catalog_rows()[0], []) == []
+
+
+# ================================================================
+# REVERSE MATCH จาก user_profiles
+# ================================================================
+def _random_users(n: int, seed: int = 0) -> list:
+    rng   = np.random.default_rng(seed)
+    skins = ["oily", "dry", "sensitive", "combination", "normal", "all"]
+    users = []
+    for i in range(n):
+        concerns = list(rng.choice(E.CONCERN_KEYS, size=rng.integers(0, 4), replace=False))
+        context  = {dim: rng.choice(values) for dim, values in E.CONTEXT_VALUES.items() if rng.random() < 0.6}
+        users.append(E.decode_profile(dict(
+            E.encode_profile(str(rng.choice(skins)), concerns, context), user_id=i, email=f"u{i}@x",
+        )))
+    return users
+
+
+@pytest.mark.parametrize("pos, threshold", [(10, 0.2), (3, 0.3), (40, 0.25)])
+def test_profile_candidates_never_drop_a_match(engine, pos, threshold):
+    product = catalog_rows()[pos]
+    users   = _random_users(400, seed=pos)
+    skins   = sorted({u["skin_type"] for u in users})
+    cands   = set(engine.profile_candidates(product, skins, threshold))
+    assert len(cands) < len(skins) << len(E.CONCERN_KEYS)       # ตัด pair ทิ้งได้จริง
+    for m in engine.find_matching_users(product, users, threshold):
+        assert (m["skin_type"], E.encode_concern_bits(m["concerns"])) in cands
+
+
+# ================================================================
+# INCREMENTAL ADD
+# ================================================================
+def test_add_products_matches_full_build(engine, monkeypatch):
+    monkeypatch.setattr(E, "TFIDF_REFIT_DRIFT", 1.0)
+    rows = catalog_rows()
+    eng  = make_engine(monkeypatch, rows[:-3])
+    got  = eng.add_products(rows[-3:])
+    assert (got["added"], got["products"], got["refit"]) == (3, len(rows), False)
+    assert 0 < got["drift"] <= 1
+
+    snap, full = eng.snapshot, engine.snapshot
+    for name in ("price", "is_new", "concern_matrix", "skin_mask", "routine_masks"):
+        assert np.array_equal(getattr(snap, name), getattr(full, name)), name
+    assert (snap.context_matrix != full.context_matrix).nnz == 0
+    assert (snap.ingredient_matrix != full.ingredient_matrix).nnz == 0
+    assert list(snap.columns["name"]) == list(full.columns["name"])
+    # แถวใหม่ transform ด้วย vectorizer ตัวเดิม
+    text = eng._tfidf_text(eng._prepare(rows[-3:]))
+    assert (snap.tfidf_matrix[-3:] != snap.vectorizer.transform(text)).nnz == 0
+
+    for q in ("serum", "ahc", "cr"):
+        assert eng.search_products(q, limit=1000) == engine.search_products(q, limit=1000), q
+    name = rows[-1]["name"]
+    assert {"text": name, "type": "product"} in eng.autocomplete(name, limit=20)
+
+
+def _wait_rebuild(eng, timeout: float = 30):
+    """รอ rebuild_async — join thread ด้วย เพราะ thread อาจยังไม่ได้ตั้ง rebuilding"""
+    for t in threading.enumerate():
+        if t.name == "engine-rebuild":
+            t.join(timeout)
+    deadline = time.monotonic() + timeout
+    while eng.rebuilding:
+        assert time.monotonic() < deadline, "rebuild ไม่จบ"
+        time.sleep(0.01)
+
+
+def test_add_products_refits_on_drift(monkeypatch):
+    monkeypatch.setattr(E, "TFIDF_REFIT_DRIFT", 0.0)
+    rows = catalog_rows()
+    eng  = make_engine(monkeypatch, rows)
+    old  = eng.snapshot
+    new  = dict(rows[0], id=10**6, name="Qwzx Vbnm Serum", brand="Qwzx")
+    rows.append(new)                                # refit อ่าน catalog ใหม่จาก DB
+    got  = eng.add_products([new])
+    assert got["refit"] is True and got["products"] == len(rows)
+    assert eng.search_products("qwzx")[0]["name"] == "Qwzx Vbnm Serum"   # ต่อท้ายไปก่อน
+    _wait_rebuild(eng)
+    assert eng.snapshot.vectorizer is not old.vectorizer
+    assert len(eng.snapshot) == len(rows)
+    assert eng._drift() == 0.0
+    assert eng.search_products("qwzx")[0]["name"] == "Qwzx Vbnm Serum"
+
+
+def test_add_products_empty(engine):
+    got = engine.add_products([])
+    assert (got["added"], got["refit"]) == (0, False)
+
+
+# ================================================================
+# REBUILD
+# ================================================================
+class SlowCatalog:
+    """get_all_products ที่ค้างรอบแรกจน release — ระหว่างนั้น test แก้ catalog ได้"""
+
+    def __init__(self, rows: list):
+        self.rows    = rows
+        self.calls   = 0
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        snapshot = [dict(r) for r in self.rows]
+        if self.calls == 1:
+            self.reading.set()
+            self.release.wait(10)
+        return snapshot
+
+
+def test_rebuild_keeps_products_added_during_build(monkeypatch):
+    rows = catalog_rows()
+    eng  = make_engine(monkeypatch, rows[:-1])
+    late = rows[-1]
+    db   = SlowCatalog(rows[:-1])                # DB ตอนอ่าน ยังไม่มี late
+    monkeypatch.setattr(E, "get_all_products", db)
+
+    t = threading.Thread(target=eng.rebuild)
+    t.start()
+    assert db.reading.wait(10)
+    assert eng.rebuilding
+    db.rows = rows                              # route insert late ลง DB แล้วค่อย add
+    eng.add_products([rows[0], late])           # rows[0] มีอยู่แล้ว → ไม่ซ้ำ
+    db.release.set()
+    t.join(10)
+    _wait_rebuild(eng)
+
+    ids = eng.snapshot.columns["id"].tolist()
+    assert sorted(ids) == sorted(r["id"] for r in rows)      # ไม่หาย ไม่ซ้ำ
+    assert eng._added_during_rebuild is None
+
+
+def test_add_during_rebuild_with_artifacts_does_not_deadlock(monkeypatch):
+    # rebuild ถือ flock ของ artifact ระหว่าง build — add ต้องไม่รอ flock ใต้ _add_lock
+    rows  = catalog_rows()
+    eng   = make_engine(monkeypatch, rows[:-1])
+    assert eng.artifacts.enabled
+    monkeypatch.setattr(E, "get_all_products", lambda: [dict(r) for r in rows[:-2]])
+    build    = eng._build_snapshot
+    building = threading.Event()
+    release  = threading.Event()
+
+    def slow_build(*args):
+        building.set()
+        release.wait(10)
+        return build(*args)
+
+    monkeypatch.setattr(eng, "_build_snapshot", slow_build)
+    rebuild = threading.Thread(target=eng.rebuild, daemon=True)
+    rebuild.start()
+    assert building.wait(10)
+
+    add = threading.Thread(target=eng.add_products, args=([rows[-1]],), daemon=True)
+    add.start()
+    add.join(10)
+    release.set()
+    rebuild.join(30)
+    assert not add.is_alive() and not rebuild.is_alive(), "deadlock"
+
+    ids = set(eng.snapshot.columns["id"][eng.snapshot.alive].tolist())
+    assert rows[-1]["id"] in ids and rows[-2]["id"] not in ids
+
+
+def test_rebuild_requested_during_rebuild_runs_again(monkeypatch):
+    eng = make_engine(monkeypatch, catalog_rows())
+    db  = SlowCatalog(catalog_rows())
+    monkeypatch.setattr(E, "get_all_products", db)
+
+    t = threading.Thread(target=eng.rebuild)
+    t.start()
+    assert db.reading.wait(10)
+    assert eng.rebuild() is False               # อ่าน DB ไปก่อนแล้ว → ต้องวนอีกรอบ
+    db.release.set()
+    t.join(10)
+    assert db.calls == 2
+    assert not eng.rebuilding and eng.stats()["rebuilding"] is False
+
+
+def test_rebuild_request_at_finish_is_not_lost(monkeypatch):
+    eng   = make_engine(monkeypatch, catalog_rows())
+    once  = eng._rebuild_once
+    calls = []
+
+    def rebuild_once():
+        calls.append(1)
+        built = once()
+        if len(calls) == 1:
+            assert eng.rebuild() is False       # คำขอมาตอน rebuild อ่านเสร็จแต่ยังไม่จบ
+        return built
+
+    monkeypatch.setattr(eng, "_rebuild_once", rebuild_once)
+    assert eng.rebuild() is True
+    assert len(calls) == 2 and not eng.rebuilding
+
+
+def test_rebuild_error_clears_running_flag(monkeypatch):
+    eng = make_engine(monkeypatch, catalog_rows())
+
+    def boom():
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(eng, "_rebuild_once", boom)
+    with pytest.raises(KeyboardInterrupt):
+        eng.rebuild()
+    assert not eng.rebuilding and eng._added_during_rebuild is None
+
+
+def test_rebuild_with_empty_db_keeps_snapshot(monkeypatch):
+    eng = make_engine(monkeypatch, catalog_rows())
+    old = eng.snapshot
+    monkeypatch.setattr(E, "get_all_products", lambda: [])
+    assert eng.rebuild() is False
+    assert eng.snapshot is old
+
+
+# ================================================================
+# CATALOG CHANGE FEED
+# ================================================================
+def test_apply_changes_adds_inserted_products(monkeypatch):
+    rows = catalog_rows()
+    db   = rows[:-2]
+    eng  = make_engine(monkeypatch, db)
+    monkeypatch.setattr(E, "TFIDF_REFIT_DRIFT", 1.0)
+    monkeypatch.setattr(eng, "rebuild_async", lambda: pytest.fail("ไม่ควร rebuild"))
+    db.extend(rows[-2:])
+    eng.catalog_version = 4
+    eng._apply_changes([
+        {"version": 4, "op": "UPDATE", "ids": [rows[0]["id"]]},          # version เก่า → ข้าม
+        {"version": 5, "op": "INSERT", "ids": [rows[-2]["id"]]},
+        {"version": 6, "op": "INSERT", "ids": [rows[-1]["id"], rows[-2]["id"]]},
+    ])
+    assert eng.catalog_version == 6
+    assert sorted(eng.snapshot.columns["id"].tolist()) == sorted(r["id"] for r in rows)
+
+
+def test_update_and_delete_apply_incrementally(monkeypatch):
+    rows   = catalog_rows()
+    eng    = make_engine(monkeypatch, rows)
+    monkeypatch.setattr(eng, "rebuild_async", lambda: pytest.fail("ไม่ควร rebuild"))
+    before = _jsonable(eng.recommend_products("all", [], top_n=200))
+    old_version = eng.snapshot.version
+
+    names   = [r["name"] for r in rows]
+    regular = [p["name"] for p in before if not p["is_new"] and names.count(p["name"]) == 1]
+    deleted, updated = regular[0], regular[1]
+    by_name = {r["name"]: r for r in rows}
+    del_id, upd_id = by_name[deleted]["id"], by_name[updated]["id"]
+    rows.remove(by_name[deleted])
+    by_name[updated]["price"] = 77777
+
+    eng.catalog_version = 1
+    eng._apply_changes([
+        {"version": 2, "op": "UPDATE", "ids": [upd_id]},
+        {"version": 3, "op": "DELETE", "ids": [del_id]},
+    ])
+
+    assert eng.catalog_version == 3
+    assert eng.snapshot.version != old_version
+    assert eng.stats()["products"] == len(rows)
+    assert eng.persist() and memmapped(eng.snapshot.tfidf_matrix.data)
+    after = _jsonable(eng.recommend_products("all", [], top_n=200))
+    assert deleted not in {p["name"] for p in after}
+    assert [p["price"] for p in after if p["name"] == updated] == [77777]
+    assert not any(r["name"] == deleted for r in eng.search_products(deleted, limit=1000))
+
+    # product อื่นได้ score เดิม (vectorizer / matrix ชุดเดิม)
+    unchanged = lambda items: _canon([p for p in items if p["name"] not in (deleted, updated)])
+    assert unchanged(after) == unchanged(before)
+
+
+def _autocomplete_state(ac) -> dict:
+    return {(k, kind): (text, float(pop))
+            for k, kind, text, pop in zip(ac.keys, ac.kinds, ac.texts, ac.popularity)}
+
+
+def test_autocomplete_follows_update_and_delete(monkeypatch):
+    rows = catalog_rows()
+    eng  = make_engine(monkeypatch, rows)
+    monkeypatch.setattr(eng, "rebuild_async", lambda: pytest.fail("ไม่ควร rebuild"))
+    names   = [r["name"] for r in rows]
+    deleted = next(r for r in rows if names.count(r["name"]) == 1 and "iacinamide" in r["ingredients_list"])
+    renamed = next(r for r in rows if names.count(r["name"]) == 1 and r is not deleted)
+    old_name = renamed["name"]
+    assert eng.autocomplete(deleted["name"], 20)[0] == {"text": deleted["name"], "type": "product"}
+
+    rows.remove(deleted)
+    renamed["name"] = "Zz Renamed Serum"
+    eng.catalog_version = 1
+    eng._apply_changes([
+        {"version": 2, "op": "UPDATE", "ids": [renamed["id"]]},
+        {"version": 3, "op": "DELETE", "ids": [deleted["id"]]},
+    ])
+
+    assert {"text": deleted["name"], "type": "product"} not in eng.autocomplete(deleted["name"], 20)
+    assert {"text": old_name, "type": "product"} not in eng.autocomplete(old_name, 20)
+    assert eng.autocomplete("zz renamed", 20) == [{"text": "Zz Renamed Serum", "type": "product"}]
+    # popularity (ชื่อ / brand / ingredient) เท่ากับ build ใหม่บน catalog ที่แก้แล้ว
+    fresh = make_engine(monkeypatch, rows)
+    assert _autocomplete_state(eng.snapshot.autocomplete) == _autocomplete_state(fresh.snapshot.autocomplete)
+
+
+def test_delete_during_rebuild_is_reapplied(monkeypatch):
+    rows = catalog_rows()
+    eng  = make_engine(monkeypatch, rows)
+    gone = rows[5]
+    db   = SlowCatalog(rows)                     # DB ตอนอ่าน ยังมี gone
+    monkeypatch.setattr(E, "get_all_products", db)
+
+    t = threading.Thread(target=eng.rebuild)
+    t.start()
+    assert db.reading.wait(10)
+    eng.add_products([], remove_ids={gone["id"]})
+    db.release.set()
+    t.join(10)
+
+    snap = eng.snapshot
+    assert gone["id"] not in set(snap.columns["id"][snap.alive].tolist())
+    assert eng.stats()["products"] == len(rows) - 1
+
+
+@pytest.mark.parametrize("event", [
+    {"version": 2, "op": "TRUNCATE", "ids": None},
+    {"version": 2, "op": "INSERT", "ids": None},               # เกิน 500 แถว
+])
+def test_apply_changes_rebuilds_otherwise(monkeypatch, event):
+    eng   = make_engine(monkeypatch, catalog_rows())
+    calls = []
+    monkeypatch.setattr(eng, "rebuild_async", lambda: calls.append(1))
+    eng.catalog_version = 1
+    eng._apply_changes([event])
+    assert calls == [1]
+    eng._apply_changes([dict(event, version=1)])              # ซ้ำ / เก่า → ไม่ทำอะไร
+    assert calls == [1]
+
+
+def test_rebuild_records_catalog_version(monkeypatch):
+    eng = make_engine(monkeypatch, catalog_rows())
+    updated_at = datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    monkeypatch.setattr(E, "get_catalog_version", lambda: (42, updated_at))
+    assert eng._read_catalog_version() == (42, f"42@{updated_at.isoformat()}")
+    assert eng.rebuild() is True
+    assert eng.catalog_version == 42 and eng.stats()["catalog_version"] == 42
+    monkeypatch.setattr(E, "get_catalog_version", lambda: 1 / 0)     # DB ล่ม → None
+    assert eng._read_catalog_version() == (None, None)
+
+
+# ================================================================
+# ARTIFACT CACHE
+# ================================================================
+def test_boot_from_artifact_matches_build(monkeypatch, expected):
+    rows  = catalog_rows()
+    built = make_engine(monkeypatch, rows)
+    monkeypatch.setattr(E.DataLoader, "_build_snapshot", lambda self, *a: pytest.fail("ควรโหลด artifact"))
+    loaded = make_engine(monkeypatch, rows)
+    assert loaded.artifact_key == built.artifact_key is not None
+    assert loaded.stats()["artifact"] == built.artifact_key
+    for case in expected["recommend"]:
+        profile = _profile(case)
+        assert _jsonable(loaded.recommend_products(top_n=case["top_n"], **profile)) == \
+               _jsonable(built.recommend_products(top_n=case["top_n"], **profile))
+
+
+def test_artifact_recomputes_is_new(monkeypatch):
+    # key เดียวกันทุก catalog → แถวที่ created_at ต่างจากตอน build ได้ artifact เดิม (เหมือน boot คนละวัน)
+    monkeypatch.setattr(E.ArtifactStore, "key", lambda self, rows, names: "fixed-key")
+    rows = catalog_rows()
+    assert not make_engine(monkeypatch, rows).snapshot.is_new.all()
+    monkeypatch.setattr(E.DataLoader, "_build_snapshot", lambda self, *a: pytest.fail("ควรโหลด artifact"))
+    eng  = make_engine(monkeypatch, [dict(r, created_at=datetime.now(timezone.utc)) for r in rows])
+    assert eng.artifact_key == "fixed-key"
+    assert eng.snapshot.is_new.all()
+
+
+def test_built_snapshot_is_memory_mapped(engine):
+    assert memmapped(engine.snapshot.concern_matrix)
+    assert memmapped(engine.snapshot.tfidf_matrix.data)
+    assert memmapped(engine.snapshot.fragments.data)
+    assert memmapped(engine.snapshot.search_index.postings.indices)
+
+
+def test_add_products_reopens_extended_artifact(monkeypatch):
+    rows = catalog_rows()
+    monkeypatch.setattr(E, "TFIDF_REFIT_DRIFT", 1.0)
+    eng  = make_engine(monkeypatch, rows[:-2])
+    base = eng.artifact_key
+    eng.add_products(rows[-2:])
+    key  = eng.artifacts.derived_key(base, rows[-2:])
+    assert eng.artifact_key == key
+    assert eng.artifacts.load(key) is None                  # ยังอยู่ใน memory จนกว่าจะ persist
+    assert not memmapped(eng.snapshot.tfidf_matrix.data)
+
+    assert eng.persist() is True
+    snap = eng.snapshot
+    assert memmapped(snap.tfidf_matrix.data) and memmapped(snap.concern_matrix) and memmapped(snap.price)
+    assert snap.created_at is not None and len(snap.created_at) == len(rows)
+    assert eng.persist() is False                            # ไม่มีอะไรค้างเขียน
+
+    # worker อื่นที่ได้ change เดียวกัน → โหลด artifact ที่เขียนไว้ ไม่เขียนซ้ำ
+    other = make_engine(monkeypatch, rows[:-2])
+    monkeypatch.setattr(E.ArtifactStore, "save", lambda *a, **k: pytest.fail("ควรโหลด artifact"))
+    other.add_products(rows[-2:])
+    assert other.persist() is True
+    assert other.artifact_key == eng.artifact_key
+    assert memmapped(other.snapshot.tfidf_matrix.data)
+    assert other.search_products(rows[-1]["name"].lower()) == eng.search_products(rows[-1]["name"].lower())
+
+
+def test_mask_only_change_is_not_persisted(monkeypatch):
+    rows = catalog_rows()
+    eng  = make_engine(monkeypatch, rows)
+    monkeypatch.setattr(E.ArtifactStore, "save", lambda *a, **k: pytest.fail("mask อย่างเดียวไม่ต้องเขียน"))
+    got  = eng.add_products([], remove_ids={rows[0]["id"]})
+    assert got["removed"] == 1
+    assert memmapped(eng.snapshot.tfidf_matrix.data)        # matrix ยังเป็นของ artifact เดิม
+    assert eng.persist() is False
+
+
+def test_persist_batches_adds_on_timer(monkeypatch):
+    rows  = catalog_rows()
+    monkeypatch.setattr(E, "TFIDF_REFIT_DRIFT", 1.0)
+    eng   = make_engine(monkeypatch, rows[:-3])
+    monkeypatch.setattr(E, "ARTIFACT_PERSIST_DELAY", 0.2)
+    saves = []
+    save  = E.ArtifactStore.save
+    monkeypatch.setattr(E.ArtifactStore, "save", lambda self, key, *a, **k: saves.append(key) or save(self, key, *a, **k))
+
+    eng.add_products([rows[-3]])
+    timer = eng._persist_timer
+    eng.add_products(rows[-2:])                              # ภายในช่วงรอ → timer เดิม
+    assert eng._persist_timer is timer
+    timer.join(10)
+    assert saves == [eng.artifact_key]
+    assert memmapped(eng.snapshot.tfidf_matrix.data) and len(eng.snapshot) == len(rows)
+
+
+def test_boot_with_db_down_uses_latest_artifact(monkeypatch):
+    eng = make_engine(monkeypatch, catalog_rows())
+    key = eng.artifact_key
+
+    def down():
+        raise ConnectionError("db down")
+
+    monkeypatch.setattr(E, "get_all_products", down)
+    booted = E.DataLoader()
+    assert booted.artifact_key == key and len(booted.snapshot) == len(eng.snapshot)
+    assert booted.catalog_version is None
+    # snapshot มีอยู่แล้ว → rebuild ที่ต่อ DB ไม่ได้ใช้ของเดิมต่อ
+    assert booted.rebuild() is False and booted.snapshot is not None
+
+
+def test_boot_with_same_stamp_skips_reading_products(monkeypatch):
+    eng = make_engine(monkeypatch, catalog_rows())
+    updated_at = datetime(2025, 1, 2, tzinfo=timezone.utc)
+    monkeypatch.setattr(E, "get_catalog_version", lambda: (7, updated_at))
+    assert eng.rebuild() is True               # เนื้อหาเดิม → mark stamp ใหม่ให้ artifact เดิม
+    assert eng.artifacts.find(f"7@{updated_at.isoformat()}") == eng.artifact_key
+
+    monkeypatch.setattr(E, "get_all_products", lambda: pytest.fail("stamp ตรง ไม่ต้องอ่าน products"))
+    booted = E.DataLoader()
+    assert booted.artifact_key == eng.artifact_key and booted.catalog_version == 7
+    assert len(booted.snapshot) == len(eng.snapshot)
+
+
+def test_artifact_key_ignores_db_row_order(monkeypatch):
+    rows = catalog_rows()
+    key  = make_engine(monkeypatch, rows).artifact_key
+    monkeypatch.setattr(E.DataLoader, "_build_snapshot", lambda self, *a: pytest.fail("ควรโหลด artifact"))
+    eng  = make_engine(monkeypatch, rows[::-1])
+    assert eng.artifact_key == key
+    assert eng.snapshot.columns["id"].tolist() == sorted(r["id"] for r in rows)
+
+
+def test_persist_stamps_derived_artifact(monkeypatch):
+    rows = catalog_rows()
+    monkeypatch.setattr(E, "TFIDF_REFIT_DRIFT", 1.0)
+    db   = rows[:-2]
+    eng  = make_engine(monkeypatch, db)
+    updated_at = datetime(2025, 1, 3, tzinfo=timezone.utc)
+    monkeypatch.setattr(E, "get_catalog_version", lambda: (6, updated_at))
+    db.extend(rows[-2:])
+    eng.catalog_version = 5
+    eng._apply_changes([{"version": 6, "op": "INSERT", "ids": [r["id"] for r in rows[-2:]]}])
+    assert eng.persist() is True
+    assert eng.artifacts.find(f"6@{updated_at.isoformat()}") == eng.artifact_key
+
+    monkeypatch.setattr(E, "get_all_products", lambda: pytest.fail("stamp ตรง ไม่ต้องอ่าน products"))
+    booted = E.DataLoader()
+    assert booted.artifact_key == eng.artifact_key and booted.catalog_version == 6
+    assert booted.stats()["products"] == len(rows)
+
+
+def test_persist_skips_stamp_when_db_is_ahead(monkeypatch):
+    rows = catalog_rows()
+    monkeypatch.setattr(E, "TFIDF_REFIT_DRIFT", 1.0)
+    eng  = make_engine(monkeypatch, rows[:-2])
+    updated_at = datetime(2025, 1, 4, tzinfo=timezone.utc)
+    monkeypatch.setattr(E, "get_catalog_version", lambda: (9, updated_at))
+    eng.catalog_version = 8
+    eng.add_products(rows[-2:])                 # route add — notification ของ version 9 ยังไม่มา
+    assert eng.persist() is True
+    assert eng.artifacts.find(f"9@{updated_at.isoformat()}") is None
+
+
+def test_warmup_loads_lazy_parts(engine):
+    engine.warmup_async().join(30)
+    assert engine.concern_model._model is not None
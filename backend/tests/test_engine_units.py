@@ -0,0 +1,332 @@
+"""
+unit test ของชิ้นส่วนใน ai_engine_v2 — ResultCache, cursor, Autocomplete, ArtifactStore
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from conftest import E, catalog_rows, memmapped
+
+
+# ================================================================
+# RESULT CACHE
+# ================================================================
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(E, "time", clock)
+    return clock
+
+
+def test_result_cache_hit_and_miss(clock):
+    cache = E.ResultCache(max_entries=4, ttl=60)
+    assert cache.get(1, "a") is None
+    cache.put(1, "a", [1, 2])
+    assert cache.get(1, "a") == [1, 2]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+
+
+def test_result_cache_new_version_drops_old_entries(clock):
+    cache = E.ResultCache(max_entries=4, ttl=60)
+    cache.put(1, "a", "old")
+    assert cache.get(2, "a") is None          # version ใหม่ไม่เห็น entry ของ version เก่า
+    cache.put(2, "b", "new")
+    assert cache.stats()["size"] == 1
+    assert cache.get(1, "a") is None          # put ของ version ใหม่ล้าง version เก่าทิ้ง
+    assert cache.get(2, "b") == "new"
+
+
+def test_result_cache_ttl(clock):
+    cache = E.ResultCache(max_entries=4, ttl=10)
+    cache.put(1, "a", "value")
+    clock.now += 10
+    assert cache.get(1, "a") == "value"
+    clock.now += 0.5
+    assert cache.get(1, "a") is None
+    assert cache.stats()["size"] == 0         # entry ที่หมดอายุถูกลบตอน get
+
+
+def test_result_cache_lru_eviction(clock):
+    cache = E.ResultCache(max_entries=2, ttl=60)
+    cache.put(1, "a", "A")
+    cache.put(1, "b", "B")
+    cache.get(1, "a")                          # a ใช้ล่าสุด → b ถูกไล่ออกก่อน
+    cache.put(1, "c", "C")
+    assert cache.get(1, "b") is None
+    assert cache.get(1, "a") == "A"
+    assert cache.get(1, "c") == "C"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_result_cache_disabled(clock):
+    cache = E.ResultCache(max_entries=0, ttl=60)
+    cache.put(1, "a", "A")
+    assert cache.get(1, "a") is None
+    assert cache.stats()["size"] == 0
+
+
+
+# ================================================================
+# CURSOR
+# ================================================================
+def test_cursor_round_trip():
+    for version, offset in [(1, 0), (7, 20), (123456, 99999)]:
+        assert E._decode_cursor(E._encode_cursor(version, offset)) == (version, offset)
+
+
+@pytest.mark.parametrize("cursor", [
+    "garbage", "", "!!!", E._encode_cursor(1, -5),
+    "MTp4",                                    # "1:x"
+    "MToyOjM=",                                # "1:2:3"
+    "bm90LWEtY3Vyc29y",                        # "not-a-cursor"
+    None,
+])
+def test_cursor_rejects_malformed(cursor):
+    with pytest.raises(ValueError):
+        E._decode_cursor(cursor)
+
+
+# ================================================================
+# AUTOCOMPLETE
+# ================================================================
+def _brute_suggest(entries: list, prefix: str, limit: int) -> list:
+    merged = {}
+    for text, kind, pop in entries:
+        key = (text.strip().lower(), kind)
+        merged.setdefault(key, [text.strip(), 0])[1] += pop
+    hits = sorted((-pop, key) for key, (_, pop) in merged.items() if key[0].startswith(prefix))
+    return [{"text": merged[key][0], "type": key[1]} for _, key in hits[:limit]]
+
+
+def test_autocomplete_merges_case_insensitive_duplicates():
+    ac = E.Autocomplete([("Serum A", "product", 1), ("serum a", "product", 2),
+                         ("Serum A", "brand", 1), ("  ", "product", 9), (None, "brand", 9)])
+    assert len(ac) == 2
+    assert ac.suggest("SER") == [{"text": "Serum A", "type": "product"},
+                                 {"text": "Serum A", "type": "brand"}]
+    assert ac.suggest("  ") == [] and ac.suggest("x") == []
+
+
+@pytest.mark.parametrize("precompute_len", [0, 2])
+def test_autocomplete_matches_brute_force(precompute_len):
+    rng   = np.random.default_rng(1)
+    words = ["cera", "cerave", "cream", "cosrx", "ceramide", "c", "niacinamide", "nivea"]
+    entries = [(w, kind, float(rng.integers(1, 5))) for w in words for kind in ("product", "brand")]
+    ac = E.Autocomplete(entries, max_limit=5, precompute_len=precompute_len)
+    for prefix in ("c", "ce", "cer", "n", "nia", "zz"):
+        for limit in (1, 3, 10):
+            assert ac.suggest(prefix, limit) == _brute_suggest(entries, prefix, min(limit, 5)), (prefix, limit)
+
+
+# ================================================================
+# USER PROFILE CODEC
+# ================================================================
+def test_concern_bits_round_trip():
+    assert E.encode_concern_bits([]) == 0
+    assert E.encode_concern_bits(["brightening", "acne_control", "acne_control", "nope"]) == \
+           1 << E.CONCERN_INDEX["acne_control"] | 1 << E.CONCERN_INDEX["brightening"]
+    for bits in (0, 1, 5, (1 << len(E.CONCERN_KEYS)) - 1):
+        assert E.encode_concern_bits(E.decode_concern_bits(bits)) == bits
+
+
+def test_profile_round_trip():
+    context = {dim: values[-1] for dim, values in E.CONTEXT_VALUES.items()}
+    profile = E.encode_profile("Oily", ["calming", "hydrating"], dict(context, unknown="x"))
+    assert profile["skin_type"] == "oily"
+    assert all(profile[f"{dim}_code"] == len(values) for dim, values in E.CONTEXT_VALUES.items())
+
+    user = E.decode_profile(dict(profile, user_id=3, email="a@b.c"))
+    assert (user["user_id"], user["email"], user["skin_type"]) == (3, "a@b.c", "oily")
+    assert sorted(user["concerns"]) == ["calming", "hydrating"]
+    assert user["context"] == context
+
+
+def test_profile_unknown_values_are_unset():
+    profile = E.encode_profile(None, None, {"age": "nope"})
+    assert profile["skin_type"] == "all" and profile["concern_bits"] == 0
+    assert profile["age_code"] == 0
+    assert E.decode_profile(dict(profile, age_code=99))["context"] == {}
+
+
+# ================================================================
+# INCREMENTAL INDEXES
+# ================================================================
+def test_search_index_extended_matches_rebuild():
+    names  = np.array(["Serum A", "Toner B", None, "Cream C"], dtype=object)
+    brands = np.array(["Acme", "Bee", "Acme", "Cee"], dtype=object)
+    base   = E.SearchIndex(names[:2], brands[:2])
+    ext    = base.extended(names[2:], brands[2:])
+    full   = E.SearchIndex(names, brands)
+    assert ext.names == full.names and ext.brands == full.brands
+    assert ext.grams.tolist() == full.grams.tolist()
+    assert (ext.postings != full.postings).nnz == 0
+    assert all(np.array_equal(ext.posting(g), full.posting(g)) for g in full.grams)
+    assert ext.posting("acm").tolist() == [0, 2] and ext.posting("zzz").tolist() == []
+    assert base.search("acme").tolist() == [0]          # index เดิมไม่ถูกแก้
+
+
+def test_packed_objects():
+    objs   = [{"a": (1, 2)}, None, "ข้อความ", {}]
+    packed = E.PackedObjects.pack(objs[:2]).extended(E.PackedObjects.pack(objs[2:]))
+    assert len(packed) == 4 and [packed[i] for i in range(4)] == objs
+    assert len(E.PackedObjects.pack([])) == 0
+
+
+def test_autocomplete_extended_adds_popularity():
+    ac  = E.Autocomplete([("Serum", "product", 1), ("Niacinamide", "ingredient", 2)])
+    ext = ac.extended([("serum", "product", 5), ("Sunscreen", "product", 3)])
+    assert ext.suggest("s") == [{"text": "Serum", "type": "product"},
+                                {"text": "Sunscreen", "type": "product"}]
+    assert ext.popularity[ext.keys.index("serum")] == 6
+    assert ext.ingredients() == ["Niacinamide"]
+    assert len(ac) == 2
+
+
+def test_autocomplete_drops_entries_without_products():
+    ac  = E.Autocomplete([("Serum", "product", 3), ("Acme", "brand", 5), ("Niacinamide", "ingredient", 1)])
+    ext = ac.extended([("serum", "product", -3), ("Acme", "brand", -3), ("Niacinamide", "ingredient", -1)])
+    assert ext.suggest("s") == []
+    assert ext.popularity[ext.keys.index("acme")] == 2
+    assert ext.ingredients() == ["Niacinamide"]         # ingredient คงไว้ถึง popularity เป็น 0
+
+
+# ================================================================
+# ARTIFACT STORE
+# ================================================================
+@pytest.fixture
+def saved(engine, tmp_path):
+    store = E.ArtifactStore(str(tmp_path), keep=2)
+    key   = store.key(catalog_rows(), ["Niacinamide"])
+    assert store.save(key, engine.snapshot.artifact(), stamp="7@2025-01-01")
+    return store, key
+
+
+def test_artifact_round_trip(engine, saved):
+    store, key = saved
+    loaded_key, parts = store.load(key)
+    assert loaded_key == key
+
+    snap     = engine.snapshot
+    original = snap.artifact()
+    for name in E.ArtifactStore.ARRAYS:
+        if original[name] is not None:
+            assert memmapped(parts[name]), name
+            assert np.array_equal(parts[name], original[name]), name
+    for name in E.ArtifactStore.MATRICES:
+        assert memmapped(parts[name].data), name
+        assert (parts[name] != original[name]).nnz == 0, name
+    for name in E.ArtifactStore.PACKED:
+        assert memmapped(parts[name].data) and memmapped(parts[name].offsets), name
+        assert parts[name][5] == original[name][5], name
+    # vectorizer unpickle ตอนใช้ครั้งแรก
+    assert isinstance(parts["vectorizer"], E.LazyPickle)
+    assert parts["vectorizer"].vocabulary_ == snap.vectorizer.vocabulary_
+
+    restored = E.CatalogSnapshot(**parts)
+    assert len(restored) == len(snap)
+    assert restored.row(3) == snap.row(3)
+    assert restored.search_index.search("serum").tolist() == snap.search_index.search("serum").tolist()
+
+
+def test_artifact_latest_and_prune(engine, saved, tmp_path):
+    store, key = saved
+    assert store.load()[0] == key              # ไม่ระบุ key → LATEST
+    for i in range(3):
+        assert store.save(f"k{i}", engine.snapshot.artifact())
+    assert store.load()[0] == "k2"
+    assert len(list(tmp_path.glob("catalog-*"))) == 2
+    assert not list(tmp_path.glob(".*.tmp"))
+    assert store.save("k2", engine.snapshot.artifact())      # key ที่มีแล้ว → ใช้ของเดิม
+
+
+def test_artifact_find_by_stamp(saved):
+    store, key = saved
+    assert store.find("7@2025-01-01") == key
+    assert store.find("8@2025-01-02") is None
+    store.mark(key, "8@2025-01-02")            # เนื้อหาเดิม catalog_version ใหม่
+    assert store.find("8@2025-01-02") == key
+    store.mark(key, None)                      # ไม่มี stamp → ไม่เปลี่ยน
+    assert store.find("8@2025-01-02") == key
+
+
+def test_artifact_key_depends_on_rows_and_ingredients():
+    store = E.ArtifactStore("")
+    rows  = [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}]
+    key   = store.key(rows, ["x"])
+    assert store.key([dict(r) for r in rows], ["x"]) == key
+    assert store.key(rows, ["y"]) != key
+    assert store.key([rows[0], dict(rows[1], name="c")], ["x"]) != key
+    assert key.endswith(store.model_version)
+
+
+def test_artifact_derived_key():
+    store = E.ArtifactStore("")
+    rows  = [{"id": 3, "name": "c"}]
+    key   = store.derived_key("base-1", rows)
+    assert store.derived_key("base-1", [dict(r) for r in rows]) == key
+    assert store.derived_key("base-2", rows) != key
+    assert store.derived_key("base-1", rows + [{"id": 4}]) != key
+
+
+def test_artifact_format_mismatch(saved, monkeypatch):
+    store, key = saved
+    monkeypatch.setattr(E, "ARTIFACT_FORMAT", E.ARTIFACT_FORMAT + 1)
+    assert store.load(key) is None
+
+
+def test_artifact_missing_or_corrupt(saved):
+    store, key = saved
+    assert store.load("nope") is None
+    (store._path(key) / store.OBJECTS).write_bytes(b"not a pickle")
+    assert store.load(key) is None
+
+
+def test_artifact_disabled():
+    store = E.ArtifactStore("")
+    assert not store.enabled
+    assert store.load() is None
+    assert store.save("k", {}) is False
+    with store.building():
+        pass
+
+
+@pytest.mark.skipif(E.fcntl is None, reason="ไม่มี fcntl")
+def test_artifact_building_holds_exclusive_lock(tmp_path):
+    store = E.ArtifactStore(str(tmp_path))
+    with store.building():
+        with open(tmp_path / ".build.lock") as f:
+            with pytest.raises(BlockingIOError):
+                E.fcntl.flock(f, E.fcntl.LOCK_EX | E.fcntl.LOCK_NB)
+    with open(tmp_path / ".build.lock") as f:
+        E.fcntl.flock(f, E.fcntl.LOCK_EX | E.fcntl.LOCK_NB)     # ปล่อยแล้ว
+
+
+def test_new_flags():
+    now = datetime.now(E.TZ_BANGKOK)
+    got = E._new_flags([now - timedelta(days=1), now - timedelta(days=8), None, "garbage"])
+    assert got.tolist() == [True, False, False, False]
+    # artifact เก็บ datetime64 (UTC) — ทางนี้ไม่ใช้ pandas
+    utc = np.array([np.datetime64(now.astimezone(E.timezone.utc).replace(tzinfo=None), "ns")
+                    - np.timedelta64(d, "D") for d in (0, 7, 8)] + [np.datetime64("NaT", "ns")])
+    assert E._new_flags(utc).tolist() == [True, True, False, False]
+
+
+def test_lazy_pickle():
+    import pickle
+    lazy = E.LazyPickle(pickle.dumps({"a": 1}))
+    assert lazy._obj is None
+    assert lazy.get() == {"a": 1} and lazy._blob is None
+    assert lazy.keys() == {"a": 1}.keys()          # attribute ส่งต่อให้ object จริง
+    assert pickle.loads(pickle.dumps(lazy)) == {"a": 1}
+    with pytest.raises(AttributeError):
+        lazy.__missing_dunder__
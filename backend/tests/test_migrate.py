@@ -0,0 +1,185 @@
+"""
+database/migrate.py — connection เป็น fake ที่เก็บ ledger ไว้ใน memory (ไม่ต้องต่อ Postgres)
+"""
+from unittest.mock import MagicMock
+
+import pytest
+
+import conftest  # noqa: F401 — เพิ่ม backend เข้า sys.path
+from database import db as D
+from database import migrate as M
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db   = db
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        self.rows = []
+        if sql is M.LEDGER_SQL:
+            self.db.ledger_created = True
+        elif sql.startswith("SELECT version, checksum FROM schema_migrations"):
+            self.rows = [(v, c) for v, (_, c) in self.db.ledger.items()]
+        elif "to_regclass" in sql:
+            self.rows = [(self.db.ledger_created,)]
+        elif "pg_advisory_xact_lock" in sql:
+            self.db.locks += 1
+        elif sql.startswith("SELECT 1 FROM schema_migrations"):
+            self.rows = [(1,)] if params[0] in self.db.ledger else []
+        elif sql.startswith("INSERT INTO schema_migrations"):
+            version, name, checksum, _ = params
+            self.db.pending.append(("ledger", version, (name, checksum)))
+        else:
+            if "FAIL" in sql:
+                raise RuntimeError("syntax error")
+            self.db.pending.append(("sql", sql, None))
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeDB:
+    def __init__(self):
+        self.ledger  = {}     # version → (name, checksum)
+        self.ledger_created = False
+        self.pending = []
+        self.applied = []     # sql ที่ commit แล้วตามลำดับ
+        self.locks   = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        for kind, a, b in self.pending:
+            if kind == "ledger":
+                self.ledger[a] = b
+            else:
+                self.applied.append(a)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDB()
+    monkeypatch.setattr(M, "get_connection", lambda: db)
+    return db
+
+
+@pytest.fixture
+def migrations(tmp_path):
+    (tmp_path / "001_baseline.sql").write_text("CREATE TABLE a ();", encoding="utf-8")
+    (tmp_path / "002_more.sql").write_text("CREATE TABLE b ();", encoding="utf-8")
+    (tmp_path / "notes.txt").write_text("ไม่ใช่ migration", encoding="utf-8")
+    return tmp_path
+
+
+def test_load_migrations_sorted(migrations):
+    (migrations / "README.sql").write_text("-- ชื่อผิดรูปแบบ", encoding="utf-8")
+    got = M.load_migrations(migrations)
+    assert [(m.version, m.name) for m in got] == [(1, "baseline"), (2, "more")]
+    assert repr(got[0]) == "001_baseline"
+
+
+def test_load_migrations_rejects_duplicate_versions(migrations):
+    (migrations / "002_other.sql").write_text("SELECT 1;", encoding="utf-8")
+    with pytest.raises(RuntimeError):
+        M.load_migrations(migrations)
+
+
+def test_shipped_migrations_are_numbered_in_order():
+    got = M.load_migrations()
+    assert [m.version for m in got] == list(range(1, len(got) + 1))
+
+
+def test_checksum_ignores_line_endings(tmp_path):
+    (tmp_path / "001_lf.sql").write_bytes(b"CREATE TABLE a ();\nSELECT 1;\n")
+    (tmp_path / "002_crlf.sql").write_bytes(b"CREATE TABLE a ();\r\nSELECT 1;\r\n")
+    lf, crlf = M.load_migrations(tmp_path)
+    assert lf.checksum == crlf.checksum
+
+
+def test_migrate_applies_pending_once(db, migrations):
+    assert [m.version for m in M.migrate(migrations)] == [1, 2]
+    assert db.applied == ["CREATE TABLE a ();", "CREATE TABLE b ();"]
+    assert sorted(db.ledger) == [1, 2]
+
+    locks = db.locks
+    assert M.migrate(migrations) == []          # ไม่มีค้าง → อ่าน ledger อย่างเดียว
+    assert db.locks == locks and len(db.applied) == 2
+
+    (migrations / "003_new.sql").write_text("CREATE TABLE c ();", encoding="utf-8")
+    assert [m.version for m in M.migrate(migrations)] == [3]
+    assert db.applied[-1] == "CREATE TABLE c ();"
+
+
+def test_migrate_skips_versions_applied_by_another_worker(db, migrations, monkeypatch):
+    pending = M._pending
+
+    def other_worker_applies_001(ms, applied):
+        # อีก worker apply 001 หลังเราอ่าน ledger — ต้องเช็คซ้ำหลังได้ lock
+        result = pending(ms, applied)
+        db.ledger[1] = ("baseline", ms[0].checksum)
+        return result
+
+    monkeypatch.setattr(M, "_pending", other_worker_applies_001)
+    assert [m.version for m in M.migrate(migrations)] == [2]
+    assert db.applied == ["CREATE TABLE b ();"]
+
+
+def test_migrate_failure_rolls_back_that_file(db, migrations):
+    (migrations / "002_more.sql").write_text("FAIL;", encoding="utf-8")
+    with pytest.raises(RuntimeError):
+        M.migrate(migrations)
+    assert sorted(db.ledger) == [1]              # 001 commit ไปแล้ว, 002 ไม่อยู่ใน ledger
+    assert db.applied == ["CREATE TABLE a ();"]
+
+
+def test_modified_migration_is_reported_not_rerun(db, migrations):
+    M.migrate(migrations)
+    (migrations / "001_baseline.sql").write_text("CREATE TABLE a (id INT);", encoding="utf-8")
+    assert M.migrate(migrations) == []
+    assert [(m.version, state) for m, state in M.status(migrations)] == [(1, "modified"), (2, "applied")]
+
+
+def test_status_before_ledger_exists(db, migrations):
+    assert [state for _, state in M.status(migrations)] == ["pending", "pending"]
+
+
+def test_migrate_keeps_callers_connection_open(migrations):
+    conn = MagicMock(wraps=FakeDB())
+    M.migrate(migrations, conn=conn)
+    conn.close.assert_not_called()
+
+
+def test_init_database_migrates_then_checks_products(monkeypatch):
+    calls = []
+    conn  = MagicMock()
+    conn.cursor.return_value.fetchone.return_value = (True,)
+    monkeypatch.setattr(M, "migrate", lambda conn: calls.append("migrate"))
+    monkeypatch.setattr(D, "get_connection", lambda: conn)
+    monkeypatch.setattr(D, "_import_products", lambda cur, conn: calls.append("import"))
+
+    assert D.init_database() is True
+    assert calls == ["migrate"]                  # มี products แล้ว → ไม่ import
+    sql = conn.cursor.return_value.execute.call_args.args[0]
+    assert "EXISTS" in sql and "COUNT" not in sql
+    conn.close.assert_called_once()
+
+
+def test_init_database_with_db_down(monkeypatch):
+    def down():
+        raise D.psycopg2.OperationalError("connection refused")
+
+    monkeypatch.setattr(D, "get_connection", down)
+    monkeypatch.setattr(M, "migrate", lambda conn: pytest.fail("migrate ไม่ควรถูกเรียก"))
+    assert D.init_database() is False
@@ -0,0 +1,87 @@
+"""
+notify_new_products.fan_out — stream_user_profiles อ่านจาก list ของ profile, connection เป็น fake
+"""
+import pytest
+
+from conftest import catalog_rows
+from test_engine import _random_users
+import notify_new_products as N
+from services.ai_engine_v2 import encode_profile
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.conn.log.append((sql, params))
+
+
+class FakeConn:
+    def __init__(self, profiles):
+        self.profiles = sorted(profiles, key=lambda r: r["user_id"])
+        self.log      = []
+        self.outbox   = []
+        self.streams  = []
+        self.commits  = 0
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def stream(self, pairs, chunk_size, after_user_id=0):
+        """แบบเดียวกับ repository.stream_user_profiles — keyset ตาม user_id"""
+        self.streams.append(after_user_id)
+        pairs = set(pairs)
+        rows  = [r for r in self.profiles
+                 if r["user_id"] > after_user_id and (r["skin_type"], r["concern_bits"]) in pairs]
+        for i in range(0, len(rows), chunk_size):
+            yield rows[i:i + chunk_size]
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    users = _random_users(300)
+    conn  = FakeConn([dict(encode_profile(u["skin_type"], u["concerns"], u["context"]),
+                           user_id=u["user_id"] + 1) for u in users])
+    monkeypatch.setattr(N, "get_profile_skin_types",
+                        lambda: sorted({r["skin_type"] for r in conn.profiles}))
+    monkeypatch.setattr(N, "stream_user_profiles", conn.stream)
+    monkeypatch.setattr(N, "execute_values",
+                        lambda cur, sql, rows: conn.outbox.extend(rows))
+    return conn
+
+
+def _checkpoints(conn) -> list:
+    return [params[0] for sql, params in conn.log if "SET last_user_id" in sql]
+
+
+def test_fan_out_writes_matches_and_checkpoints(engine, conn):
+    product = dict(catalog_rows()[10], last_user_id=0)
+    total   = N.fan_out(engine, conn, product, 0.2, chunk_size=40)
+
+    users = [N.decode_profile(r) for r in conn.profiles]
+    want  = {(m["user_id"], m["score"]) for m in engine.find_matching_users(product, users, 0.2)}
+    assert total == len(conn.outbox) == len(want)
+    assert {(uid, score) for _, uid, score in conn.outbox} == want
+
+    checkpoints = _checkpoints(conn)
+    assert checkpoints == sorted(checkpoints) and len(checkpoints) > 1
+    assert "SET done = TRUE" in conn.log[-1][0]
+
+
+def test_fan_out_resumes_after_last_user_id(engine, conn):
+    product = dict(catalog_rows()[10], last_user_id=150)
+    N.fan_out(engine, conn, product, 0.2, chunk_size=40)
+    assert conn.streams == [150]
+    assert conn.outbox and all(uid > 150 for _, uid, _ in conn.outbox)
+
+
+def test_fan_out_without_candidates_marks_done(engine, conn):
+    product = dict(catalog_rows()[10], last_user_id=0)
+    N.fan_out(engine, conn, product, 2.0, chunk_size=40)      # threshold เกิน score สูงสุด
+    assert conn.outbox == [] and _checkpoints(conn) == []
+    assert conn.streams == []
+    assert "SET done = TRUE" in conn.log[-1][0]
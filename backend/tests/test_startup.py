@@ -0,0 +1,39 @@
+"""
+services/startup.py — phase รันครั้งเดียวต่อ process และจับเวลา
+"""
+import conftest  # noqa: F401 — เพิ่ม backend เข้า sys.path
+from services.startup import Startup
+
+
+def test_run_once_and_report():
+    startup = Startup()
+    calls   = []
+    assert startup.run("engine", lambda x: calls.append(x) or "ok", 1) == "ok"
+    assert startup.run("engine", lambda x: calls.append(x) or "again", 2) == "ok"
+    assert calls == [1]
+
+    startup.mark("imports")
+    startup.mark("imports")
+    startup.ready()
+    startup.first_request()
+    first = startup.first_request_ms
+    startup.first_request()
+
+    report = startup.report()
+    assert list(report["phases"]) == ["engine", "imports"]
+    assert all(ms >= 0 for ms in report["phases"].values())
+    assert report["ready_ms"] is not None and report["first_request_ms"] == first
+
+
+def test_phase_error_is_not_cached():
+    startup = Startup()
+
+    def boom():
+        raise RuntimeError("db down")
+
+    try:
+        startup.run("schema", boom)
+    except RuntimeError:
+        pass
+    assert "schema" not in startup.phases
+    assert startup.run("schema", lambda: "ok") == "ok"
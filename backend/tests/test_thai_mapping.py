@@ -0,0 +1,41 @@
+import pytest
+
+from services.thai_mapping import match_phrases, parse_thai_input
+
+
+def test_match_phrases_longest_match():
+    # "หน้ามัน" ยาวกว่า "มัน", "สิวอุดตัน" ยาวกว่า "สิว"
+    assert match_phrases("หน้ามันสิวอุดตัน") == [
+        ("หน้ามัน", {"skin_type": "oily"}),
+        ("สิวอุดตัน", {"concern": "acne_control"}),
+    ]
+
+
+def test_match_phrases_space_inside_phrase():
+    assert match_phrases("ผิว แห้ง") == [("ผิว แห้ง", {"skin_type": "dry"})]
+
+
+def test_match_phrases_phrase_in_several_maps():
+    # "ผิวแดง" อยู่ทั้ง SKINTYPE_MAP และ CONCERN_MAP
+    assert match_phrases("ผิวแดง") == [("ผิวแดง", {"skin_type": "sensitive", "concern": "calming"})]
+
+
+def test_match_phrases_case_insensitive():
+    assert match_phrases("SPF 50") == [("spf", {"category": "sunscreen"})]
+
+
+def test_match_phrases_no_match():
+    assert match_phrases("hello world") == []
+    assert match_phrases("") == []
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("หน้ามันเป็นสิวอยากได้เซรั่ม",      ("oily", ["acne_control"], "serum")),
+    ("หน้ามัน สิว",                     ("oily", ["acne_control"], "")),
+    ("ผิวแห้ง ขาดความชุ่มชื้น เซรั่ม",    ("dry", ["hydrating"], "serum")),
+    ("ฝ้า กระ ริ้วรอย กันแดด",           ("", ["brightening", "anti_aging"], "sunscreen")),
+    ("ผิวแพ้ง่าย ผิวแดง ครีมบำรุง",      ("sensitive", ["calming"], "moisturizer")),
+    ("อยากได้ของดีๆ",                   ("", [], "")),
+])
+def test_parse_thai_input(text, expected):
+    assert parse_thai_input(text) == expected
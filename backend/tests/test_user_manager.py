@@ -0,0 +1,43 @@
+"""
+services/user_manager.py — get_connection เป็น mock (ไม่ต้องต่อ DB)
+"""
+from unittest.mock import MagicMock
+
+import pytest
+
+import conftest  # noqa: F401 — เพิ่ม backend เข้า sys.path
+from services import user_manager as UM
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    conn = MagicMock()
+    monkeypatch.setattr(UM, "get_connection", lambda: conn)
+    return conn
+
+
+def test_add_history_upserts_profile_in_same_transaction(conn):
+    UM.UserManager().add_history("a@b.c", "oily", ["acne_control"], [{"name": "x"}],
+                                 profile={"skin_type": "oily", "concern_bits": 3})
+    calls = conn.cursor.return_value.execute.call_args_list
+    assert len(calls) == 2 and "INSERT INTO history" in calls[0].args[0]
+    sql, params = calls[1].args
+    assert "INSERT INTO user_profiles (user_id, skin_type, concern_bits)" in sql
+    assert "ON CONFLICT (user_id) DO UPDATE" in sql
+    assert params == ["oily", 3, "a@b.c"]
+    conn.commit.assert_called_once()
+    conn.close.assert_called_once()
+
+
+def test_add_history_without_profile(conn):
+    UM.UserManager().add_history("a@b.c", "oily", [], [])
+    assert conn.cursor.return_value.execute.call_count == 1
+    conn.commit.assert_called_once()
+
+
+def test_add_history_rolls_back_both_on_error(conn):
+    conn.cursor.return_value.execute.side_effect = [None, Exception("boom")]
+    UM.UserManager().add_history("a@b.c", "oily", [], [], profile={"skin_type": "oily"})
+    conn.commit.assert_not_called()
+    conn.rollback.assert_called_once()
+    conn.close.assert_called_once()